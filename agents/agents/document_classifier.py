@@ -8,6 +8,8 @@ from typing import Dict, Any, Callable, List
 from openai import AsyncOpenAI
 from datetime import datetime
 from dotenv import load_dotenv
+from services.llm import create_chat_completion, measure_parse, record_parse_failure
+from services.tracing import start_span
 
 # Load environment variables
 load_dotenv()
@@ -56,13 +58,15 @@ class DocumentClassifierAgent:
         await progress_callback(20, "Preparing classification prompt...")
         
         # Build the classification prompt
-        prompt = self._build_classification_prompt(document_content, document_type, context)
+        with start_span("prompt.build", agent_type="document_classifier"):
+            prompt = self._build_classification_prompt(document_content, document_type, context)
         
         await progress_callback(40, "Calling OpenAI API for document analysis...")
         
         try:
             # Call OpenAI API
-            response = await self.client.chat.completions.create(
+            response = await create_chat_completion(
+                self.client, "document_classifier",
                 model=self.model,
                 messages=[
                     {
@@ -82,7 +86,8 @@ class DocumentClassifierAgent:
             
             # Parse the response
             ai_response = response.choices[0].message.content
-            classification_data = self._parse_classification_response(ai_response)
+            with measure_parse("document_classifier"):
+                classification_data = self._parse_classification_response(ai_response)
             
             await progress_callback(90, "Finalizing classification...")
             
@@ -222,10 +227,12 @@ Fokuser på nøyaktighet og gi praktiske forslag basert på norsk forretningspra
                 
                 return result
             else:
+                record_parse_failure("document_classifier")
                 return self._fallback_classification()
                 
         except (json.JSONDecodeError, KeyError) as e:
             # Fallback to basic classification
+            record_parse_failure("document_classifier")
             return self._fallback_classification()
     
     def _fallback_classification(self) -> Dict[str, Any]:
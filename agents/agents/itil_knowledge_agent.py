@@ -3,9 +3,13 @@ ITIL Knowledge Agent for Epic 4 - Story 4.2
 Provides access to ITIL 4 knowledge base for AI-enhanced process generation
 """
 import os
-import json
 from typing import Dict, Any, List, Optional
 from pathlib import Path
+from services.knowledge_base import get_knowledge_base
+from services.retrieval import get_itil_index, expand_query
+from services.practice_index import get_practice_index
+from services.practice_classifier import get_practice_classifier
+from services.compliance_rules import get_compliance_rules
 
 
 class ITILKnowledgeAgent:
@@ -15,17 +19,23 @@ class ITILKnowledgeAgent:
         # Path to ITIL knowledge base
         self.knowledge_base_path = Path(__file__).parent.parent.parent / "data" / "itil"
         
-        # Cache for loaded knowledge
-        self._knowledge_cache = {}
-        
-        # Initialize knowledge areas
-        self.itil_areas = [
-            "service-strategy",
-            "service-design", 
-            "service-transition",
-            "service-operation",
-            "continual-service-improvement"
-        ]
+        # Build the practice index at startup rather than on the first request
+        get_practice_index(self.knowledge_base)
+    
+    @property
+    def knowledge_base(self):
+        """Compiled knowledge-base snapshot: the one pinned for the running job, else the latest"""
+        return get_knowledge_base()
+    
+    @property
+    def practice_index(self):
+        """Practice name/alias/area index of the current knowledge-base version"""
+        return get_practice_index(self.knowledge_base)
+    
+    @property
+    def itil_areas(self) -> List[str]:
+        """ITIL areas that have at least one practice in the knowledge base"""
+        return self.practice_index.areas
         
     def get_service_value_system(self) -> Dict[str, Any]:
         """Get ITIL 4 Service Value System information"""
@@ -41,14 +51,19 @@ class ITILKnowledgeAgent:
         svs = self.get_service_value_system()
         return svs.get("components", {}).get("service_value_chain", {}).get("activities", [])
     
+    def find_practice(self, practice_name: str, itil_area: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Resolve a practice name, alias or near-miss spelling to its name, area and aliases"""
+        entry = self.practice_index.find(practice_name, itil_area)
+        return entry.to_dict() if entry else None
+    
+    def classify_practice(self, title: str, description: str = "", limit: int = 3) -> List[Dict[str, Any]]:
+        """Practices a request is most likely about, ranked, with confidence and matched terms"""
+        return get_practice_classifier(self.knowledge_base).classify(title, description, limit)
+    
     def get_practice_knowledge(self, practice_name: str, itil_area: str) -> Optional[Dict[str, Any]]:
         """Get detailed knowledge about a specific ITIL practice"""
-        filename = f"{practice_name.lower().replace(' ', '-').replace('(', '').replace(')', '')}.json"
-        file_path = self.knowledge_base_path / itil_area / filename
-        
-        if file_path.exists():
-            return self._load_knowledge_file(f"{itil_area}/{filename}")
-        return None
+        entry = self.practice_index.find(practice_name, itil_area)
+        return entry.knowledge if entry else None
     
     def get_incident_management_knowledge(self) -> Dict[str, Any]:
         """Get comprehensive incident management knowledge"""
@@ -72,7 +87,14 @@ class ITILKnowledgeAgent:
         knowledge = self.get_practice_knowledge(practice_name, itil_area)
         return knowledge.get("key_metrics", []) if knowledge else []
     
-    def generate_itil_process_context(self, process_type: str, itil_area: str) -> Dict[str, Any]:
+    def search_knowledge(self, query: str, top_k: int = 8, practice: Optional[str] = None) -> List[Dict[str, Any]]:
+        """BM25 search over all ITIL passages; passages from `practice` are ranked higher"""
+        index = get_itil_index(self.knowledge_base)
+        boost = {practice: 1.5} if practice else None
+        return index.search(expand_query(query), k=top_k, boost=boost, min_relative_score=0.3)
+    
+    def generate_itil_process_context(self, process_type: Optional[str], itil_area: str, query: str = "",
+                                      top_k: Optional[int] = None) -> Dict[str, Any]:
         """Generate comprehensive ITIL context for AI process generation"""
         
         # Get general ITIL context
@@ -80,8 +102,8 @@ class ITILKnowledgeAgent:
         guiding_principles = self.get_guiding_principles()
         value_chain = self.get_service_value_chain_activities()
         
-        # Get specific practice knowledge
-        practice_knowledge = self.get_practice_knowledge(process_type, itil_area)
+        # Get specific practice knowledge (none when the practice could not be determined)
+        practice_knowledge = self.get_practice_knowledge(process_type, itil_area) if process_type else None
         
         context = {
             "itil_version": "ITIL 4",
@@ -115,6 +137,11 @@ class ITILKnowledgeAgent:
             }
         }
         
+        # Passages most relevant to the request, used in prompts instead of whole practice sections
+        if query:
+            top_k = top_k or int(os.getenv("ITIL_CONTEXT_TOP_K", "6"))
+            context["relevant_passages"] = self.search_knowledge(query, top_k, practice=process_type)
+        
         return context
     
     def get_process_template_suggestions(self, process_type: str, itil_area: str) -> List[Dict[str, Any]]:
@@ -143,48 +170,20 @@ class ITILKnowledgeAgent:
         return suggestions
     
     def validate_process_against_itil(self, process_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Validate a process against ITIL best practices"""
-        validation_results = {
-            "compliance_score": 0,
-            "compliance_checks": [],
-            "recommendations": [],
-            "missing_elements": []
-        }
-        
-        # Check for ITIL alignment
-        checks = [
-            self._check_guiding_principles_alignment(process_data),
-            self._check_value_chain_alignment(process_data), 
-            self._check_role_clarity(process_data),
-            self._check_metric_inclusion(process_data),
-            self._check_norwegian_context(process_data)
-        ]
-        
-        validation_results["compliance_checks"] = checks
-        validation_results["compliance_score"] = sum(check["score"] for check in checks) / len(checks)
-        
-        # Generate recommendations
-        for check in checks:
-            if check["score"] < 0.8:
-                validation_results["recommendations"].append(check["recommendation"])
-                
-        return validation_results
+        """Validate a process against ITIL best practices (rules in data/itil/compliance-rules.json)"""
+        return get_compliance_rules(self.knowledge_base).validate(process_data)
+    
+    def validate_processes(self, processes: List[Dict[str, Any]], include_results: bool = False) -> Dict[str, Any]:
+        """Portfolio-wide compliance scoring of many processes"""
+        return get_compliance_rules(self.knowledge_base).validate_batch(processes, include_results)
     
     def _load_knowledge_file(self, filename: str) -> Dict[str, Any]:
-        """Load knowledge from JSON file with caching"""
-        if filename in self._knowledge_cache:
-            return self._knowledge_cache[filename]
-            
-        file_path = self.knowledge_base_path / filename
-        
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                knowledge = json.load(f)
-                self._knowledge_cache[filename] = knowledge
-                return knowledge
-        except (FileNotFoundError, json.JSONDecodeError) as e:
-            print(f"Warning: Could not load ITIL knowledge file {filename}: {e}")
+        """Load knowledge from the shared snapshot (decoded once per process)"""
+        knowledge = self.knowledge_base.get(f"itil/{filename}")
+        if knowledge is None:
+            print(f"Warning: Could not load ITIL knowledge file {filename}: not in knowledge base snapshot")
             return {}
+        return knowledge
     
     def _estimate_duration(self, activity: Dict[str, Any]) -> int:
         """Estimate duration for an activity based on complexity"""
@@ -234,94 +233,3 @@ class ITILKnowledgeAgent:
             return "Document"
         else:
             return "Task"
-    
-    def _check_guiding_principles_alignment(self, process_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Check alignment with ITIL guiding principles"""
-        score = 0.7  # Base score
-        recommendation = "Ensure process aligns with ITIL 4 guiding principles"
-        
-        # Check for value focus
-        if "value" in process_data.get("description", "").lower():
-            score += 0.1
-            
-        # Check for iterative approach
-        steps = process_data.get("steps", [])
-        if len(steps) > 3:  # Broken into manageable steps
-            score += 0.1
-            
-        # Check for collaboration indicators
-        roles = [step.get("responsible_role", "") for step in steps]
-        if len(set(roles)) > 1:  # Multiple roles involved
-            score += 0.1
-            
-        return {
-            "check_name": "Guiding Principles Alignment",
-            "score": min(score, 1.0),
-            "recommendation": recommendation
-        }
-    
-    def _check_value_chain_alignment(self, process_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Check alignment with Service Value Chain"""
-        score = 0.8  # Base score
-        recommendation = "Align process activities with Service Value Chain"
-        
-        # Basic alignment check - more sophisticated logic could be implemented
-        return {
-            "check_name": "Value Chain Alignment", 
-            "score": score,
-            "recommendation": recommendation
-        }
-    
-    def _check_role_clarity(self, process_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Check for clear role assignments"""
-        score = 0.6
-        recommendation = "Ensure clear role assignments for all process steps"
-        
-        steps = process_data.get("steps", [])
-        steps_with_roles = [step for step in steps if step.get("responsible_role")]
-        
-        if steps and len(steps_with_roles) == len(steps):
-            score = 1.0
-            recommendation = "Role assignments are complete"
-            
-        return {
-            "check_name": "Role Clarity",
-            "score": score,
-            "recommendation": recommendation
-        }
-    
-    def _check_metric_inclusion(self, process_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Check for inclusion of relevant metrics"""
-        score = 0.5
-        recommendation = "Include relevant KPIs and metrics for process measurement"
-        
-        # Check if metrics are mentioned in description or steps
-        text_content = f"{process_data.get('description', '')} {' '.join([step.get('description', '') for step in process_data.get('steps', [])])}"
-        
-        metric_keywords = ["metric", "kpi", "measure", "time", "satisfaction", "resolution"]
-        if any(keyword in text_content.lower() for keyword in metric_keywords):
-            score = 0.8
-            
-        return {
-            "check_name": "Metrics Inclusion",
-            "score": score, 
-            "recommendation": recommendation
-        }
-    
-    def _check_norwegian_context(self, process_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Check for Norwegian business context considerations"""
-        score = 0.7
-        recommendation = "Include Norwegian business context and language considerations"
-        
-        # Check for Norwegian language or cultural considerations
-        text_content = f"{process_data.get('description', '')} {' '.join([step.get('description', '') for step in process_data.get('steps', [])])}"
-        
-        norwegian_indicators = ["norsk", "norge", "gdpr", "personvern"]
-        if any(indicator in text_content.lower() for indicator in norwegian_indicators):
-            score = 0.9
-            
-        return {
-            "check_name": "Norwegian Context",
-            "score": score,
-            "recommendation": recommendation
-        }
\ No newline at end of file
@@ -4,25 +4,32 @@ Enhanced with ITIL 4 knowledge base integration for Epic 4
 """
 import os
 import json
+import time
+import asyncio
+import logging
 from typing import Dict, Any, List, Callable, Optional
 from openai import AsyncOpenAI
 from datetime import datetime
 from dotenv import load_dotenv
 from .itil_knowledge_agent import ITILKnowledgeAgent
+from services.llm import create_chat_completion, measure_parse, record_parse_failure
+from services.tracing import start_span
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 class ProcessGeneratorAgent:
     """AI Agent that generates new business processes based on requirements"""
     
-    def __init__(self):
+    def __init__(self, client: Optional[AsyncOpenAI] = None):
         api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
+        if client is None and not api_key:
             raise ValueError("OPENAI_API_KEY environment variable must be set")
         
-        self.client = AsyncOpenAI(api_key=api_key)
+        self.client = client or AsyncOpenAI(api_key=api_key)
         self.model = os.getenv("OPENAI_MODEL", "gpt-4")
         
         # Initialize ITIL knowledge agent for Epic 4
@@ -42,22 +49,29 @@ class ProcessGeneratorAgent:
         title = request_data.get("title", "")
         description = request_data.get("description", "")
         category = request_data.get("category", "")
-        requirements = request_data.get("requirements", [])
+        requirements = request_data.get("requirements") or []
         target_audience = request_data.get("target_audience", "")
         complexity_level = request_data.get("complexity_level", "medium")
         
+        if (request_data.get("generation_mode") or os.getenv("PROCESS_GENERATION_MODE", "single")) == "outline":
+            return await self._generate_outline_then_expand(
+                title, description, category, requirements, target_audience, complexity_level, progress_callback
+            )
+        
         await progress_callback(20, "Preparing AI prompt...")
         
         # Build the prompt
-        prompt = self._build_generation_prompt(
-            title, description, category, requirements, target_audience, complexity_level
-        )
+        with start_span("prompt.build", agent_type="process_generator"):
+            prompt = self._build_generation_prompt(
+                title, description, category, requirements, target_audience, complexity_level
+            )
         
         await progress_callback(30, "Calling OpenAI API...")
         
         try:
             # Call OpenAI API
-            response = await self.client.chat.completions.create(
+            response = await create_chat_completion(
+                self.client, "process_generator",
                 model=self.model,
                 messages=[
                     {
@@ -77,7 +91,8 @@ class ProcessGeneratorAgent:
             
             # Parse the response
             ai_response = response.choices[0].message.content
-            process_data = self._parse_ai_response(ai_response)
+            with measure_parse("process_generator"):
+                process_data = self._parse_ai_response(ai_response)
             
             await progress_callback(90, "Structuring process data...")
             
@@ -109,39 +124,186 @@ class ProcessGeneratorAgent:
         except Exception as e:
             raise Exception(f"Failed to generate process: {str(e)}")
     
+    async def _generate_outline_then_expand(self, title: str, description: str, category: str,
+                                            requirements: List[str], target_audience: str, complexity_level: str,
+                                            progress_callback: Callable[[int, str], None]) -> Dict[str, Any]:
+        """
+        Two-phase generation: one short call for the outline, then one call per step, run
+        concurrently under the shared rate limiter and merged in outline order
+        """
+        started = time.perf_counter()
+        await progress_callback(20, "Outlining process...")
+        
+        try:
+            with start_span("prompt.build", agent_type="process_outline"):
+                prompt = self._build_outline_prompt(
+                    title, description, category, requirements, target_audience, complexity_level
+                )
+            response = await create_chat_completion(
+                self.client, "process_outline",
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": "You are an expert business process designer. You outline structured, practical business processes."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.7,
+                max_tokens=int(os.getenv("PROCESS_OUTLINE_MAX_TOKENS", "800"))
+            )
+            with measure_parse("process_outline"):
+                outline = self._parse_ai_response(response.choices[0].message.content, "process_outline")
+        except Exception as e:
+            raise Exception(f"Failed to generate process outline: {str(e)}")
+        
+        outline_steps = [step for step in outline.get("steps", []) if step.get("title")]
+        if not outline_steps:
+            raise Exception("Failed to generate process outline: the outline has no steps")
+        outline_seconds = time.perf_counter() - started
+        responses = [response]
+        
+        await progress_callback(35, f"Expanding {len(outline_steps)} steps...")
+        
+        completed = 0
+        
+        async def expand(index: int, step: Dict[str, Any]):
+            nonlocal completed
+            started_step = time.perf_counter()
+            try:
+                step_response = await create_chat_completion(
+                    self.client, "process_step",
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": "You are an expert business process designer. You write precise, practical process steps."},
+                        {"role": "user", "content": self._build_step_expansion_prompt(
+                            outline.get("title", title), outline.get("description", description), outline_steps, index
+                        )}
+                    ],
+                    temperature=0.5,
+                    max_tokens=int(os.getenv("PROCESS_STEP_MAX_TOKENS", "500"))
+                )
+                responses.append(step_response)
+                content = step_response.choices[0].message.content or ""
+                with measure_parse("process_step"):
+                    detail = json.loads(content[content.find('{'):content.rfind('}') + 1])
+            except json.JSONDecodeError:
+                record_parse_failure("process_step")
+                detail = {}
+            except Exception as e:
+                # A failed expansion keeps the outline's version of the step instead of failing the job
+                logger.warning("Could not expand process step; keeping the outline step",
+                               extra={"step": index + 1, "step_title": step["title"], "error": str(e)})
+                detail = {}
+            completed += 1
+            await progress_callback(35 + 55 * completed // len(outline_steps), f"Expanded {completed}/{len(outline_steps)} steps")
+            return detail, time.perf_counter() - started_step
+        
+        expansions = await asyncio.gather(*(expand(index, step) for index, step in enumerate(outline_steps)))
+        
+        steps = []
+        for index, (step, (detail, _)) in enumerate(zip(outline_steps, expansions), 1):
+            steps.append({
+                "title": step["title"],
+                "description": detail.get("description") or step.get("summary") or step["title"],
+                "type": step.get("type", "Task"),
+                "responsible_role": step.get("responsible_role", "Team Member"),
+                "estimated_duration": step.get("estimated_duration", 15),
+                "order_index": index,
+                "is_optional": step.get("is_optional", False),
+                "detailed_instructions": detail.get("detailed_instructions") or f"Complete the task: {step['title']}",
+                "prerequisites": detail.get("prerequisites", [])
+            })
+        
+        usages = [getattr(item, "usage", None) for item in responses]
+        result = {
+            "title": outline.get("title", title),
+            "description": outline.get("description", description),
+            "category": category,
+            "steps": steps,
+            "estimated_duration": outline.get("estimated_duration") or sum(step["estimated_duration"] or 0 for step in steps),
+            "tags": outline.get("tags", []),
+            "metadata": {
+                "ai_generated": True,
+                "generation_model": self.model,
+                "generated_at": datetime.utcnow().isoformat(),
+                "confidence_score": 0.85,
+                "generation": {
+                    "mode": "outline",
+                    "latency_ms": int((time.perf_counter() - started) * 1000),
+                    "outline_ms": int(outline_seconds * 1000),
+                    "slowest_step_ms": int(max(seconds for _, seconds in expansions) * 1000),
+                    "calls": len(responses),
+                    "failed_steps": sum(1 for detail, _ in expansions if not detail),
+                    "prompt_tokens": sum(getattr(usage, "prompt_tokens", 0) or 0 for usage in usages),
+                    "completion_tokens": sum(getattr(usage, "completion_tokens", 0) or 0 for usage in usages)
+                },
+                "original_request": {
+                    "title": title,
+                    "description": description,
+                    "category": category,
+                    "complexity_level": complexity_level
+                }
+            }
+        }
+        
+        await progress_callback(100, "Process generation completed")
+        return result
+    
     async def generate_itil_process(self, request_data: Dict[str, Any], progress_callback: Callable[[int, str], None]) -> Dict[str, Any]:
         """
         Generate a new process with ITIL 4 knowledge integration (Epic 4)
         """
         await progress_callback(5, "Initializing ITIL-enhanced generation...")
+        started = time.perf_counter()
         
         # Extract request parameters
         title = request_data.get("title", "")
         description = request_data.get("description", "")
         category = request_data.get("category", "")
         itil_area = request_data.get("itil_area", "")
-        requirements = request_data.get("requirements", [])
+        requirements = request_data.get("requirements") or []
         target_audience = request_data.get("target_audience", "")
         complexity_level = request_data.get("complexity_level", "medium")
+        generation_mode = request_data.get("generation_mode") or os.getenv("ITIL_GENERATION_MODE", "full")
         
         await progress_callback(15, "Loading ITIL knowledge base...")
         
         # Get ITIL context if available
         itil_context = {}
+        process_candidates = []
+        process_type = None
         if self.itil_agent and itil_area:
-            # Determine process type from title
-            process_type = self._determine_itil_process_type(title, description)
-            itil_context = self.itil_agent.generate_itil_process_context(process_type, itil_area.lower().replace(" ", "-"))
+            # Rank ITIL practices by the vocabulary found in the title and description
+            process_candidates = self.itil_agent.classify_practice(title, description)
+            process_type = process_candidates[0]["practice"] if process_candidates else None
+            query = " ".join([title, description, *requirements])
+            with start_span("itil.context", itil_area=itil_area, process_type=process_type or ""):
+                itil_context = self.itil_agent.generate_itil_process_context(
+                    process_type, itil_area.lower().replace(" ", "-"), query=query
+                )
             
             await progress_callback(25, f"Loaded ITIL context for {itil_area}...")
         
+        # Template-first: steps come from the practice's activities, the model only refines them
+        skeleton = []
+        if generation_mode == "template" and self.itil_agent and process_type:
+            skeleton = self.itil_agent.get_process_template_suggestions(
+                process_type, itil_area.lower().replace(" ", "-")
+            )
+        agent_type = "itil_process_template" if skeleton else "itil_process_generator"
+        max_tokens = int(os.getenv("ITIL_TEMPLATE_MAX_TOKENS", "1200")) if skeleton else 3000
+        
         await progress_callback(35, "Building ITIL-enhanced prompt...")
         
         # Build enhanced prompt with ITIL knowledge
-        prompt = self._build_itil_enhanced_prompt(
-            title, description, category, itil_area, requirements, 
-            target_audience, complexity_level, itil_context
-        )
+        with start_span("prompt.build", agent_type=agent_type):
+            if skeleton:
+                prompt = self._build_template_refinement_prompt(
+                    title, description, itil_area, requirements, target_audience, complexity_level, skeleton
+                )
+            else:
+                prompt = self._build_itil_enhanced_prompt(
+                    title, description, category, itil_area, requirements, 
+                    target_audience, complexity_level, itil_context
+                )
         
         await progress_callback(45, "Calling OpenAI API with ITIL context...")
         
@@ -149,7 +311,8 @@ class ProcessGeneratorAgent:
             # Call OpenAI API with enhanced system message
             system_message = self._build_itil_system_message(itil_context)
             
-            response = await self.client.chat.completions.create(
+            response = await create_chat_completion(
+                self.client, agent_type,
                 model=self.model,
                 messages=[
                     {
@@ -162,25 +325,29 @@ class ProcessGeneratorAgent:
                     }
                 ],
                 temperature=0.7,
-                max_tokens=3000  # Increased for ITIL-enhanced responses
+                max_tokens=max_tokens  # 3000 for full ITIL-enhanced responses, far less for template refinement
             )
             
             await progress_callback(75, "Processing ITIL-enhanced response...")
             
             # Parse the response
             ai_response = response.choices[0].message.content
-            process_data = self._parse_ai_response(ai_response)
+            with measure_parse(agent_type):
+                process_data = self._parse_ai_response(ai_response, agent_type)
+                if skeleton:
+                    process_data = self._merge_template_refinement(skeleton, process_data)
             
             await progress_callback(85, "Validating against ITIL standards...")
             
             # Validate against ITIL if agent available
             validation_results = {}
             if self.itil_agent and itil_area:
-                validation_results = self.itil_agent.validate_process_against_itil({
-                    "title": title,
-                    "description": description,
-                    "steps": process_data.get("steps", [])
-                })
+                with start_span("itil.validate", itil_area=itil_area):
+                    validation_results = self.itil_agent.validate_process_against_itil({
+                        "title": title,
+                        "description": description,
+                        "steps": process_data.get("steps", [])
+                    })
             
             await progress_callback(95, "Finalizing ITIL-compliant process...")
             
@@ -199,6 +366,11 @@ class ProcessGeneratorAgent:
                     "generation_model": self.model,
                     "generated_at": datetime.utcnow().isoformat(),
                     "itil_enhanced": bool(self.itil_agent and itil_area),
+                    "knowledge_base_version": self.itil_agent.knowledge_base.version if self.itil_agent else None,
+                    "itil_process_candidates": process_candidates,
+                    "generation": self._generation_stats(
+                        "template" if skeleton else "full", response, started, max_tokens, len(skeleton)
+                    ),
                     "confidence_score": validation_results.get("compliance_score", 0.85),
                     "original_request": {
                         "title": title,
@@ -280,7 +452,64 @@ Make the process practical, realistic, and well-structured. Consider industry be
 """
         return prompt.strip()
     
-    def _parse_ai_response(self, response: str) -> Dict[str, Any]:
+    def _build_outline_prompt(self, title: str, description: str, category: str,
+                              requirements: List[str], target_audience: str, complexity_level: str) -> str:
+        """Build the prompt for the short outline call of outline-then-expand generation"""
+        
+        prompt = f"""
+Outline a business process with the following specifications. Only the outline: each step is
+elaborated separately afterwards, so keep every field short.
+
+**Process Title:** {title}
+**Description:** {description}
+**Category:** {category}
+**Target Audience:** {target_audience}
+**Complexity Level:** {complexity_level}
+
+**Requirements:**
+{chr(10).join(f"- {req}" for req in requirements) if requirements else "- No specific requirements provided"}
+
+Create 5-15 logical, sequential steps. Respond with JSON only:
+```json
+{{
+  "title": "Process Title",
+  "description": "Two-sentence process description",
+  "estimated_duration": 120,
+  "tags": ["tag1", "tag2"],
+  "steps": [
+    {{"title": "Step Title", "summary": "One sentence", "type": "Task", "responsible_role": "Department/Role", "estimated_duration": 30}}
+  ]
+}}
+```
+"""
+        return prompt.strip()
+    
+    def _build_step_expansion_prompt(self, process_title: str, process_description: str,
+                                     outline_steps: List[Dict[str, Any]], index: int) -> str:
+        """Build the prompt that elaborates one step of an outline"""
+        
+        step = outline_steps[index]
+        outline_text = "\n".join(f"{number}. {item['title']}" for number, item in enumerate(outline_steps, 1))
+        prompt = f"""
+Process: {process_title}
+{process_description}
+
+Outline:
+{outline_text}
+
+Elaborate step {index + 1}, "{step['title']}" ({step.get('type', 'Task')}, {step.get('responsible_role', 'Team Member')}): {step.get('summary', '')}
+Do not repeat the other steps. Respond with JSON only:
+```json
+{{
+  "description": "Detailed step description",
+  "detailed_instructions": "Specific instructions for this step",
+  "prerequisites": ["Prerequisite or dependency"]
+}}
+```
+"""
+        return prompt.strip()
+    
+    def _parse_ai_response(self, response: str, agent_type: str = "process_generator") -> Dict[str, Any]:
         """Parse the AI response and extract structured process data"""
         try:
             # Try to find JSON in the response
@@ -292,10 +521,12 @@ Make the process practical, realistic, and well-structured. Consider industry be
                 return json.loads(json_str)
             else:
                 # Fallback: manual parsing
+                record_parse_failure(agent_type)
                 return self._manual_parse_response(response)
                 
         except json.JSONDecodeError:
             # Fallback to manual parsing if JSON parsing fails
+            record_parse_failure(agent_type)
             return self._manual_parse_response(response)
     
     def _manual_parse_response(self, response: str) -> Dict[str, Any]:
@@ -348,23 +579,122 @@ Make the process practical, realistic, and well-structured. Consider industry be
         
         return process_data
     
-    def _determine_itil_process_type(self, title: str, description: str) -> str:
-        """Determine ITIL process type from title and description"""
-        text = f"{title} {description}".lower()
-        
-        if any(keyword in text for keyword in ["incident", "issue", "outage", "disruption"]):
-            return "incident-management"
-        elif any(keyword in text for keyword in ["change", "modification", "update", "upgrade"]):
-            return "change-management" 
-        elif any(keyword in text for keyword in ["problem", "root cause", "recurring"]):
-            return "problem-management"
-        elif any(keyword in text for keyword in ["request", "service request", "fulfillment"]):
-            return "service-request-management"
-        elif any(keyword in text for keyword in ["access", "permission", "authorization"]):
-            return "access-management"
-        else:
-            # Default to incident management for unknown types
-            return "incident-management"
+    def _build_template_refinement_prompt(self, title: str, description: str, itil_area: str,
+                                          requirements: List[str], target_audience: str,
+                                          complexity_level: str, skeleton: List[Dict[str, Any]]) -> str:
+        """Build the prompt asking the model to refine a locally built ITIL step skeleton"""
+        
+        # Sub-activities stay local (they become the default instructions), keeping the prompt short
+        skeleton_lines = [
+            f"{index}. [{step['step_type']}] {step['step_title']} ({step['responsible_role']}, "
+            f"{step['estimated_duration']} min): {step['description']}"
+            for index, step in enumerate(skeleton, 1)
+        ]
+        
+        prompt = f"""
+Tilpass dette ITIL 4-prosessutkastet til forespørselen under. Trinnene er allerede laget fra ITIL-kunnskapsbasen.
+
+**Prosessinformasjon:**
+- Tittel: {title}
+- Beskrivelse: {description}
+- ITIL-område: {itil_area}
+- Målgruppe: {target_audience}
+- Kompleksitetsnivå: {complexity_level}
+
+**Krav:**
+{chr(10).join(f"- {req}" for req in requirements) if requirements else "- Ingen spesifikke krav oppgitt"}
+
+**Utkast til trinn:**
+{chr(10).join(skeleton_lines)}
+
+Oppgave:
+- Skriv tittel og beskrivelse for prosessen på norsk
+- For hvert trinn: norsk tittel, en kort beskrivelse og konkrete instruksjoner tilpasset forespørselen
+- Endre rolle, varighet eller type bare der forespørselen tilsier det
+- Legg bare til trinn som kravene gjør nødvendige
+- Hold hvert felt kort (1-2 setninger)
+
+Svar kun med JSON:
+```json
+{{
+  "title": "Prosesstittel",
+  "description": "Prosessbeskrivelse",
+  "tags": ["itil", "norsk"],
+  "steps": [
+    {{"order_index": 1, "title": "Trinntittel", "description": "Kort beskrivelse", "detailed_instructions": "Instruksjoner"}}
+  ],
+  "additional_steps": [
+    {{"after": 2, "title": "Trinntittel", "description": "Beskrivelse", "type": "Task", "responsible_role": "Rolle", "estimated_duration": 30}}
+  ]
+}}
+```
+"""
+        return prompt.strip()
+    
+    def _merge_template_refinement(self, skeleton: List[Dict[str, Any]], refinement: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply the model's refinements to the skeleton steps and insert any additional steps"""
+        
+        steps = [
+            {
+                "title": step["step_title"],
+                "description": step["description"],
+                "type": step["step_type"],
+                "responsible_role": step["responsible_role"],
+                "estimated_duration": step["estimated_duration"],
+                "order_index": index,
+                "is_optional": False,
+                "detailed_instructions": "; ".join(step.get("sub_activities", [])) or step["description"]
+            }
+            for index, step in enumerate(skeleton, 1)
+        ]
+        
+        refinable = ("title", "description", "detailed_instructions", "responsible_role", "estimated_duration", "type", "is_optional")
+        for patch in refinement.get("steps", []):
+            index = patch.get("order_index")
+            if isinstance(index, int) and 1 <= index <= len(steps):
+                steps[index - 1].update({key: patch[key] for key in refinable if patch.get(key) not in (None, "")})
+        
+        # Insert from the back so the "after" positions still refer to the skeleton numbering
+        additional = [step for step in refinement.get("additional_steps", []) if step.get("title")]
+        positions = [
+            min(max(step["after"], 0), len(steps)) if isinstance(step.get("after"), int) else len(steps)
+            for step in additional
+        ]
+        for position, extra in sorted(zip(positions, additional), key=lambda item: item[0], reverse=True):
+            steps.insert(position, {
+                "title": extra["title"],
+                "description": extra.get("description", extra["title"]),
+                "type": extra.get("type", "Task"),
+                "responsible_role": extra.get("responsible_role", "Process Team"),
+                "estimated_duration": extra.get("estimated_duration", 30),
+                "is_optional": extra.get("is_optional", False),
+                "detailed_instructions": extra.get("detailed_instructions", extra.get("description", ""))
+            })
+        
+        for index, step in enumerate(steps, 1):
+            step["order_index"] = index
+        
+        process_data = {
+            "title": refinement.get("title"),
+            "description": refinement.get("description"),
+            "tags": refinement.get("tags"),
+            "estimated_duration": sum(step.get("estimated_duration") or 0 for step in steps),
+            "steps": steps
+        }
+        # Missing fields fall back to the request's values
+        return {key: value for key, value in process_data.items() if value is not None}
+    
+    def _generation_stats(self, mode: str, response: Any, started: float, max_tokens: int, template_steps: int) -> Dict[str, Any]:
+        """Latency and token usage of a generation, to compare template-first with full generation"""
+        usage = getattr(response, "usage", None)
+        return {
+            "mode": mode,
+            "latency_ms": int((time.perf_counter() - started) * 1000),
+            "max_tokens": max_tokens,
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "template_steps": template_steps
+        }
     
     def _build_itil_system_message(self, itil_context: Dict[str, Any]) -> str:
         """Build ITIL-enhanced system message"""
@@ -374,10 +704,23 @@ Make the process practical, realistic, and well-structured. Consider industry be
         if not itil_context:
             return base_message
             
-        # Add ITIL-specific guidance
-        guiding_principles = itil_context.get("service_value_system", {}).get("guiding_principles", [])
+        # Add ITIL-specific guidance, preferring the principles retrieved for this request
+        guiding_principles = [
+            {"name": passage["title"]} for passage in itil_context.get("relevant_passages", [])
+            if passage["kind"] == "principle"
+        ] or itil_context.get("service_value_system", {}).get("guiding_principles", [])
         principles_text = ", ".join([p.get("name", "") for p in guiding_principles[:3]])
         
+        # Principle names come from the knowledge base, so there are few distinct messages
+        if self.itil_agent:
+            return self.itil_agent.knowledge_base.fragment(
+                f"itil/system-message:{principles_text}",
+                lambda: self._render_itil_system_message(base_message, principles_text)
+            )
+        return self._render_itil_system_message(base_message, principles_text)
+    
+    def _render_itil_system_message(self, base_message: str, principles_text: str) -> str:
+        """Render the ITIL system message for a set of guiding principles"""
         enhanced_message = f"""{base_message}
 
 ITIL 4 KONTEKST:
@@ -397,13 +740,17 @@ Lag prosesser som er praktiske, målbare og i tråd med ITIL 4 standarder."""
 
         return enhanced_message
     
-    def _build_itil_enhanced_prompt(self, title: str, description: str, category: str, 
-                                  itil_area: str, requirements: List[str], target_audience: str, 
-                                  complexity_level: str, itil_context: Dict[str, Any]) -> str:
-        """Build ITIL-enhanced prompt with knowledge base integration"""
-        
-        # Get specific practice knowledge if available
-        practice_specific = itil_context.get("process_specific", {})
+    def _format_passages(self, heading: str, passages: List[Dict[str, Any]], kinds: tuple) -> str:
+        """Render retrieved passages of the given kinds as a prompt section"""
+        selected = [passage for passage in passages if passage["kind"] in kinds]
+        if not selected:
+            return ""
+        lines = [f"\n**{heading}:**"]
+        lines.extend(f"- {passage['title']}: {passage['text']}" for passage in selected)
+        return "\n".join(lines) + "\n"
+    
+    def _render_practice_sections(self, practice_specific: Dict[str, Any]) -> tuple:
+        """Activities and KPI sections of the prompt from a practice's knowledge"""
         
         # Extract key activities and metrics
         key_activities = practice_specific.get("key_activities", [])
@@ -423,6 +770,32 @@ Lag prosesser som er praktiske, målbare og i tråd med ITIL 4 standarder."""
             for metric in key_metrics[:3]:  # Limit to 3
                 metrics_text += f"- {metric.get('metric', '')}: {metric.get('description', '')}\n"
         
+        return activities_text, metrics_text
+    
+    def _build_itil_enhanced_prompt(self, title: str, description: str, category: str, 
+                                  itil_area: str, requirements: List[str], target_audience: str, 
+                                  complexity_level: str, itil_context: Dict[str, Any]) -> str:
+        """Build ITIL-enhanced prompt with knowledge base integration"""
+        
+        passages = itil_context.get("relevant_passages")
+        if passages is not None:
+            # Passages retrieved for this request (BM25 over the knowledge base)
+            activities_text = self._format_passages(
+                "ITIL Nøkkelaktiviteter for referanse", passages, ("activity", "value_chain_activity")
+            )
+            metrics_text = self._format_passages("Relevante KPI-er", passages, ("metric",))
+            metrics_text += self._format_passages("Relevante roller og begreper", passages, ("role", "concept"))
+        else:
+            # Fixed sections of the practice, the same for every request on this knowledge-base version
+            practice_specific = itil_context.get("process_specific", {})
+            if self.itil_agent and practice_specific.get("practice"):
+                activities_text, metrics_text = self.itil_agent.knowledge_base.fragment(
+                    f"itil/practice-sections:{practice_specific['practice']}",
+                    lambda: self._render_practice_sections(practice_specific)
+                )
+            else:
+                activities_text, metrics_text = self._render_practice_sections(practice_specific)
+        
         prompt = f"""
 Lag en detaljert ITIL 4-kompatibel forretningsprosess med følgende spesifikasjoner:
 
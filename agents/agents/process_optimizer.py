@@ -9,6 +9,8 @@ from openai import AsyncOpenAI
 from datetime import datetime, timedelta
 import random
 from dotenv import load_dotenv
+from services.llm import create_chat_completion, measure_parse, record_parse_failure
+from services.tracing import start_span
 
 # Load environment variables
 load_dotenv()
@@ -51,15 +53,17 @@ class ProcessOptimizerAgent:
         await progress_callback(30, "Preparing optimization analysis...")
         
         # Build the optimization prompt
-        prompt = self._build_optimization_prompt(
-            process_title, process_steps, performance_metrics, historical_data
-        )
+        with start_span("prompt.build", agent_type="process_optimizer"):
+            prompt = self._build_optimization_prompt(
+                process_title, process_steps, performance_metrics, historical_data
+            )
         
         await progress_callback(50, "Calling OpenAI API for process analysis...")
         
         try:
             # Call OpenAI API
-            response = await self.client.chat.completions.create(
+            response = await create_chat_completion(
+                self.client, "process_optimizer",
                 model=self.model,
                 messages=[
                     {
@@ -79,7 +83,8 @@ class ProcessOptimizerAgent:
             
             # Parse the response
             ai_response = response.choices[0].message.content
-            optimization_data = self._parse_optimization_response(ai_response)
+            with measure_parse("process_optimizer"):
+                optimization_data = self._parse_optimization_response(ai_response)
             
             await progress_callback(85, "Calculating optimization metrics...")
             
@@ -244,9 +249,11 @@ Gi praktiske, norske forretningsanbefalinger basert på beste praksis innen pros
                 
                 return result
             else:
+                record_parse_failure("process_optimizer")
                 return self._fallback_optimization()
                 
         except (json.JSONDecodeError, KeyError) as e:
+            record_parse_failure("process_optimizer")
             return self._fallback_optimization()
     
     def _validate_bottlenecks(self, bottlenecks: List[Dict]) -> List[Dict]:
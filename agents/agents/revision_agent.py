@@ -7,6 +7,8 @@ from typing import Dict, Any, List, Callable, Optional
 from openai import AsyncOpenAI
 from datetime import datetime
 from dotenv import load_dotenv
+from services.llm import create_chat_completion, measure_parse, record_parse_failure
+from services.tracing import start_span
 
 # Load environment variables
 load_dotenv()
@@ -45,15 +47,17 @@ class RevisionAgent:
         await progress_callback(30, "Analyzing current process...")
         
         # Build the revision prompt
-        prompt = self._build_revision_prompt(
-            current_process, revision_type, feedback, improvement_goals, custom_instructions
-        )
+        with start_span("prompt.build", agent_type="revision_agent"):
+            prompt = self._build_revision_prompt(
+                current_process, revision_type, feedback, improvement_goals, custom_instructions
+            )
         
         await progress_callback(50, "Calling OpenAI API for revision...")
         
         try:
             # Call OpenAI API
-            response = await self.client.chat.completions.create(
+            response = await create_chat_completion(
+                self.client, "revision_agent",
                 model=self.model,
                 messages=[
                     {
@@ -73,7 +77,8 @@ class RevisionAgent:
             
             # Parse the response
             ai_response = response.choices[0].message.content
-            revision_data = self._parse_revision_response(ai_response)
+            with measure_parse("revision_agent"):
+                revision_data = self._parse_revision_response(ai_response)
             
             await progress_callback(95, "Finalizing revision...")
             
@@ -262,10 +267,12 @@ Focus on making the process more efficient, clear, and aligned with the stated g
                 return json.loads(json_str)
             else:
                 # Fallback: manual parsing
+                record_parse_failure("revision_agent")
                 return self._manual_parse_revision_response(response)
                 
         except json.JSONDecodeError:
             # Fallback to manual parsing if JSON parsing fails
+            record_parse_failure("revision_agent")
             return self._manual_parse_revision_response(response)
     
     def _manual_parse_revision_response(self, response: str) -> Dict[str, Any]:
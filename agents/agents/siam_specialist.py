@@ -4,27 +4,35 @@ Provides expert guidance on Service Integration and Management (SIAM) for multi-
 """
 import os
 import json
-from typing import Dict, Any, List, Optional
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Iterable, Tuple
 from pathlib import Path
 from datetime import datetime
 import openai
 from dotenv import load_dotenv
+from services.llm import create_chat_completion_sync
+from services.knowledge_base import get_knowledge_base, pin_knowledge_base
+from services.guidance_cache import (
+    LEVELS, DEFAULT_VENDOR_COUNTS, get_guidance_cache, guidance_key, is_cacheable, normalize_level, prompt_hash
+)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class SIAMSpecialistAgent:
     """AI Agent specializing in SIAM methodology and multi-vendor service integration"""
     
-    def __init__(self):
+    GOVERNANCE_MODEL = "gpt-4"
+    
+    def __init__(self, client: Optional[openai.OpenAI] = None):
         # Initialize OpenAI client
-        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.client = client or openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         
         # Path to SIAM knowledge base
         self.knowledge_base_path = Path(__file__).parent.parent.parent / "data" / "siam"
         
-        # Cache for loaded knowledge
-        self._knowledge_cache = {}
-        
         # SIAM specialization areas
         self.specializations = [
             "multi_vendor_governance",
@@ -36,6 +44,11 @@ class SIAMSpecialistAgent:
             "risk_management",
             "norwegian_compliance"
         ]
+    
+    @property
+    def knowledge_base(self):
+        """Compiled knowledge-base snapshot: the one pinned for the running job, else the latest"""
+        return get_knowledge_base()
         
     def get_siam_framework(self) -> Dict[str, Any]:
         """Get comprehensive SIAM framework information"""
@@ -60,7 +73,8 @@ class SIAMSpecialistAgent:
         )
         
         try:
-            response = self.client.chat.completions.create(
+            response = create_chat_completion_sync(
+                self.client, "siam_specialist",
                 model="gpt-4",
                 messages=[
                     {
@@ -99,42 +113,15 @@ class SIAMSpecialistAgent:
     def provide_governance_guidance(self, vendor_count: int, service_complexity: str, org_maturity: str) -> Dict[str, Any]:
         """Provide specific governance structure recommendations"""
         
-        siam_framework = self.get_siam_framework()
-        scenarios = self.get_multi_vendor_scenarios()
-        
-        prompt = f"""
-        Based on the following requirements, recommend an optimal SIAM governance structure:
-        
-        - Number of vendors: {vendor_count}
-        - Service complexity: {service_complexity} (low/medium/high)
-        - Organizational maturity: {org_maturity} (low/medium/high)
-        
-        Consider the SIAM framework components and governance patterns to provide:
-        1. Recommended governance model (centralized/federated/hybrid)
-        2. Specific governance bodies and their responsibilities
-        3. Decision-making frameworks
-        4. Escalation procedures
-        5. Norwegian business context considerations
-        
-        SIAM Framework: {json.dumps(siam_framework.get('core_components', {}), indent=2)}
-        Governance Patterns: {json.dumps(scenarios.get('multi_vendor_scenarios', {}).get('governance_patterns', {}), indent=2)}
-        """
+        service_complexity = normalize_level(service_complexity)
+        org_maturity = normalize_level(org_maturity)
         
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": self._get_system_prompt()},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.2,
-                max_tokens=1500
-            )
-            
-            guidance_content = response.choices[0].message.content
+            guidance_content, guidance_source = self._governance_guidance_text(vendor_count, service_complexity, org_maturity)
             
             return {
                 "governance_guidance": guidance_content,
+                "guidance_source": guidance_source,
                 "recommended_model": self._determine_governance_model(vendor_count, service_complexity, org_maturity),
                 "governance_bodies": self._suggest_governance_bodies(vendor_count, service_complexity),
                 "implementation_timeline": self._suggest_governance_timeline(org_maturity),
@@ -148,29 +135,44 @@ class SIAMSpecialistAgent:
                 "timestamp": datetime.now().isoformat()
             }
     
+    def precompute_governance_guidance(self, vendor_counts: Optional[Iterable[int]] = None, threads: int = 4,
+                                       refresh: bool = False) -> Dict[str, int]:
+        """Generate and store governance guidance for every common input combination (offline warm-up)"""
+        snapshot = self.knowledge_base
+        cache = get_guidance_cache(snapshot)
+        combinations = [
+            (vendor_count, complexity, maturity)
+            for vendor_count in (vendor_counts or DEFAULT_VENDOR_COUNTS) for complexity in LEVELS for maturity in LEVELS
+        ]
+        
+        def warm(combination) -> str:
+            # Pool threads do not inherit the pinned snapshot, so pin the one the cache belongs to
+            with pin_knowledge_base(snapshot):
+                messages = self._governance_messages(*combination)
+                key, prompt_sha = guidance_key(*combination), prompt_hash(messages)
+                if not refresh and cache.get(key, prompt_sha) is not None:
+                    return "cached"
+                try:
+                    cache.put(key, prompt_sha, self._live_governance_guidance(messages), self.GOVERNANCE_MODEL, persist=True)
+                except Exception as e:
+                    logger.warning("Could not precompute governance guidance", extra={"guidance_key": key, "error": str(e)})
+                    return "failed"
+                return "generated"
+        
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+            outcomes = list(pool.map(warm, combinations))
+        return {outcome: outcomes.count(outcome) for outcome in ("generated", "cached", "failed")}
+    
     def suggest_integration_approach(self, integration_requirements: Dict[str, Any]) -> Dict[str, Any]:
         """Suggest technical and process integration approaches"""
         
         siam_framework = self.get_siam_framework()
         
-        prompt = f"""
-        Based on the integration requirements below, provide detailed SIAM integration recommendations:
-        
-        Requirements: {json.dumps(integration_requirements, indent=2)}
-        
-        Provide recommendations for:
-        1. Integration mechanisms and tools
-        2. Data sharing and governance approaches
-        3. Process integration strategies
-        4. Performance monitoring approaches
-        5. Risk mitigation strategies
-        6. Implementation priorities and phasing
-        
-        Consider SIAM integration mechanisms: {json.dumps(siam_framework.get('core_components', {}).get('integration_mechanisms', {}), indent=2)}
-        """
+        prompt = self._create_integration_prompt(integration_requirements)
         
         try:
-            response = self.client.chat.completions.create(
+            response = create_chat_completion_sync(
+                self.client, "siam_specialist",
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": self._get_system_prompt()},
@@ -226,7 +228,8 @@ class SIAMSpecialistAgent:
             """
             
             try:
-                response = self.client.chat.completions.create(
+                response = create_chat_completion_sync(
+                    self.client, "siam_specialist",
                     model="gpt-4",
                     messages=[
                         {"role": "system", "content": self._get_system_prompt()},
@@ -276,7 +279,8 @@ class SIAMSpecialistAgent:
         """
         
         try:
-            response = self.client.chat.completions.create(
+            response = create_chat_completion_sync(
+                self.client, "siam_specialist",
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": self._get_system_prompt()},
@@ -340,27 +344,99 @@ Focus on value delivery and practical implementation rather than theoretical con
         7. Norwegian context considerations
         
         Consider these SIAM implementation patterns:
-        {json.dumps(scenarios.get('multi_vendor_scenarios', {}).get('scenarios', []), indent=2)[:1000]}...
+        {self._knowledge_json("multi-vendor-scenarios.json", "multi_vendor_scenarios", "scenarios", limit=1000)}...
         
         Governance options:
-        {json.dumps(scenarios.get('multi_vendor_scenarios', {}).get('governance_patterns', {}), indent=2)}
+        {self._knowledge_json("multi-vendor-scenarios.json", "multi_vendor_scenarios", "governance_patterns")}
         """
     
-    def _load_knowledge_file(self, filename: str) -> Dict[str, Any]:
-        """Load knowledge from JSON file with caching"""
-        if filename in self._knowledge_cache:
-            return self._knowledge_cache[filename]
-            
-        file_path = self.knowledge_base_path / filename
+    def _governance_messages(self, vendor_count: int, service_complexity: str, org_maturity: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": self._get_system_prompt()},
+            {"role": "user", "content": self._create_governance_prompt(vendor_count, service_complexity, org_maturity)}
+        ]
+    
+    def _live_governance_guidance(self, messages: List[Dict[str, str]]) -> str:
+        response = create_chat_completion_sync(
+            self.client, "siam_specialist",
+            model=self.GOVERNANCE_MODEL,
+            messages=messages,
+            temperature=0.2,
+            max_tokens=1500
+        )
+        return response.choices[0].message.content
+    
+    def _governance_guidance_text(self, vendor_count: int, service_complexity: str, org_maturity: str) -> Tuple[str, str]:
+        """Guidance text and where it came from: cache (precomputed or answered earlier) or live"""
+        messages = self._governance_messages(vendor_count, service_complexity, org_maturity)
+        cache = get_guidance_cache(self.knowledge_base)
+        key, prompt_sha = guidance_key(vendor_count, service_complexity, org_maturity), prompt_hash(messages)
+        entry = cache.get(key, prompt_sha)
+        if entry is not None:
+            return entry["guidance"], "cache"
+        guidance = self._live_governance_guidance(messages)
+        if is_cacheable(vendor_count, service_complexity, org_maturity):
+            cache.put(key, prompt_sha, guidance, self.GOVERNANCE_MODEL)
+        return guidance, "live"
+    
+    def _create_governance_prompt(self, vendor_count: int, service_complexity: str, org_maturity: str) -> str:
+        """Create the governance structure recommendation prompt"""
+        return f"""
+        Based on the following requirements, recommend an optimal SIAM governance structure:
         
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                knowledge = json.load(f)
-                self._knowledge_cache[filename] = knowledge
-                return knowledge
-        except (FileNotFoundError, json.JSONDecodeError) as e:
-            print(f"Warning: Could not load SIAM knowledge file {filename}: {e}")
+        - Number of vendors: {vendor_count}
+        - Service complexity: {service_complexity} (low/medium/high)
+        - Organizational maturity: {org_maturity} (low/medium/high)
+        
+        Consider the SIAM framework components and governance patterns to provide:
+        1. Recommended governance model (centralized/federated/hybrid)
+        2. Specific governance bodies and their responsibilities
+        3. Decision-making frameworks
+        4. Escalation procedures
+        5. Norwegian business context considerations
+        
+        SIAM Framework: {self._knowledge_json("siam-framework.json", "core_components")}
+        Governance Patterns: {self._knowledge_json("multi-vendor-scenarios.json", "multi_vendor_scenarios", "governance_patterns")}
+        """
+    
+    def _create_integration_prompt(self, integration_requirements: Dict[str, Any]) -> str:
+        """Create the integration approach prompt"""
+        return f"""
+        Based on the integration requirements below, provide detailed SIAM integration recommendations:
+        
+        Requirements: {json.dumps(integration_requirements, indent=2)}
+        
+        Provide recommendations for:
+        1. Integration mechanisms and tools
+        2. Data sharing and governance approaches
+        3. Process integration strategies
+        4. Performance monitoring approaches
+        5. Risk mitigation strategies
+        6. Implementation priorities and phasing
+        
+        Consider SIAM integration mechanisms: {self._knowledge_json("siam-framework.json", "core_components", "integration_mechanisms")}
+        """
+    
+    def _knowledge_json(self, filename: str, *keys: str, limit: Optional[int] = None) -> str:
+        """Indented JSON of a knowledge section for prompts, rendered once per knowledge-base version"""
+        knowledge_base = self.knowledge_base
+        
+        def render() -> str:
+            section = knowledge_base.get(f"siam/{filename}") or {}
+            for key in keys:
+                section = section.get(key, {})
+            text = json.dumps(section, indent=2)
+            return text[:limit] if limit else text
+        
+        return knowledge_base.fragment(f"siam/{filename}:{'.'.join(keys)}:{limit}", render)
+    
+    def _load_knowledge_file(self, filename: str) -> Dict[str, Any]:
+        """Load knowledge from the shared snapshot (decoded once per process)"""
+        knowledge = self.knowledge_base.get(f"siam/{filename}")
+        if knowledge is None:
+            print(f"Warning: Could not load SIAM knowledge file {filename}: not in knowledge base snapshot")
             return {}
+        return knowledge
     
     def _extract_recommendations(self, analysis_content: str) -> List[str]:
         """Extract key recommendations from analysis content"""
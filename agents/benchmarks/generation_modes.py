@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark: template-first versus full ITIL process generation
+Runs the same requests in both modes against the configured OpenAI model (OPENAI_API_KEY,
+OPENAI_MODEL) and compares end-to-end latency, tokens and estimated cost. This makes real
+API calls.
+
+    cd agents && python benchmarks/generation_modes.py [--runs 3]
+"""
+import os
+import sys
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.process_generator import ProcessGeneratorAgent
+from services.usage import _model_price
+
+REQUESTS = [
+    {
+        "title": "Hendelseshåndtering for kundeservice",
+        "description": "Registrering, prioritering og løsning av hendelser meldt inn av kunder",
+        "category": "IT", "itil_area": "Service Operation",
+        "requirements": ["Kritiske hendelser skal eskaleres innen 15 minutter", "Kunden skal varsles ved løsning"]
+    },
+    {
+        "title": "Endringshåndtering for produksjonssystemer",
+        "description": "Vurdering, godkjenning og gjennomføring av endringer i produksjon",
+        "category": "IT", "itil_area": "Service Transition",
+        "requirements": ["Endringer med høy risiko krever CAB-godkjenning", "Tilbakerullingsplan er påkrevd"]
+    }
+]
+
+
+async def run_mode(generator: ProcessGeneratorAgent, mode: str, runs: int):
+    async def progress(value, message):
+        pass
+
+    stats = []
+    for _ in range(runs):
+        for request in REQUESTS:
+            result = await generator.generate_itil_process(dict(request, generation_mode=mode), progress)
+            stats.append(dict(result["metadata"]["generation"], steps=len(result["steps"])))
+    return stats
+
+
+def summarize(stats, model: str):
+    price = _model_price(model)
+    prompt = statistics.mean(entry["prompt_tokens"] or 0 for entry in stats)
+    completion = statistics.mean(entry["completion_tokens"] or 0 for entry in stats)
+    cost = (prompt * price[0] + completion * price[2]) / 1e6 if price else None
+    return {
+        "latency_ms": statistics.mean(entry["latency_ms"] for entry in stats),
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "steps": statistics.mean(entry["steps"] for entry in stats),
+        "cost_usd": cost
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare template-first and full ITIL generation")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    generator = ProcessGeneratorAgent()
+    full = summarize(await run_mode(generator, "full", args.runs), generator.model)
+    template = summarize(await run_mode(generator, "template", args.runs), generator.model)
+
+    print(f"📊 ITIL generation, {generator.model}, {args.runs * len(REQUESTS)} requests per mode (means)")
+    for name, summary in (("Full", full), ("Template-first", template)):
+        cost = f"${summary['cost_usd']:.4f}" if summary["cost_usd"] is not None else "n/a"
+        print(f"   {name:15s} {summary['latency_ms']:8.0f} ms  {summary['prompt_tokens']:6.0f} prompt + "
+              f"{summary['completion_tokens']:6.0f} completion tokens  {summary['steps']:4.1f} steps  {cost}")
+    print(f"   Savings:        {100 * (1 - template['latency_ms'] / full['latency_ms']):7.1f}% latency, "
+          f"{100 * (1 - template['completion_tokens'] / full['completion_tokens']):.1f}% completion tokens")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark: memory per 100k retained (completed) jobs
+Compares the previous dict-backed job record with the compact Job in services/jobs.py
+
+    cd agents && python benchmarks/job_memory.py [--jobs 100000]
+"""
+import os
+import sys
+import argparse
+import tracemalloc
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.jobs import Job, JobStatus
+
+
+class LegacyJob:
+    """Job record as it was before: per-instance __dict__, datetimes and the full request data"""
+
+    def __init__(self, job_id: str, agent_type: str, request_data: Dict[str, Any], user_id: str):
+        self.job_id = job_id
+        self.agent_type = agent_type
+        self.request_data = request_data
+        self.user_id = user_id
+        self.status = JobStatus.QUEUED
+        self.progress = 0
+        self.message = "Job queued"
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.completed_at: Optional[datetime] = None
+        self.error_message: Optional[str] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.stages = None
+        self.estimated_runtime = 0.0
+        self.estimated_duration: Optional[int] = None
+        self.deadline: Optional[float] = None
+        self.best_effort = False
+        self.deadline_met: Optional[bool] = None
+
+
+def make_request(index: int) -> Dict[str, Any]:
+    """A typical process generation request"""
+    return {
+        "title": f"Hendelseshåndtering {index}",
+        "description": f"Prosess for registrering, klassifisering og løsning av hendelser i tjeneste {index}. " * 4,
+        "category": "ITSM",
+        "requirements": [f"Krav {index}-{n}: hendelser skal logges og prioriteres" for n in range(5)],
+        "target_audience": "IT-driftsteam",
+        "complexity_level": "medium",
+        "user_id": f"user_{index % 500}"
+    }
+
+
+def retain_jobs(job_class, count: int, compact: bool) -> float:
+    """Create and finish count jobs and return the retained bytes per job"""
+    shared_result = {"title": "Generated process"}
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    jobs = {}
+    for index in range(count):
+        job = job_class(f"job_{index:08x}", "process_generator", make_request(index), f"user_{index % 500}")
+        job.status = JobStatus.COMPLETED
+        job.started_at = datetime.utcnow()
+        job.completed_at = datetime.utcnow()
+        job.progress = 100
+        job.message = "Job completed successfully"
+        job.result = shared_result
+        if compact:
+            job.compact()
+        jobs[job.job_id] = job
+    retained = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(baseline, "filename"))
+    tracemalloc.stop()
+    return retained / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure memory per retained job")
+    parser.add_argument("--jobs", type=int, default=100_000)
+    args = parser.parse_args()
+
+    legacy = retain_jobs(LegacyJob, args.jobs, compact=False)
+    compact = retain_jobs(Job, args.jobs, compact=True)
+
+    print(f"📊 Memory per retained job ({args.jobs:,} jobs)")
+    print(f"   Legacy record:  {legacy:8.0f} bytes  ({legacy * args.jobs / 2**20:7.1f} MiB total)")
+    print(f"   Compact record: {compact:8.0f} bytes  ({compact * args.jobs / 2**20:7.1f} MiB total)")
+    print(f"   Reduction:      {100 * (1 - compact / legacy):7.1f}%")
+
+
+if __name__ == "__main__":
+    main()
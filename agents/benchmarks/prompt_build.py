@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark: prompt build time and allocations per request
+Builds the SIAM governance, integration and scenario prompts and the ITIL system message and
+practice sections, with the knowledge fragments rendered on every request (as before) and
+with the per-version fragment cache
+
+    cd agents && python benchmarks/prompt_build.py [--requests 2000]
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The agents create OpenAI clients, but no request is sent
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from services.knowledge_base import KnowledgeBaseSnapshot, get_knowledge_base, pin_knowledge_base
+from agents.siam_specialist import SIAMSpecialistAgent
+from agents.process_generator import ProcessGeneratorAgent
+
+
+class UncachedSnapshot(KnowledgeBaseSnapshot):
+    """Snapshot that renders every fragment on each use, like the prompt builders used to"""
+
+    def fragment(self, key, render):
+        return render()
+
+
+def build_prompts(siam: SIAMSpecialistAgent, generator: ProcessGeneratorAgent, index: int):
+    """The knowledge-derived prompt parts of one SIAM and one ITIL request"""
+    framework = siam.get_siam_framework()
+    scenarios = siam.get_multi_vendor_scenarios()
+    siam._create_governance_prompt(3 + index % 5, "high", "medium")
+    siam._create_integration_prompt({"vendors": index % 7, "tools": ["ServiceNow"]})
+    siam._create_scenario_analysis_prompt(f"Scenario {index}", ["24/7 drift"], framework, scenarios)
+
+    context = generator.itil_agent.generate_itil_process_context("incident-management", "service-operation")
+    generator._build_itil_system_message(context)
+    generator._build_itil_enhanced_prompt(
+        f"Hendelseshåndtering {index}", "Registrering og løsning av hendelser", "ITSM", "Service Operation",
+        ["Hendelser skal prioriteres"], "IT-drift", "medium", context
+    )
+
+
+def measure(snapshot: KnowledgeBaseSnapshot, requests: int):
+    """Mean microseconds and mean peak allocated bytes per request"""
+    siam = SIAMSpecialistAgent()
+    generator = ProcessGeneratorAgent()
+    with pin_knowledge_base(snapshot):
+        build_prompts(siam, generator, 0)
+
+        started = time.perf_counter()
+        for index in range(requests):
+            build_prompts(siam, generator, index)
+        elapsed = time.perf_counter() - started
+
+        tracemalloc.start()
+        peak = 0
+        for index in range(min(requests, 200)):
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            build_prompts(siam, generator, index)
+            peak += tracemalloc.get_traced_memory()[1] - baseline
+        tracemalloc.stop()
+    return elapsed / requests * 1e6, peak / min(requests, 200)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure prompt build cost per request")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    snapshot = get_knowledge_base()
+    uncached = UncachedSnapshot(snapshot._buffer, snapshot.source)
+    before_time, before_bytes = measure(uncached, args.requests)
+    after_time, after_bytes = measure(snapshot, args.requests)
+
+    print(f"📊 Prompt build per request ({args.requests:,} requests, knowledge base {snapshot.version})")
+    print(f"   Rendered each time: {before_time:8.1f} µs  {before_bytes / 1024:7.1f} KiB peak allocated")
+    print(f"   Fragment cache:     {after_time:8.1f} µs  {after_bytes / 1024:7.1f} KiB peak allocated")
+    print(f"   Reduction:          {100 * (1 - after_time / before_time):7.1f}% time, "
+          f"{100 * (1 - after_bytes / before_bytes):.1f}% allocations")
+
+
+if __name__ == "__main__":
+    main()
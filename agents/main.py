@@ -2,9 +2,17 @@
 FastAPI main application for AI Agents
 """
 import os
+import json
+import asyncio
+import hmac
+import logging
+from datetime import datetime
+from typing import Any, Optional
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Header, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from pydantic import ValidationError
 import uvicorn
 from dotenv import load_dotenv
 
@@ -18,25 +26,65 @@ from models.requests import (
     RevisionRequest, 
     SIAMAnalysisRequest, 
     GovernanceGuidanceRequest, 
-    VendorReadinessRequest
+    VendorReadinessRequest,
+    PipelineRequest,
+    BatchRequest,
+    ComplianceBatchRequest
 )
-from models.responses import JobResponse, JobStatusResponse
-from services.job_queue import JobQueue
+from models.responses import JobResponse, JobStatusResponse, BatchResponse, BatchStatusResponse
+from services.job_queue import JobQueue, QueueFullError, DeadlineUnachievableError
+from services.structured_logging import configure_logging
+from services.tracing import configure_tracing, start_span
+from services.loop_monitor import LoopLagMonitor
+from services.knowledge_base import KnowledgeBaseReloader
+from services.profiling import PROFILER, PROFILE_MODES, MAX_PROFILE_SECONDS, ProfilerBusyError
+from services.metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 
 # Load environment variables
 load_dotenv()
 
+configure_logging()
+configure_tracing()
+logger = logging.getLogger(__name__)
+
 # Initialize job queue
 job_queue = JobQueue()
+loop_monitor = LoopLagMonitor()
+knowledge_reloader = KnowledgeBaseReloader()
+
+# Request models used to validate batch items per agent type
+BATCH_REQUEST_MODELS = {
+    "process_generator": ProcessGenerationRequest,
+    "itil_process_generator": ProcessGenerationRequest,
+    "revision_agent": RevisionRequest,
+    "siam_specialist": SIAMAnalysisRequest,
+    "pipeline": PipelineRequest
+}
+# SIAM batch items are validated like the single endpoint for their analysis type
+SIAM_BATCH_REQUEST_MODELS = {
+    "governance": GovernanceGuidanceRequest,
+    "vendor_assessment": VendorReadinessRequest
+}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager"""
-    global process_generator, revision_agent, document_classifier, process_optimizer, siam_specialist
+    global process_generator, revision_agent, document_classifier, process_optimizer, siam_specialist, itil_agent
     
     # Startup
-    print("🤖 Starting AI Agents Service...")
+    logger.info("Starting AI Agents Service")
+    if os.getenv("LOOP_LAG_MONITOR", "true").lower() == "true":
+        loop_monitor.start()
+    # Picks up edits under data/itil and data/siam without a restart (KB_RELOAD_SECONDS=0 disables)
+    knowledge_reloader.start()
+    
+    # Set JOB_QUEUE_RUN_WORKER=false when jobs run in separate worker processes (worker.py).
+    # Started before the API's agents, so the reaper and usage flush run even if those fail
+    try:
+        await job_queue.initialize(run_worker=os.getenv("JOB_QUEUE_RUN_WORKER", "true").lower() == "true")
+    except Exception:
+        logger.exception("Failed to start job queue workers")
     
     try:
         # Initialize agents
@@ -45,26 +93,36 @@ async def lifespan(app: FastAPI):
         from agents.document_classifier import DocumentClassifierAgent
         from agents.process_optimizer import ProcessOptimizerAgent
         from agents.siam_specialist import SIAMSpecialistAgent
+        from agents.itil_knowledge_agent import ITILKnowledgeAgent
         
         process_generator = ProcessGeneratorAgent()
         revision_agent = RevisionAgent()
         document_classifier = DocumentClassifierAgent()
         process_optimizer = ProcessOptimizerAgent()
         siam_specialist = SIAMSpecialistAgent()
-        print("✅ AI Agents initialized successfully")
-        
-        await job_queue.initialize()
-        print("✅ Job queue initialized")
+        itil_agent = process_generator.itil_agent or ITILKnowledgeAgent()
+        logger.info("AI Agents initialized")
         
-    except Exception as e:
-        print(f"❌ Failed to initialize AI Agents: {e}")
-        print("⚠️  AI Agents will not be available")
+    except Exception:
+        logger.exception("Failed to initialize AI Agents; they will not be available")
     
     yield
     
     # Shutdown
-    print("🤖 Shutting down AI Agents Service...")
+    logger.info("Shutting down AI Agents Service")
     await job_queue.cleanup()
+    await loop_monitor.stop()
+    await knowledge_reloader.stop()
+
+def parse_deadline(value: Any) -> Optional[datetime]:
+    """Parse an optional ISO 8601 deadline from an untyped request body"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid deadline: {value}")
+
 
 app = FastAPI(
     title="ProsessPortal AI Agents",
@@ -80,14 +138,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["traceparent"],
 )
 
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Trace each request, continuing the caller's trace when a traceparent header is sent"""
+    with start_span("http.request", parent=request.headers.get("traceparent"),
+                    method=request.method, path=request.url.path) as span:
+        response = await call_next(request)
+        span.set_attribute("status_code", response.status_code)
+        response.headers["traceparent"] = span.traceparent
+        return response
+
 # Initialize agents (will be created on startup)
 process_generator = None
 revision_agent = None
 document_classifier = None
 process_optimizer = None
 siam_specialist = None
+itil_agent = None
 
 
 @app.get("/")
@@ -120,6 +191,13 @@ async def root():
     }
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for the job queue and LLM calls"""
+    await job_queue.collect_metrics()
+    return Response(content=REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
 @app.post("/api/agents/generate-process", response_model=JobResponse)
 async def generate_process(request: ProcessGenerationRequest):
     """
@@ -131,15 +209,21 @@ async def generate_process(request: ProcessGenerationRequest):
     try:
         job_id = await job_queue.submit_job(
             agent_type="process_generator",
-            request_data=request.model_dump(),
-            user_id=request.user_id
+            request_data=request.model_dump(exclude={"deadline"}),
+            user_id=request.user_id,
+            deadline=request.deadline
         )
         
         return JobResponse(
             job_id=job_id,
             status="queued",
-            message="Process generation job submitted successfully"
+            message="Process generation job submitted successfully",
+            estimated_duration=await job_queue.get_estimated_duration(job_id)
         )
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DeadlineUnachievableError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to submit job: {str(e)}")
 
@@ -155,19 +239,145 @@ async def revise_process(request: RevisionRequest):
     try:
         job_id = await job_queue.submit_job(
             agent_type="revision_agent",
-            request_data=request.model_dump(),
-            user_id=request.user_id
+            request_data=request.model_dump(exclude={"deadline"}),
+            user_id=request.user_id,
+            deadline=request.deadline
         )
         
         return JobResponse(
             job_id=job_id,
             status="queued", 
-            message="Process revision job submitted successfully"
+            message="Process revision job submitted successfully",
+            estimated_duration=await job_queue.get_estimated_duration(job_id)
         )
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DeadlineUnachievableError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to submit job: {str(e)}")
 
 
+@app.post("/api/agents/pipeline", response_model=JobResponse)
+async def submit_pipeline(request: PipelineRequest):
+    """
+    Submit a pipeline of dependent agent stages (e.g. classify → generate → validate)
+    that runs server-side as a single job
+    """
+    if not process_generator:
+        raise HTTPException(status_code=503, detail="AI Agents are not available. Please check OpenAI API key configuration.")
+    
+    try:
+        job_id = await job_queue.submit_pipeline(
+            stages=[stage.model_dump() for stage in request.stages],
+            user_id=request.user_id,
+            deadline=request.deadline
+        )
+        
+        return JobResponse(
+            job_id=job_id,
+            status="queued",
+            message=f"Pipeline job with {len(request.stages)} stages submitted successfully",
+            estimated_duration=await job_queue.get_estimated_duration(job_id)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid pipeline: {str(e)}")
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DeadlineUnachievableError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to submit pipeline job: {str(e)}")
+
+
+@app.post("/api/agents/batch", response_model=BatchResponse)
+async def submit_batch(request: BatchRequest):
+    """
+    Submit many jobs of mixed agent types in one request
+    """
+    if not process_generator:
+        raise HTTPException(status_code=503, detail="AI Agents are not available. Please check OpenAI API key configuration.")
+    
+    items = []
+    for index, item in enumerate(request.jobs):
+        request_data = {"user_id": request.user_id, **item.request_data}
+        model = BATCH_REQUEST_MODELS.get(item.agent_type)
+        analysis_type = request_data.get("analysis_type")
+        if item.agent_type == "siam_specialist" and analysis_type in SIAM_BATCH_REQUEST_MODELS:
+            model = SIAM_BATCH_REQUEST_MODELS[analysis_type]
+        if model:
+            try:
+                request_data = model(**request_data).model_dump(exclude={"deadline"})
+            except ValidationError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid batch item {index}: {str(e)}")
+            if analysis_type is not None:
+                request_data["analysis_type"] = analysis_type
+        items.append({"agent_type": item.agent_type, "request_data": request_data, "deadline": item.deadline})
+    
+    try:
+        batch_id = await job_queue.submit_batch(items, user_id=request.user_id)
+        batch_status = await job_queue.get_batch_status(batch_id)
+        
+        return BatchResponse(
+            batch_id=batch_id,
+            job_ids=batch_status["job_ids"],
+            status="queued",
+            message=f"Batch with {len(items)} jobs submitted successfully"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch: {str(e)}")
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DeadlineUnachievableError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to submit batch: {str(e)}")
+
+
+@app.get("/api/batches/{batch_id}/status", response_model=BatchStatusResponse)
+async def get_batch_status(batch_id: str):
+    """
+    Get aggregated progress for a batch
+    """
+    batch_status = await job_queue.get_batch_status(batch_id)
+    if not batch_status:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    
+    return BatchStatusResponse(**batch_status)
+
+
+@app.get("/api/batches/{batch_id}/results")
+async def get_batch_results(batch_id: str, wait: bool = False):
+    """
+    Download batch results as NDJSON, one line per job.
+    With wait=true the stream stays open and emits each result as its job finishes.
+    """
+    if not await job_queue.get_batch_status(batch_id):
+        raise HTTPException(status_code=404, detail="Batch not found")
+    
+    async def ndjson_lines():
+        async for record in job_queue.stream_batch_results(batch_id, wait=wait):
+            yield json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+@app.get("/api/jobs/estimates")
+async def get_job_duration_estimates():
+    """
+    Get learned job duration percentiles per agent type, analysis type and input size
+    """
+    return await job_queue.get_duration_percentiles()
+
+
+@app.get("/api/jobs/deadline-stats")
+async def get_deadline_stats():
+    """
+    Get deadline outcomes and miss rates per agent type
+    """
+    return await job_queue.get_deadline_stats()
+
+
 @app.get("/api/jobs/{job_id}/status", response_model=JobStatusResponse)
 async def get_job_status(job_id: str):
     """
@@ -198,6 +408,138 @@ async def get_job_result(job_id: str):
         raise HTTPException(status_code=500, detail=f"Failed to get job result: {str(e)}")
 
 
+@app.get("/api/jobs/{job_id}/timeline")
+async def get_job_timeline(job_id: str):
+    """
+    Get a waterfall of the spans recorded for a job (queue wait, stages, LLM calls, parsing)
+    """
+    try:
+        timeline = await job_queue.get_job_timeline(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get job timeline: {str(e)}")
+    if not timeline:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return timeline
+
+
+# Admin endpoints: enabled by setting ADMIN_TOKEN, called with an X-Admin-Token header
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Reject requests without the configured admin token"""
+    admin_token = os.getenv("ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set)")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+def profile_response(result) -> Response:
+    return Response(
+        content=result.content,
+        media_type=result.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{result.filename}"'}
+    )
+
+
+@app.post("/api/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_process(seconds: float = 10, mode: str = "sampling"):
+    """
+    Profile this process for a number of seconds. mode=sampling returns folded stacks
+    for flame graph tools, mode=cprofile returns a pstats dump
+    """
+    try:
+        return profile_response(await PROFILER.profile_for(seconds, mode))
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/api/admin/profile/jobs", dependencies=[Depends(require_admin)])
+async def profile_jobs(agent_type: str, count: int = 1, mode: str = "sampling",
+                       timeout: float = MAX_PROFILE_SECONDS):
+    """
+    Profile this process while its workers run the next N jobs of an agent type
+    """
+    if mode not in PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(PROFILE_MODES)}")
+    try:
+        return profile_response(await PROFILER.profile_jobs(agent_type, count, mode, timeout=timeout))
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+
+
+@app.get("/api/admin/usage/top", dependencies=[Depends(require_admin)])
+async def get_top_usage(group_by: str = "user", metric: str = "cost_microusd", limit: int = 10):
+    """
+    Top OpenAI consumers by user, agent or user/agent pair (tokens, calls, latency or estimated cost)
+    """
+    try:
+        return {
+            "group_by": group_by,
+            "metric": metric,
+            "consumers": await job_queue.get_top_consumers(group_by, metric, limit)
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/admin/loop-lag", dependencies=[Depends(require_admin)])
+async def get_loop_lag():
+    """
+    Event loop lag so far and the stacks captured for recent stalls
+    """
+    return loop_monitor.status()
+
+
+@app.post("/api/admin/tracemalloc/start", dependencies=[Depends(require_admin)])
+async def start_tracemalloc(frames: int = 10):
+    """
+    Start tracing memory allocations (adds overhead until stopped)
+    """
+    return PROFILER.start_tracemalloc(frames)
+
+
+@app.get("/api/admin/tracemalloc/snapshot", dependencies=[Depends(require_admin)])
+async def tracemalloc_snapshot(limit: int = 25, group_by: str = "lineno", path: Optional[str] = None):
+    """
+    Top memory allocations, and growth since the previous snapshot
+    """
+    try:
+        return PROFILER.tracemalloc_snapshot(limit, group_by, path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.post("/api/admin/tracemalloc/stop", dependencies=[Depends(require_admin)])
+async def stop_tracemalloc():
+    """
+    Stop tracing memory allocations
+    """
+    return PROFILER.stop_tracemalloc()
+
+
+# Epic 4: ITIL compliance
+
+@app.post("/api/agents/itil/validate-batch")
+async def validate_processes_batch(request: ComplianceBatchRequest):
+    """
+    Score many existing processes against the ITIL compliance rules (portfolio view)
+    """
+    if not itil_agent:
+        raise HTTPException(status_code=503, detail="ITIL knowledge agent is not available.")
+    
+    try:
+        # CPU-bound for large portfolios, so it runs off the event loop
+        return await asyncio.to_thread(itil_agent.validate_processes, request.processes, request.include_results)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to validate processes: {str(e)}")
+
+
 # Epic 3: AI-driven Process Automation Endpoints
 
 @app.post("/api/agents/classify-document", response_model=JobResponse)
@@ -208,18 +550,26 @@ async def classify_document(request: dict):
     if not document_classifier:
         raise HTTPException(status_code=503, detail="Document classification agent is not available.")
     
+    deadline = parse_deadline(request.pop("deadline", None))
+    
     try:
         job_id = await job_queue.submit_job(
             agent_type="document_classifier",
             request_data=request,
-            user_id=request.get("user_id", "unknown")
+            user_id=request.get("user_id", "unknown"),
+            deadline=deadline
         )
         
         return JobResponse(
             job_id=job_id,
             status="queued",
-            message="Document classification job submitted successfully"
+            message="Document classification job submitted successfully",
+            estimated_duration=await job_queue.get_estimated_duration(job_id)
         )
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DeadlineUnachievableError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to submit document classification job: {str(e)}")
 
@@ -232,18 +582,26 @@ async def optimize_process(request: dict):
     if not process_optimizer:
         raise HTTPException(status_code=503, detail="Process optimization agent is not available.")
     
+    deadline = parse_deadline(request.pop("deadline", None))
+    
     try:
         job_id = await job_queue.submit_job(
             agent_type="process_optimizer",
             request_data=request,
-            user_id=request.get("user_id", "unknown")
+            user_id=request.get("user_id", "unknown"),
+            deadline=deadline
         )
         
         return JobResponse(
             job_id=job_id,
             status="queued",
-            message="Process optimization job submitted successfully"
+            message="Process optimization job submitted successfully",
+            estimated_duration=await job_queue.get_estimated_duration(job_id)
         )
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DeadlineUnachievableError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to submit process optimization job: {str(e)}")
 
@@ -261,15 +619,21 @@ async def siam_analysis(request: SIAMAnalysisRequest):
     try:
         job_id = await job_queue.submit_job(
             agent_type="siam_specialist",
-            request_data=request.model_dump(),
-            user_id=request.user_id
+            request_data=request.model_dump(exclude={"deadline"}),
+            user_id=request.user_id,
+            deadline=request.deadline
         )
         
         return JobResponse(
             job_id=job_id,
             status="queued",
-            message="SIAM analysis job submitted successfully"
+            message="SIAM analysis job submitted successfully",
+            estimated_duration=await job_queue.get_estimated_duration(job_id)
         )
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DeadlineUnachievableError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to submit SIAM analysis job: {str(e)}")
 
@@ -285,15 +649,21 @@ async def governance_guidance(request: GovernanceGuidanceRequest):
     try:
         job_id = await job_queue.submit_job(
             agent_type="siam_specialist",
-            request_data={**request.model_dump(), "analysis_type": "governance"},
-            user_id=request.user_id
+            request_data={**request.model_dump(exclude={"deadline"}), "analysis_type": "governance"},
+            user_id=request.user_id,
+            deadline=request.deadline
         )
         
         return JobResponse(
             job_id=job_id,
             status="queued",
-            message="SIAM governance guidance job submitted successfully"
+            message="SIAM governance guidance job submitted successfully",
+            estimated_duration=await job_queue.get_estimated_duration(job_id)
         )
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DeadlineUnachievableError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to submit governance guidance job: {str(e)}")
 
@@ -309,15 +679,21 @@ async def vendor_readiness(request: VendorReadinessRequest):
     try:
         job_id = await job_queue.submit_job(
             agent_type="siam_specialist",
-            request_data={**request.model_dump(), "analysis_type": "vendor_assessment"},
-            user_id=request.user_id
+            request_data={**request.model_dump(exclude={"deadline"}), "analysis_type": "vendor_assessment"},
+            user_id=request.user_id,
+            deadline=request.deadline
         )
         
         return JobResponse(
             job_id=job_id,
             status="queued",
-            message="Vendor readiness assessment job submitted successfully"
+            message="Vendor readiness assessment job submitted successfully",
+            estimated_duration=await job_queue.get_estimated_duration(job_id)
         )
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except DeadlineUnachievableError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to submit vendor readiness job: {str(e)}")
 
@@ -2,6 +2,7 @@
 Pydantic models for API requests
 """
 from typing import Optional, List, Dict, Any
+from datetime import datetime
 from pydantic import BaseModel, Field
 
 
@@ -13,7 +14,10 @@ class ProcessGenerationRequest(BaseModel):
     requirements: Optional[List[str]] = Field(default=None, description="Specific requirements or constraints")
     target_audience: Optional[str] = Field(default=None, description="Who will use this process")
     complexity_level: Optional[str] = Field(default="medium", description="Simple, medium, or complex")
+    itil_area: Optional[str] = Field(default=None, description="ITIL area (e.g. 'Service Operation'); enables ITIL-enhanced generation")
+    generation_mode: Optional[str] = Field(default=None, description="'outline' to outline the process and expand the steps in parallel; with itil_area, 'template' refines a step skeleton built from the knowledge base. Default: one full completion")
     user_id: str = Field(..., description="ID of the user requesting generation")
+    deadline: Optional[datetime] = Field(default=None, description="Time the result is needed by (ISO 8601); used for deadline-aware scheduling")
     
     class Config:
         json_schema_extra = {
@@ -41,6 +45,7 @@ class RevisionRequest(BaseModel):
     improvement_goals: Optional[List[str]] = Field(default=None, description="What should be improved")
     custom_instructions: Optional[str] = Field(default=None, description="Custom revision instructions")
     user_id: str = Field(..., description="ID of the user requesting revision")
+    deadline: Optional[datetime] = Field(default=None, description="Time the result is needed by (ISO 8601); used for deadline-aware scheduling")
     
     class Config:
         json_schema_extra = {
@@ -71,6 +76,7 @@ class SIAMAnalysisRequest(BaseModel):
     organizational_maturity: Optional[str] = Field(default="medium", description="SIAM maturity level: low, medium, high")
     analysis_type: str = Field(..., description="Type of analysis: scenario, governance, integration, vendor_assessment, sla")
     user_id: str = Field(..., description="ID of the user requesting analysis")
+    deadline: Optional[datetime] = Field(default=None, description="Time the result is needed by (ISO 8601); used for deadline-aware scheduling")
     
     class Config:
         json_schema_extra = {
@@ -98,6 +104,7 @@ class GovernanceGuidanceRequest(BaseModel):
     industry_sector: Optional[str] = Field(default=None, description="Industry sector (e.g., government, finance, healthcare)")
     specific_challenges: Optional[List[str]] = Field(default=None, description="Specific governance challenges to address")
     user_id: str = Field(..., description="ID of the user requesting guidance")
+    deadline: Optional[datetime] = Field(default=None, description="Time the result is needed by (ISO 8601); used for deadline-aware scheduling")
     
     class Config:
         json_schema_extra = {
@@ -121,6 +128,7 @@ class VendorReadinessRequest(BaseModel):
     vendor_profiles: List[Dict[str, Any]] = Field(..., description="List of vendor profiles to assess")
     assessment_criteria: Optional[List[str]] = Field(default=None, description="Specific criteria for assessment")
     user_id: str = Field(..., description="ID of the user requesting assessment")
+    deadline: Optional[datetime] = Field(default=None, description="Time the result is needed by (ISO 8601); used for deadline-aware scheduling")
     
     class Config:
         json_schema_extra = {
@@ -144,6 +152,109 @@ class VendorReadinessRequest(BaseModel):
         }
 
 
+class PipelineStage(BaseModel):
+    """A single agent stage in a job pipeline"""
+    name: str = Field(..., description="Unique stage name within the pipeline")
+    agent_type: str = Field(..., description="Agent type that executes the stage")
+    request_data: Dict[str, Any] = Field(default_factory=dict, description="Request data for the stage's agent")
+    depends_on: List[str] = Field(default_factory=list, description="Stages that must complete before this stage starts")
+    inputs: Dict[str, str] = Field(
+        default_factory=dict,
+        description="Request fields filled from upstream outputs, as 'stage.path.to.value'"
+    )
+
+
+class PipelineRequest(BaseModel):
+    """Request model for a pipeline of dependent agent stages"""
+    stages: List[PipelineStage] = Field(..., description="Pipeline stages; independent stages run concurrently")
+    user_id: str = Field(..., description="ID of the user submitting the pipeline")
+    deadline: Optional[datetime] = Field(default=None, description="Time the result is needed by (ISO 8601); used for deadline-aware scheduling")
+    
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "stages": [
+                    {
+                        "name": "classify",
+                        "agent_type": "document_classifier",
+                        "request_data": {"document_content": "Faktura nr. 2024-117 fra leverandør ..."}
+                    },
+                    {
+                        "name": "generate",
+                        "agent_type": "process_generator",
+                        "depends_on": ["classify"],
+                        "inputs": {
+                            "title": "classify.suggested_processes.0.process_name",
+                            "description": "classify.suggested_processes.0.description",
+                            "category": "classify.business_category"
+                        }
+                    },
+                    {
+                        "name": "validate",
+                        "agent_type": "itil_validator",
+                        "depends_on": ["generate"],
+                        "inputs": {"process": "generate"}
+                    }
+                ],
+                "user_id": "user_123"
+            }
+        }
+
+
+class BatchJobItem(BaseModel):
+    """A single job in a batch submission"""
+    agent_type: str = Field(..., description="Type of agent to execute the job")
+    request_data: Dict[str, Any] = Field(..., description="Request data for the agent")
+    deadline: Optional[datetime] = Field(default=None, description="Time the result is needed by (ISO 8601); used for deadline-aware scheduling")
+
+
+class BatchRequest(BaseModel):
+    """Request model for bulk job submission"""
+    jobs: List[BatchJobItem] = Field(..., description="Jobs to submit; may mix agent types")
+    user_id: str = Field(..., description="ID of the user submitting the batch")
+    
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "jobs": [
+                    {
+                        "agent_type": "document_classifier",
+                        "request_data": {"document_content": "Faktura nr. 2024-117 ..."}
+                    },
+                    {
+                        "agent_type": "document_classifier",
+                        "request_data": {"document_content": "Referat fra styremøte ..."}
+                    }
+                ],
+                "user_id": "user_123"
+            }
+        }
+
+
+class ComplianceBatchRequest(BaseModel):
+    """Request model for portfolio-wide ITIL compliance validation"""
+    processes: List[Dict[str, Any]] = Field(..., description="Processes with title, description and steps; an optional id identifies each in the result")
+    include_results: bool = Field(default=False, description="Include the checks and recommendations of every process")
+    
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "processes": [
+                    {
+                        "id": "proc-17",
+                        "title": "Hendelseshåndtering",
+                        "description": "Registrering og løsning av hendelser med måling av løsningstid",
+                        "steps": [
+                            {"description": "Registrer hendelsen", "responsible_role": "Service Desk"},
+                            {"description": "Løs eller eskaler", "responsible_role": "Driftsteam"}
+                        ]
+                    }
+                ],
+                "include_results": False
+            }
+        }
+
+
 class JobRequest(BaseModel):
     """Base job request model"""
     agent_type: str = Field(..., description="Type of agent to execute the job")
@@ -1,7 +1,7 @@
 """
 Pydantic models for API responses
 """
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, List
 from datetime import datetime
 from pydantic import BaseModel, Field
 
@@ -34,6 +34,12 @@ class JobStatusResponse(BaseModel):
     started_at: Optional[datetime] = Field(default=None, description="Job start timestamp")
     completed_at: Optional[datetime] = Field(default=None, description="Job completion timestamp")
     error_message: Optional[str] = Field(default=None, description="Error message if job failed")
+    stages: Optional[Dict[str, Dict[str, Any]]] = Field(default=None, description="Per-stage status for pipeline jobs")
+    estimated_duration: Optional[int] = Field(default=None, description="Estimated seconds from submission to completion")
+    deadline: Optional[datetime] = Field(default=None, description="Requested completion deadline")
+    best_effort: Optional[bool] = Field(default=None, description="True if the deadline is not expected to be met")
+    usage: Optional[Dict[str, Any]] = Field(default=None, description="OpenAI token usage, latency and estimated cost")
+    knowledge_base_version: Optional[str] = Field(default=None, description="Knowledge-base snapshot version the job ran against")
     
     class Config:
         json_schema_extra = {
@@ -50,6 +56,35 @@ class JobStatusResponse(BaseModel):
         }
 
 
+class BatchResponse(BaseModel):
+    """Response model for batch submission"""
+    batch_id: str = Field(..., description="Unique batch identifier")
+    job_ids: List[str] = Field(..., description="IDs of the jobs created for the batch, in submission order")
+    status: str = Field(..., description="Current batch status")
+    message: str = Field(..., description="Human-readable status message")
+    
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "batch_id": "batch_abc123",
+                "job_ids": ["job_abc123", "job_def456"],
+                "status": "queued",
+                "message": "Batch with 2 jobs submitted successfully"
+            }
+        }
+
+
+class BatchStatusResponse(BaseModel):
+    """Response model for batch status queries"""
+    batch_id: str = Field(..., description="Unique batch identifier")
+    status: str = Field(..., description="Aggregated batch status: queued, running, completed, failed")
+    progress: int = Field(..., description="Average progress across the batch's jobs (0-100)")
+    total_jobs: int = Field(..., description="Number of jobs in the batch")
+    status_counts: Dict[str, int] = Field(..., description="Number of jobs per status")
+    job_ids: List[str] = Field(..., description="IDs of the jobs in the batch")
+    created_at: datetime = Field(..., description="Batch creation timestamp")
+
+
 class ProcessGenerationResult(BaseModel):
     """Result model for process generation"""
     title: str = Field(..., description="Generated process title")
@@ -0,0 +1,66 @@
+"""
+Production entrypoint for ProsessPortal AI Agents
+Runs the API with several uvicorn worker processes (uvloop/httptools when installed).
+Every process sees the same jobs through the shared job backend, so a status poll can
+land on any worker:
+
+    JOB_BACKEND_URL=redis://localhost:6379/0 python serve.py --workers 4
+"""
+import os
+import logging
+import argparse
+import importlib.util
+from dotenv import load_dotenv
+import uvicorn
+
+from services.knowledge_base import load_snapshot
+from services.structured_logging import configure_logging
+
+# Load environment variables
+load_dotenv()
+
+# Used when several API processes are started without a shared JOB_BACKEND_URL
+DEFAULT_SHARED_BACKEND_URL = "sqlite:///jobs.db"
+
+logger = logging.getLogger(__name__)
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the ProsessPortal AI Agents API")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8001)))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")),
+                        help="number of API worker processes")
+    args = parser.parse_args()
+    configure_logging()
+
+    # Worker processes inherit the environment, so they all open the same backend
+    backend_url = os.getenv("JOB_BACKEND_URL") or "memory://"
+    if args.workers > 1 and backend_url.startswith("memory://"):
+        os.environ["JOB_BACKEND_URL"] = DEFAULT_SHARED_BACKEND_URL
+        logger.warning("In-memory job backend cannot be shared by several workers, using the default shared backend",
+                       extra={"workers": args.workers, "backend_url": DEFAULT_SHARED_BACKEND_URL})
+
+    # Compile the knowledge base once, so every worker process maps the same snapshot file
+    snapshot = load_snapshot()
+    logger.info("Knowledge base snapshot ready", extra={"source": snapshot.source, "version": snapshot.version})
+
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="uvloop" if _installed("uvloop") else "asyncio",
+        http="httptools" if _installed("httptools") else "h11",
+        proxy_headers=True,
+        access_log=False,
+        log_level="info"
+    )
+
+
+if __name__ == "__main__":
+    main()
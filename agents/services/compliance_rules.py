@@ -0,0 +1,154 @@
+"""
+ITIL compliance rule engine
+The rules in data/itil/compliance-rules.json are compiled once per knowledge-base version
+into plain predicates over ProcessFeatures, a pre-tokenized view of a process that is built
+once per process however many rules look at it. Term conditions match at the start of a
+word (so "measure" also matches "measurement"). validate_batch scores whole portfolios.
+"""
+import re
+import collections
+from typing import Dict, Any, List, Callable, Iterable
+
+from services.knowledge_base import versioned_cache
+
+RULES_FILE = "itil/compliance-rules.json"
+TEXT_FIELDS = ("title", "description", "text")
+LOWEST_SCORING = 10
+
+_WORD = re.compile(r"[0-9a-zæøåäöéü]+")
+
+
+class ProcessFeatures:
+    """Words of each text field and step statistics of one process"""
+
+    __slots__ = ("words", "step_count", "steps_with", "distinct")
+
+    def __init__(self, process: Dict[str, Any], step_fields: Iterable[str] = ()):
+        steps = process.get("steps") or []
+        description = process.get("description") or ""
+        step_text = " ".join(step.get("description") or "" for step in steps)
+        self.words = {
+            "title": frozenset(_WORD.findall((process.get("title") or "").lower())),
+            "description": frozenset(_WORD.findall(description.lower()))
+        }
+        self.words["text"] = self.words["description"] | frozenset(_WORD.findall(step_text.lower()))
+        self.step_count = len(steps)
+        self.steps_with = {field: sum(1 for step in steps if step.get(field)) for field in step_fields}
+        self.distinct = {field: len({step.get(field) or "" for step in steps}) for field in step_fields}
+
+
+def _compile_condition(condition: Dict[str, Any]) -> Callable[[ProcessFeatures], bool]:
+    kind = condition.get("type")
+    if kind == "contains_any":
+        field = condition["field"]
+        if field not in TEXT_FIELDS:
+            raise ValueError(f"Unknown field '{field}' (expected one of {', '.join(TEXT_FIELDS)})")
+        prefixes = tuple(term.lower() for term in condition["terms"])
+        return lambda features: any(word.startswith(prefixes) for word in features.words[field])
+    if kind == "min_steps":
+        minimum = condition["value"]
+        return lambda features: features.step_count >= minimum
+    if kind == "min_distinct":
+        field, minimum = condition["step_field"], condition["value"]
+        return lambda features: features.distinct[field] >= minimum
+    if kind == "all_steps_have":
+        field = condition["step_field"]
+        return lambda features: features.step_count > 0 and features.steps_with[field] == features.step_count
+    raise ValueError(f"Unknown rule condition type: {kind}")
+
+
+class CompiledRule:
+    __slots__ = ("rule_id", "name", "base_score", "max_score", "recommendation", "conditions")
+
+    def __init__(self, rule: Dict[str, Any]):
+        self.rule_id = rule["id"]
+        self.name = rule.get("name", rule["id"])
+        self.base_score = float(rule.get("base_score", 0.0))
+        self.max_score = float(rule.get("max_score", 1.0))
+        self.recommendation = rule.get("recommendation", "")
+        try:
+            self.conditions = [
+                (_compile_condition(condition), condition.get("add"), condition.get("score"), condition.get("recommendation"))
+                for condition in rule.get("conditions", [])
+            ]
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"Invalid compliance rule '{self.rule_id}': {e}")
+
+    def evaluate(self, features: ProcessFeatures) -> Dict[str, Any]:
+        score = self.base_score
+        recommendation = self.recommendation
+        for matches, add, set_score, new_recommendation in self.conditions:
+            if matches(features):
+                score = set_score if set_score is not None else score + (add or 0.0)
+                recommendation = new_recommendation or recommendation
+        return {
+            "rule_id": self.rule_id,
+            "check_name": self.name,
+            "score": round(min(score, self.max_score), 4),
+            "recommendation": recommendation
+        }
+
+
+class ComplianceRuleSet:
+    """Compiled compliance rules of one knowledge-base version"""
+
+    def __init__(self, definition: Dict[str, Any]):
+        self.version = definition.get("version")
+        self.recommendation_threshold = float(definition.get("recommendation_threshold", 0.8))
+        self.rules = [CompiledRule(rule) for rule in definition.get("rules", [])]
+        # Step fields the rules look at, so features only count what is needed
+        self.step_fields = sorted({
+            condition["step_field"]
+            for rule in definition.get("rules", []) for condition in rule.get("conditions", [])
+            if "step_field" in condition
+        })
+
+    def validate(self, process: Dict[str, Any]) -> Dict[str, Any]:
+        """Compliance score, per-rule checks and recommendations for one process"""
+        features = ProcessFeatures(process, self.step_fields)
+        checks = [rule.evaluate(features) for rule in self.rules]
+        return {
+            "compliance_score": sum(check["score"] for check in checks) / len(checks) if checks else 0.0,
+            "compliance_checks": checks,
+            "recommendations": [
+                check["recommendation"] for check in checks if check["score"] < self.recommendation_threshold
+            ],
+            "missing_elements": []
+        }
+
+    def validate_batch(self, processes: List[Dict[str, Any]], include_results: bool = False) -> Dict[str, Any]:
+        """Portfolio compliance: score distribution, average per rule and the lowest-scoring processes"""
+        rule_totals: Dict[str, float] = collections.defaultdict(float)
+        scores = []
+        results = []
+        for position, process in enumerate(processes):
+            result = self.validate(process)
+            for check in result["compliance_checks"]:
+                rule_totals[check["rule_id"]] += check["score"]
+            scores.append((result["compliance_score"], process.get("id", position)))
+            if include_results:
+                results.append(dict(result, process_id=process.get("id", position)))
+
+        count = len(processes)
+        summary = {
+            "count": count,
+            "rules_version": self.version,
+            "average_score": round(sum(score for score, _ in scores) / count, 4) if count else None,
+            "min_score": round(min(score for score, _ in scores), 4) if count else None,
+            "max_score": round(max(score for score, _ in scores), 4) if count else None,
+            "below_threshold": sum(1 for score, _ in scores if score < self.recommendation_threshold),
+            "rule_averages": {rule_id: round(total / count, 4) for rule_id, total in rule_totals.items()},
+            "lowest_scoring": [
+                {"process_id": process_id, "compliance_score": round(score, 4)}
+                for score, process_id in sorted(scores, key=lambda item: item[0])[:LOWEST_SCORING]
+            ]
+        }
+        if include_results:
+            summary["results"] = results
+        return summary
+
+
+@versioned_cache
+def get_compliance_rules(snapshot) -> ComplianceRuleSet:
+    """Compliance rules of a knowledge-base version, compiled once"""
+    return ComplianceRuleSet(snapshot.get(RULES_FILE) or {})
@@ -0,0 +1,204 @@
+"""
+Online job duration estimator
+Keeps streaming latency histograms per agent type, analysis type and input-size bucket
+"""
+import math
+from typing import Dict, Any, List, Optional, Tuple
+
+
+# Prior durations (seconds) used until enough samples have been observed
+DEFAULT_DURATIONS = {
+    "process_generator": 45.0,
+    "itil_process_generator": 60.0,
+    "revision_agent": 40.0,
+    "document_classifier": 15.0,
+    "process_optimizer": 30.0,
+    "siam_specialist": 40.0,
+    "itil_validator": 1.0
+}
+FALLBACK_DURATION = 30.0
+
+# Log-spaced histogram buckets from 0.1s to roughly one hour
+BUCKET_MIN = 0.1
+BUCKET_GROWTH = 1.25
+BUCKET_COUNT = 48
+
+
+class LatencyHistogram:
+    """Log-bucketed streaming histogram with bounded weight, so recent samples dominate"""
+
+    def __init__(self, max_weight: float = 500.0):
+        self.counts = [0.0] * BUCKET_COUNT
+        self.total = 0.0
+        self.sum = 0.0
+        self.max_weight = max_weight
+
+    @staticmethod
+    def _bucket(value: float) -> int:
+        if value <= BUCKET_MIN:
+            return 0
+        index = int(math.log(value / BUCKET_MIN, BUCKET_GROWTH)) + 1
+        return min(index, BUCKET_COUNT - 1)
+
+    @staticmethod
+    def _bucket_bounds(index: int) -> Tuple[float, float]:
+        if index == 0:
+            return 0.0, BUCKET_MIN
+        return BUCKET_MIN * BUCKET_GROWTH ** (index - 1), BUCKET_MIN * BUCKET_GROWTH ** index
+
+    def observe(self, value: float):
+        """Add a sample, halving older weight once the histogram is full"""
+        if self.total >= self.max_weight:
+            self.counts = [count / 2 for count in self.counts]
+            self.total /= 2
+            self.sum /= 2
+        self.counts[self._bucket(value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Estimate the q-th percentile (0-100), interpolating inside the bucket"""
+        if self.total <= 0:
+            return None
+        target = self.total * q / 100
+        cumulative = 0.0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= target:
+                lower, upper = self._bucket_bounds(index)
+                fraction = (target - cumulative) / count
+                return lower + (upper - lower) * fraction
+            cumulative += count
+        return self._bucket_bounds(BUCKET_COUNT - 1)[1]
+
+    def mean(self) -> Optional[float]:
+        return self.sum / self.total if self.total else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"counts": list(self.counts), "total": self.total, "sum": self.sum}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LatencyHistogram":
+        histogram = cls()
+        histogram.counts = list(data["counts"])
+        histogram.total = data["total"]
+        histogram.sum = data["sum"]
+        return histogram
+
+
+def input_size(agent_type: str, request_data: Dict[str, Any]) -> Tuple[str, int]:
+    """Return the size dimension and value that best predicts an agent's duration"""
+    if agent_type == "document_classifier":
+        return "chars", len(request_data.get("document_content") or "")
+    if agent_type == "siam_specialist":
+        vendors = request_data.get("vendor_profiles")
+        return "vendors", len(vendors) if vendors else int(request_data.get("vendor_count") or 0)
+    if agent_type == "process_optimizer":
+        return "steps", len(request_data.get("process_steps") or [])
+    if agent_type in ("process_generator", "itil_process_generator", "revision_agent"):
+        items = (request_data.get("requirements") or []) + (request_data.get("feedback") or []) + \
+            (request_data.get("improvement_goals") or [])
+        return "items", len(items)
+    if agent_type == "itil_validator":
+        return "steps", len((request_data.get("process") or request_data).get("steps") or [])
+    return "items", 0
+
+
+def size_bucket(agent_type: str, request_data: Dict[str, Any]) -> str:
+    """Bucket the input size on a power-of-two scale, e.g. 'chars:1024-2047'"""
+    unit, size = input_size(agent_type, request_data)
+    if size <= 0:
+        return f"{unit}:0"
+    lower = 1 << (size.bit_length() - 1)
+    return f"{unit}:{lower}-{2 * lower - 1}"
+
+
+class DurationEstimator:
+    """Predicts job durations from observed latencies, from most to least specific key"""
+
+    def __init__(self, min_samples: int = 5):
+        self.min_samples = min_samples
+        self.histograms: Dict[Tuple[str, ...], LatencyHistogram] = {}
+
+    def _keys(self, agent_type: str, request_data: Dict[str, Any]) -> List[Tuple[str, ...]]:
+        """Histogram keys for a request, most specific first"""
+        analysis_type = request_data.get("analysis_type")
+        bucket = size_bucket(agent_type, request_data)
+        keys = [(agent_type, "*", bucket), (agent_type, "*", "*")]
+        if analysis_type:
+            keys = [(agent_type, analysis_type, bucket), (agent_type, analysis_type, "*")] + keys
+        return keys
+
+    def observe(self, agent_type: str, request_data: Dict[str, Any], duration: float):
+        """Record the run time (seconds) of a completed job"""
+        if agent_type == "pipeline":
+            return
+        for key in self._keys(agent_type, request_data):
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.observe(duration)
+
+    def estimate(self, agent_type: str, request_data: Dict[str, Any], percentile: float = 50) -> float:
+        """Estimate the run time (seconds) of a job"""
+        if agent_type == "pipeline":
+            return self._estimate_pipeline(request_data.get("stages") or [], percentile)
+
+        for key in self._keys(agent_type, request_data):
+            histogram = self.histograms.get(key)
+            if histogram and histogram.total >= self.min_samples:
+                return histogram.percentile(percentile)
+        return DEFAULT_DURATIONS.get(agent_type, FALLBACK_DURATION)
+
+    def _estimate_pipeline(self, stages: List[Dict[str, Any]], percentile: float) -> float:
+        """Estimate a pipeline as the length of its critical path"""
+        finish_times: Dict[str, float] = {}
+        remaining = list(stages)
+        while remaining:
+            progressed = False
+            for stage in list(remaining):
+                dependencies = stage.get("depends_on") or []
+                if all(dependency in finish_times for dependency in dependencies):
+                    start = max((finish_times[dependency] for dependency in dependencies), default=0.0)
+                    own = self.estimate(stage["agent_type"], stage.get("request_data") or {}, percentile)
+                    finish_times[stage["name"]] = start + own
+                    remaining.remove(stage)
+                    progressed = True
+            if not progressed:
+                break
+        return max(finish_times.values(), default=FALLBACK_DURATION)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Snapshot the histograms so other processes can merge them"""
+        return {"|".join(key): histogram.to_dict() for key, histogram in self.histograms.items()}
+
+    @classmethod
+    def merged(cls, snapshots: List[Dict[str, Any]], min_samples: int = 5) -> "DurationEstimator":
+        """Build an estimator from the snapshots of several worker processes"""
+        estimator = cls(min_samples)
+        for snapshot in snapshots:
+            for name, data in snapshot.items():
+                key = tuple(name.split("|"))
+                histogram = estimator.histograms.get(key)
+                if histogram is None:
+                    estimator.histograms[key] = LatencyHistogram.from_dict(data)
+                    continue
+                histogram.counts = [a + b for a, b in zip(histogram.counts, data["counts"])]
+                histogram.total += data["total"]
+                histogram.sum += data["sum"]
+        return estimator
+
+    def export_percentiles(self, percentiles: Tuple[float, ...] = (50, 90, 99)) -> List[Dict[str, Any]]:
+        """Export percentiles per histogram key for capacity planning"""
+        exported = []
+        for (agent_type, analysis_type, bucket), histogram in sorted(self.histograms.items()):
+            entry = {
+                "agent_type": agent_type,
+                "analysis_type": None if analysis_type == "*" else analysis_type,
+                "size_bucket": None if bucket == "*" else bucket,
+                "samples": round(histogram.total, 1),
+                "mean": round(histogram.mean(), 3)
+            }
+            for q in percentiles:
+                entry[f"p{int(q)}"] = round(histogram.percentile(q), 3)
+            exported.append(entry)
+        return exported
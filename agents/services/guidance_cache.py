@@ -0,0 +1,166 @@
+"""
+Precomputed SIAM governance guidance
+Governance guidance depends only on vendor count, service complexity and organisational
+maturity, so the answers for the common combinations are generated ahead of time by a
+warm-up job and stored in one JSON file per knowledge-base version (GUIDANCE_CACHE_DIR,
+default data/guidance-cache). Every entry records a hash of the prompt it answers, so an
+edited prompt or knowledge base misses instead of serving stale guidance. Misses fall back
+to a live call. Answers for inputs on the precomputed grid (is_cacheable) are then kept in
+memory for the knowledge-base version; other inputs are answered live every time, so
+callers cannot grow the cache.
+
+    python -m services.guidance_cache warm --vendors 2-10 --threads 4
+    python -m services.guidance_cache info
+"""
+import os
+import sys
+import json
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from services.knowledge_base import DATA_DIR, get_knowledge_base, versioned_cache
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ("low", "medium", "high")
+DEFAULT_VENDOR_COUNTS = tuple(range(2, 11))
+
+
+def default_cache_dir() -> Path:
+    return Path(os.getenv("GUIDANCE_CACHE_DIR") or DATA_DIR / "guidance-cache")
+
+
+def normalize_level(level: str) -> str:
+    return (level or "").strip().lower()
+
+
+def guidance_key(vendor_count: int, service_complexity: str, org_maturity: str) -> str:
+    return f"{int(vendor_count)}:{normalize_level(service_complexity)}:{normalize_level(org_maturity)}"
+
+
+def is_cacheable(vendor_count: int, service_complexity: str, org_maturity: str) -> bool:
+    """Whether live answers for these inputs may be kept: only the grid the warm-up covers by default"""
+    return (int(vendor_count) in DEFAULT_VENDOR_COUNTS and normalize_level(service_complexity) in LEVELS
+            and normalize_level(org_maturity) in LEVELS)
+
+
+def prompt_hash(messages: List[Dict[str, str]]) -> str:
+    return hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class GuidanceCache:
+    """Governance guidance of one knowledge-base version, read from (and saved to) its cache file"""
+
+    def __init__(self, version: str, cache_dir: Path):
+        self.version = version
+        self.path = Path(cache_dir) / f"governance-{version}.json"
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._loaded_mtime: Optional[float] = None
+        self._lock = threading.Lock()
+        self._refresh()
+
+    def _read_file(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f).get("entries", {})
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable guidance cache", extra={"path": str(self.path), "error": str(e)})
+            return {}
+
+    def _refresh(self):
+        """Pick up entries written by a warm-up job since the file was last read"""
+        try:
+            mtime = self.path.stat().st_mtime
+        except OSError:
+            return
+        if mtime != self._loaded_mtime:
+            with self._lock:
+                self._entries.update(self._read_file())
+                self._loaded_mtime = mtime
+
+    def get(self, key: str, prompt_sha: str) -> Optional[Dict[str, Any]]:
+        """The stored answer for key, if it was generated from the same prompt"""
+        entry = self._entries.get(key)
+        if entry is None or entry["prompt_sha"] != prompt_sha:
+            self._refresh()
+            entry = self._entries.get(key)
+        return entry if entry is not None and entry["prompt_sha"] == prompt_sha else None
+
+    def put(self, key: str, prompt_sha: str, guidance: str, model: str, persist: bool = False) -> Dict[str, Any]:
+        """Store an answer in memory, and in the cache file when persist is set"""
+        entry = {
+            "prompt_sha": prompt_sha,
+            "guidance": guidance,
+            "model": model,
+            "generated_at": datetime.utcnow().isoformat()
+        }
+        with self._lock:
+            self._entries[key] = entry
+            if persist:
+                self._save(key, entry)
+        return entry
+
+    def _save(self, key: str, entry: Dict[str, Any]):
+        # Merge into what is on disk, so concurrent warm-ups of other keys are kept
+        entries = self._read_file()
+        entries[key] = entry
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", dir=self.path.parent, suffix=".tmp", delete=False, encoding="utf-8") as f:
+                json.dump({"knowledge_base_version": self.version, "entries": entries}, f, ensure_ascii=False, indent=1)
+            os.replace(f.name, self.path)
+            self._loaded_mtime = self.path.stat().st_mtime
+        except OSError as e:
+            logger.warning("Could not write guidance cache", extra={"path": str(self.path), "error": str(e)})
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+@versioned_cache
+def get_guidance_cache(snapshot, cache_dir: Optional[str] = None) -> GuidanceCache:
+    """Governance guidance cache of a knowledge-base version, read from disk once"""
+    return GuidanceCache(snapshot.version, Path(cache_dir or default_cache_dir()))
+
+
+def _parse_vendor_counts(value: str) -> List[int]:
+    counts = []
+    for part in value.split(","):
+        low, _, high = part.partition("-")
+        counts.extend(range(int(low), int(high or low) + 1))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute or inspect the SIAM governance guidance cache")
+    parser.add_argument("command", choices=["warm", "info"])
+    parser.add_argument("--vendors", type=_parse_vendor_counts, default=list(DEFAULT_VENDOR_COUNTS),
+                        help="vendor counts to precompute, e.g. 2-10 or 2,3,5")
+    parser.add_argument("--threads", type=int, default=4, help="guidance calls made in parallel")
+    parser.add_argument("--refresh", action="store_true", help="regenerate entries that are already cached")
+    args = parser.parse_args()
+
+    if args.command == "warm":
+        from agents.siam_specialist import SIAMSpecialistAgent
+
+        outcomes = SIAMSpecialistAgent().precompute_governance_guidance(args.vendors, args.threads, args.refresh)
+        cache = get_guidance_cache(get_knowledge_base())
+        print(f"✅ Governance guidance for knowledge base {cache.version}: {outcomes['generated']} generated, "
+              f"{outcomes['cached']} already cached, {outcomes['failed']} failed ({cache.path})")
+        return 1 if outcomes["failed"] else 0
+
+    cache = get_guidance_cache(get_knowledge_base())
+    print(f"Guidance cache {cache.path}: {len(cache)} entries for knowledge base {cache.version}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
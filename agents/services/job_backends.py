@@ -0,0 +1,482 @@
+"""
+Pluggable storage and queueing backends for the job queue
+The in-memory backend serves a single process; the SQLite and Redis backends let
+API and worker processes share one job table and queue
+"""
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import itertools
+import threading
+from typing import Dict, Any, List, Optional
+
+from services.jobs import Job, Batch
+
+
+class JobBackend:
+    """Interface for job storage and the priority queue shared by API and worker processes"""
+
+    # True if other processes can see the same jobs and queue
+    shared = False
+
+    async def save_job(self, job: Job):
+        raise NotImplementedError
+
+    async def get_jobs(self, job_ids: List[str]) -> List[Optional[Job]]:
+        raise NotImplementedError
+
+    async def get_job(self, job_id: str) -> Optional[Job]:
+        return (await self.get_jobs([job_id]))[0]
+
+    async def save_batch(self, batch: Batch):
+        raise NotImplementedError
+
+    async def get_batch(self, batch_id: str) -> Optional[Batch]:
+        raise NotImplementedError
+
+    async def enqueue(self, jobs: List[Job], scores: List[float]):
+        """Store and queue jobs atomically; lower scores are dequeued first"""
+        raise NotImplementedError
+
+    async def dequeue(self, timeout: float, owner: str, lease_seconds: float) -> Optional[Job]:
+        """
+        Pop the lowest-scored job, waiting up to timeout seconds, and lease it to the owner.
+        The lease must be renewed before it expires or the job is handed to the reaper.
+        """
+        raise NotImplementedError
+
+    async def renew_leases(self, owner: str, job_ids: List[str], lease_seconds: float) -> List[str]:
+        """Extend the owner's leases and return the job ids it still holds"""
+        raise NotImplementedError
+
+    async def release_lease(self, job_id: str, owner: str) -> bool:
+        """Drop a lease when its job finishes; False if the owner no longer held it"""
+        raise NotImplementedError
+
+    async def claim_expired_leases(self, now: float) -> List[str]:
+        """Remove leases that expired before now and return their job ids (each is claimed once)"""
+        raise NotImplementedError
+
+    async def work_ahead(self, score: float) -> float:
+        """Sum of estimated run times of queued jobs with a score at or below the given one"""
+        raise NotImplementedError
+
+    async def queue_depth(self) -> int:
+        raise NotImplementedError
+
+    async def job_count(self) -> int:
+        """Number of job records held by the backend"""
+        raise NotImplementedError
+
+    async def increment_counter(self, name: str, field: str, amount: int = 1):
+        raise NotImplementedError
+
+    async def get_counters(self, name: str) -> Dict[str, int]:
+        raise NotImplementedError
+
+    async def save_stats(self, name: str, data: Dict[str, Any]):
+        raise NotImplementedError
+
+    async def load_stats(self, prefix: str) -> Dict[str, Dict[str, Any]]:
+        """Load all stats snapshots whose name starts with prefix"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InMemoryJobBackend(JobBackend):
+    """Process-local backend; jobs are kept as live objects"""
+
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self.batches: Dict[str, Batch] = {}
+        # Entries are (score, sequence, job_id); the sequence keeps FIFO order among equal scores
+        self.queue = asyncio.PriorityQueue()
+        self.queued: Dict[str, tuple] = {}
+        # Leases are job_id -> (owner, expiry as epoch seconds)
+        self.leases: Dict[str, tuple] = {}
+        self._sequence = itertools.count()
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self.stats: Dict[str, Dict[str, Any]] = {}
+
+    async def save_job(self, job: Job):
+        self.jobs[job.job_id] = job
+
+    async def get_jobs(self, job_ids: List[str]) -> List[Optional[Job]]:
+        return [self.jobs.get(job_id) for job_id in job_ids]
+
+    async def save_batch(self, batch: Batch):
+        self.batches[batch.batch_id] = batch
+
+    async def get_batch(self, batch_id: str) -> Optional[Batch]:
+        return self.batches.get(batch_id)
+
+    async def enqueue(self, jobs: List[Job], scores: List[float]):
+        for job, score in zip(jobs, scores):
+            self.jobs[job.job_id] = job
+            self.queued[job.job_id] = (score, job.estimated_runtime)
+            self.queue.put_nowait((score, next(self._sequence), job.job_id))
+
+    async def dequeue(self, timeout: float, owner: str, lease_seconds: float) -> Optional[Job]:
+        try:
+            _, _, job_id = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.queued.pop(job_id, None)
+        self.leases[job_id] = (owner, time.time() + lease_seconds)
+        return self.jobs.get(job_id)
+
+    async def renew_leases(self, owner: str, job_ids: List[str], lease_seconds: float) -> List[str]:
+        held = [job_id for job_id in job_ids if self.leases.get(job_id, (None,))[0] == owner]
+        for job_id in held:
+            self.leases[job_id] = (owner, time.time() + lease_seconds)
+        return held
+
+    async def release_lease(self, job_id: str, owner: str) -> bool:
+        if self.leases.get(job_id, (None,))[0] != owner:
+            return False
+        del self.leases[job_id]
+        return True
+
+    async def claim_expired_leases(self, now: float) -> List[str]:
+        expired = [job_id for job_id, (_, expires) in self.leases.items() if expires < now]
+        for job_id in expired:
+            del self.leases[job_id]
+        return expired
+
+    async def work_ahead(self, score: float) -> float:
+        return sum(runtime for queued_score, runtime in self.queued.values() if queued_score <= score)
+
+    async def queue_depth(self) -> int:
+        return len(self.queued)
+
+    async def job_count(self) -> int:
+        return len(self.jobs)
+
+    async def increment_counter(self, name: str, field: str, amount: int = 1):
+        counters = self.counters.setdefault(name, {})
+        counters[field] = counters.get(field, 0) + amount
+
+    async def get_counters(self, name: str) -> Dict[str, int]:
+        return dict(self.counters.get(name, {}))
+
+    async def save_stats(self, name: str, data: Dict[str, Any]):
+        self.stats[name] = data
+
+    async def load_stats(self, prefix: str) -> Dict[str, Dict[str, Any]]:
+        return {name: data for name, data in self.stats.items() if name.startswith(prefix)}
+
+
+class SQLiteJobBackend(JobBackend):
+    """
+    Local multi-process backend on a single SQLite file (WAL mode), so several
+    worker processes on one node can share jobs without running Redis
+    """
+
+    shared = True
+
+    def __init__(self, path: str, poll_interval: float = 0.1):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, data TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS batches (batch_id TEXT PRIMARY KEY, data TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS queue (job_id TEXT PRIMARY KEY, score REAL NOT NULL, runtime REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS queue_score ON queue (score);
+            CREATE TABLE IF NOT EXISTS leases (job_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS counters (name TEXT, field TEXT, value INTEGER NOT NULL, PRIMARY KEY (name, field));
+            CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, data TEXT NOT NULL);
+        """)
+
+    def _run(self, statements):
+        """Run (sql, params) statements in one transaction and return the last result rows"""
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                rows = []
+                for sql, params in statements:
+                    rows = cursor.execute(sql, params).fetchall()
+                cursor.execute("COMMIT")
+                return rows
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    async def _execute(self, *statements):
+        return await asyncio.to_thread(self._run, statements)
+
+    async def save_job(self, job: Job):
+        await self._execute(
+            ("INSERT OR REPLACE INTO jobs (job_id, data) VALUES (?, ?)", (job.job_id, json.dumps(job.to_dict(), default=str)))
+        )
+
+    async def get_jobs(self, job_ids: List[str]) -> List[Optional[Job]]:
+        if not job_ids:
+            return []
+        placeholders = ",".join("?" * len(job_ids))
+        rows = await self._execute((f"SELECT job_id, data FROM jobs WHERE job_id IN ({placeholders})", tuple(job_ids)))
+        found = {job_id: Job.from_dict(json.loads(data)) for job_id, data in rows}
+        return [found.get(job_id) for job_id in job_ids]
+
+    async def save_batch(self, batch: Batch):
+        await self._execute(
+            ("INSERT OR REPLACE INTO batches (batch_id, data) VALUES (?, ?)", (batch.batch_id, json.dumps(batch.to_dict())))
+        )
+
+    async def get_batch(self, batch_id: str) -> Optional[Batch]:
+        rows = await self._execute(("SELECT data FROM batches WHERE batch_id = ?", (batch_id,)))
+        return Batch.from_dict(json.loads(rows[0][0])) if rows else None
+
+    async def enqueue(self, jobs: List[Job], scores: List[float]):
+        statements = []
+        for job, score in zip(jobs, scores):
+            statements.append(("INSERT OR REPLACE INTO jobs (job_id, data) VALUES (?, ?)",
+                               (job.job_id, json.dumps(job.to_dict(), default=str))))
+            statements.append(("INSERT OR REPLACE INTO queue (job_id, score, runtime) VALUES (?, ?, ?)",
+                               (job.job_id, score, job.estimated_runtime)))
+        await self._execute(*statements)
+
+    def _pop(self, owner: str, lease_seconds: float) -> Optional[Job]:
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                row = cursor.execute("SELECT job_id FROM queue ORDER BY score LIMIT 1").fetchone()
+                job = None
+                if row:
+                    cursor.execute("DELETE FROM queue WHERE job_id = ?", row)
+                    cursor.execute("INSERT OR REPLACE INTO leases (job_id, owner, expires) VALUES (?, ?, ?)",
+                                   (row[0], owner, time.time() + lease_seconds))
+                    data = cursor.execute("SELECT data FROM jobs WHERE job_id = ?", row).fetchone()
+                    job = Job.from_dict(json.loads(data[0])) if data else None
+                cursor.execute("COMMIT")
+                return job
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    async def dequeue(self, timeout: float, owner: str, lease_seconds: float) -> Optional[Job]:
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await asyncio.to_thread(self._pop, owner, lease_seconds)
+            if job or time.monotonic() >= deadline:
+                return job
+            await asyncio.sleep(self.poll_interval)
+
+    async def renew_leases(self, owner: str, job_ids: List[str], lease_seconds: float) -> List[str]:
+        if not job_ids:
+            return []
+        placeholders = ",".join("?" * len(job_ids))
+        rows = await self._execute((
+            f"UPDATE leases SET expires = ? WHERE owner = ? AND job_id IN ({placeholders}) RETURNING job_id",
+            (time.time() + lease_seconds, owner, *job_ids)
+        ))
+        return [row[0] for row in rows]
+
+    async def release_lease(self, job_id: str, owner: str) -> bool:
+        rows = await self._execute(("DELETE FROM leases WHERE job_id = ? AND owner = ? RETURNING job_id", (job_id, owner)))
+        return bool(rows)
+
+    async def claim_expired_leases(self, now: float) -> List[str]:
+        rows = await self._execute(("DELETE FROM leases WHERE expires < ? RETURNING job_id", (now,)))
+        return [row[0] for row in rows]
+
+    async def work_ahead(self, score: float) -> float:
+        rows = await self._execute(("SELECT COALESCE(SUM(runtime), 0) FROM queue WHERE score <= ?", (score,)))
+        return rows[0][0]
+
+    async def queue_depth(self) -> int:
+        rows = await self._execute(("SELECT COUNT(*) FROM queue", ()))
+        return rows[0][0]
+
+    async def job_count(self) -> int:
+        rows = await self._execute(("SELECT COUNT(*) FROM jobs", ()))
+        return rows[0][0]
+
+    async def increment_counter(self, name: str, field: str, amount: int = 1):
+        await self._execute((
+            "INSERT INTO counters (name, field, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (name, field) DO UPDATE SET value = value + excluded.value",
+            (name, field, amount)
+        ))
+
+    async def get_counters(self, name: str) -> Dict[str, int]:
+        rows = await self._execute(("SELECT field, value FROM counters WHERE name = ?", (name,)))
+        return dict(rows)
+
+    async def save_stats(self, name: str, data: Dict[str, Any]):
+        await self._execute(("INSERT OR REPLACE INTO stats (name, data) VALUES (?, ?)", (name, json.dumps(data))))
+
+    async def load_stats(self, prefix: str) -> Dict[str, Dict[str, Any]]:
+        rows = await self._execute(("SELECT name, data FROM stats WHERE substr(name, 1, ?) = ?", (len(prefix), prefix)))
+        return {name: json.loads(data) for name, data in rows}
+
+    async def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+# Lease bookkeeping runs as scripts so that popping, renewing and reaping are atomic
+_POP_AND_LEASE = """
+local popped = redis.call('ZPOPMIN', KEYS[1])
+if #popped == 0 then return false end
+local job_id = popped[1]
+redis.call('HDEL', KEYS[2], job_id)
+redis.call('ZADD', KEYS[3], ARGV[1], job_id)
+redis.call('HSET', KEYS[4], job_id, ARGV[2])
+return job_id
+"""
+_RENEW_LEASES = """
+local held = {}
+for i = 3, #ARGV do
+    if redis.call('HGET', KEYS[2], ARGV[i]) == ARGV[1] then
+        redis.call('ZADD', KEYS[1], ARGV[2], ARGV[i])
+        table.insert(held, ARGV[i])
+    end
+end
+return held
+"""
+_RELEASE_LEASE = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then return 0 end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+return 1
+"""
+_CLAIM_EXPIRED = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[1])
+for _, job_id in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], job_id)
+    redis.call('HDEL', KEYS[2], job_id)
+end
+return expired
+"""
+
+
+class RedisJobBackend(JobBackend):
+    """Redis-compatible backend (Redis, Valkey, KeyDB) for API and workers on many nodes"""
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str = "prosessportal", poll_interval: float = 0.2):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise ImportError("The Redis job backend requires the 'redis' package (pip install redis)")
+
+        self.client = redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.poll_interval = poll_interval
+        self._pop_and_lease = self.client.register_script(_POP_AND_LEASE)
+        self._renew_leases = self.client.register_script(_RENEW_LEASES)
+        self._release_lease = self.client.register_script(_RELEASE_LEASE)
+        self._claim_expired = self.client.register_script(_CLAIM_EXPIRED)
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    async def save_job(self, job: Job):
+        await self.client.set(self._key("job", job.job_id), json.dumps(job.to_dict(), default=str))
+
+    async def get_jobs(self, job_ids: List[str]) -> List[Optional[Job]]:
+        if not job_ids:
+            return []
+        values = await self.client.mget([self._key("job", job_id) for job_id in job_ids])
+        return [Job.from_dict(json.loads(value)) if value else None for value in values]
+
+    async def save_batch(self, batch: Batch):
+        await self.client.set(self._key("batch", batch.batch_id), json.dumps(batch.to_dict()))
+
+    async def get_batch(self, batch_id: str) -> Optional[Batch]:
+        value = await self.client.get(self._key("batch", batch_id))
+        return Batch.from_dict(json.loads(value)) if value else None
+
+    async def enqueue(self, jobs: List[Job], scores: List[float]):
+        async with self.client.pipeline(transaction=True) as pipe:
+            for job, score in zip(jobs, scores):
+                pipe.set(self._key("job", job.job_id), json.dumps(job.to_dict(), default=str))
+                pipe.sadd(self._key("job_ids"), job.job_id)
+                pipe.hset(self._key("queue", "runtime"), job.job_id, job.estimated_runtime)
+                pipe.zadd(self._key("queue"), {job.job_id: score})
+            await pipe.execute()
+
+    def _lease_keys(self) -> List[str]:
+        return [self._key("leases"), self._key("leases", "owner")]
+
+    async def dequeue(self, timeout: float, owner: str, lease_seconds: float) -> Optional[Job]:
+        deadline = time.monotonic() + timeout
+        keys = [self._key("queue"), self._key("queue", "runtime")] + self._lease_keys()
+        while True:
+            job_id = await self._pop_and_lease(keys=keys, args=[time.time() + lease_seconds, owner])
+            if job_id:
+                return await self.get_job(job_id)
+            if time.monotonic() >= deadline:
+                return None
+            await asyncio.sleep(self.poll_interval)
+
+    async def renew_leases(self, owner: str, job_ids: List[str], lease_seconds: float) -> List[str]:
+        if not job_ids:
+            return []
+        return await self._renew_leases(keys=self._lease_keys(), args=[owner, time.time() + lease_seconds, *job_ids])
+
+    async def release_lease(self, job_id: str, owner: str) -> bool:
+        return bool(await self._release_lease(keys=self._lease_keys(), args=[job_id, owner]))
+
+    async def claim_expired_leases(self, now: float) -> List[str]:
+        return await self._claim_expired(keys=self._lease_keys(), args=[now])
+
+    async def work_ahead(self, score: float) -> float:
+        job_ids = await self.client.zrangebyscore(self._key("queue"), "-inf", score)
+        if not job_ids:
+            return 0.0
+        runtimes = await self.client.hmget(self._key("queue", "runtime"), job_ids)
+        return sum(float(runtime) for runtime in runtimes if runtime)
+
+    async def queue_depth(self) -> int:
+        return await self.client.zcard(self._key("queue"))
+
+    async def job_count(self) -> int:
+        return await self.client.scard(self._key("job_ids"))
+
+    async def increment_counter(self, name: str, field: str, amount: int = 1):
+        await self.client.hincrby(self._key("counters", name), field, amount)
+
+    async def get_counters(self, name: str) -> Dict[str, int]:
+        values = await self.client.hgetall(self._key("counters", name))
+        return {field: int(value) for field, value in values.items()}
+
+    async def save_stats(self, name: str, data: Dict[str, Any]):
+        await self.client.set(self._key("stats", name), json.dumps(data))
+
+    async def load_stats(self, prefix: str) -> Dict[str, Dict[str, Any]]:
+        keys = [key async for key in self.client.scan_iter(match=self._key("stats", prefix) + "*")]
+        if not keys:
+            return {}
+        values = await self.client.mget(keys)
+        offset = len(self._key("stats", ""))
+        return {key[offset:]: json.loads(value) for key, value in zip(keys, values) if value}
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def create_job_backend(url: Optional[str] = None) -> JobBackend:
+    """
+    Create a backend from a URL (default JOB_BACKEND_URL):
+    memory://, sqlite:///path/to/jobs.db or redis://host:6379/0
+    """
+    url = url or os.getenv("JOB_BACKEND_URL") or "memory://"
+    if url.startswith("memory://"):
+        return InMemoryJobBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteJobBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisJobBackend(url, prefix=os.getenv("JOB_BACKEND_PREFIX", "prosessportal"))
+    raise ValueError(f"Unsupported job backend URL: {url}")
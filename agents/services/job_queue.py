@@ -1,83 +1,445 @@
 """
-Simple in-memory job queue for AI agent tasks
-In production, this would be replaced with Redis or similar
+Job queue for AI agent tasks
+Jobs and the queue live in a pluggable backend (see services/job_backends.py), so the
+API and any number of worker processes can share them
 """
+import os
+import time
+import socket
+import logging
 import asyncio
 import uuid
-from datetime import datetime
-from typing import Dict, Any, Optional
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
 from enum import Enum
 from dotenv import load_dotenv
+from services.duration_estimator import DurationEstimator
+from services.job_backends import JobBackend, create_job_backend
+from services.jobs import Job, Batch, JobStatus, _to_timestamp
+from services.structured_logging import ProgressSampler, log_context
+from services.profiling import PROFILER
+from services.usage import UsageAccountant, usage_scope
+from services.knowledge_base import pin_knowledge_base
+from services.tracing import build_timeline, collect_spans, start_span, record_span, current_traceparent, new_traceparent
+from services.metrics import (
+    JOB_QUEUE_WAIT_SECONDS, JOB_DURATION_SECONDS, JOB_QUEUE_DEPTH, JOBS_IN_FLIGHT, JOB_TABLE_SIZE
+)
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
-class JobStatus(str, Enum):
-    QUEUED = "queued"
-    RUNNING = "running" 
-    COMPLETED = "completed"
-    FAILED = "failed"
 
+# Agent type used for server-side pipelines of dependent agent stages
+PIPELINE_AGENT_TYPE = "pipeline"
 
-class Job:
-    def __init__(self, job_id: str, agent_type: str, request_data: Dict[str, Any], user_id: str):
-        self.job_id = job_id
-        self.agent_type = agent_type
-        self.request_data = request_data
-        self.user_id = user_id
-        self.status = JobStatus.QUEUED
-        self.progress = 0
-        self.message = "Job queued"
-        self.created_at = datetime.utcnow()
-        self.started_at: Optional[datetime] = None
-        self.completed_at: Optional[datetime] = None
-        self.error_message: Optional[str] = None
-        self.result: Optional[Dict[str, Any]] = None
+# Agent types that can be executed by the worker (and used as pipeline stages)
+SUPPORTED_AGENT_TYPES = {
+    "process_generator",
+    "itil_process_generator",
+    "revision_agent",
+    "document_classifier",
+    "process_optimizer",
+    "siam_specialist",
+    "itil_validator"
+}
+
+# Queue score offsets for EDF: feasible deadlines first, then jobs without a deadline
+# (in arrival order), then best-effort jobs by deadline. Epoch seconds stay well below 1e10.
+NO_DEADLINE_SCORE_OFFSET = 1e10
+BEST_EFFORT_SCORE_OFFSET = 2e10
+
+# How often API processes re-merge the duration histograms published by workers
+ESTIMATOR_REFRESH_SECONDS = 30.0
+
+DEADLINE_OUTCOMES = ("submitted", "rejected", "best_effort", "met", "missed")
+
+
+class QueueFullError(Exception):
+    """Raised when admission control rejects a job because the backlog is too long"""
+
+
+class QueueClosedError(QueueFullError):
+    """Raised when a job is submitted while the queue is draining for shutdown"""
+
+
+class DeadlineUnachievableError(Exception):
+    """Raised when a job's deadline cannot be met and the deadline policy is 'reject'"""
+
+
+class SchedulingMode(str, Enum):
+    FIFO = "fifo"
+    EDF = "edf"  # Earliest deadline first
+
+
+class DeadlinePolicy(str, Enum):
+    REJECT = "reject"
+    BEST_EFFORT = "best_effort"
 
 
 class JobQueue:
-    def __init__(self):
-        self.jobs: Dict[str, Job] = {}
-        self.queue = asyncio.Queue()
-        self.worker_task: Optional[asyncio.Task] = None
+    def __init__(self, agents: Optional[Dict[str, Any]] = None, scheduling_mode: Optional[str] = None,
+                 backend: Optional[JobBackend] = None, concurrency: Optional[int] = None):
+        # Jobs, batches, the queue and shared counters (JOB_BACKEND_URL, in-memory by default)
+        self.backend = backend or create_job_backend()
+        self.scheduling_mode = SchedulingMode(scheduling_mode or os.getenv("JOB_SCHEDULING_MODE", "fifo"))
+        self.deadline_policy = DeadlinePolicy(os.getenv("JOB_DEADLINE_POLICY", "best_effort"))
+        self.worker_tasks: List[asyncio.Task] = []
+        self.background_tasks: List[asyncio.Task] = []
+        self.concurrency = concurrency or int(os.getenv("JOB_WORKER_CONCURRENCY", "1"))
+        self.worker_id = os.getenv("JOB_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
         self.is_running = False
+        self.accepting = True
+        # In-flight jobs get this long to finish on shutdown before they are requeued
+        self.drain_seconds = float(os.getenv("JOB_DRAIN_SECONDS", "30"))
+        # Agent instances keyed by agent type (created by the worker if not given)
+        self.agents = agents
+        # Learned durations drive estimates and admission control; with a shared backend,
+        # workers publish their histograms and the API plans with the merged view
+        self.duration_estimator = DurationEstimator()
+        self._merged_estimator: Optional[DurationEstimator] = None
+        self._merged_at = 0.0
+        max_backlog = os.getenv("JOB_QUEUE_MAX_BACKLOG_SECONDS")
+        self.max_backlog_seconds: Optional[float] = float(max_backlog) if max_backlog else None
+        # Workers hold a lease on each job they run and renew it with heartbeats; jobs whose
+        # lease expires (crashed or stalled worker) are requeued, up to max_attempts runs
+        self.lease_seconds = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+        self.job_timeout_seconds = float(os.getenv("JOB_TIMEOUT_SECONDS", "900"))
+        self.max_attempts = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+        self.active_jobs: Dict[str, asyncio.Task] = {}
+        self._lost_leases = set()
+        # Progress ticks are logged at most once per interval per job
+        self.progress_sampler = ProgressSampler(float(os.getenv("LOG_PROGRESS_INTERVAL_SECONDS", "5")))
+        # OpenAI usage per user and agent, flushed to the backend's shared counters
+        self.usage = UsageAccountant(self.backend)
 
-    async def initialize(self):
-        """Initialize the job queue and start worker"""
+    async def initialize(self, run_worker: bool = True):
+        """Initialize the job queue and start workers (skipped for API-only processes)"""
         self.is_running = True
-        self.worker_task = asyncio.create_task(self._worker())
-        print("✅ Job queue initialized and worker started")
+        self.accepting = True
+        self.background_tasks = [asyncio.create_task(self._reaper()), asyncio.create_task(self.usage.run())]
+        if not run_worker:
+            logger.info("Job queue initialized (API only, jobs run in separate worker processes)")
+            return
+        
+        if self.agents is None:
+            self.agents = self._create_agents()
+        self.worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        self.background_tasks.append(asyncio.create_task(self._heartbeat()))
+        logger.info("Job queue initialized", extra={"worker_id": self.worker_id, "concurrency": self.concurrency})
+
+    async def cleanup(self, grace_seconds: Optional[float] = None):
+        """Drain the workers, then stop heartbeats and the reaper and close the backend"""
+        await self.drain(self.drain_seconds if grace_seconds is None else grace_seconds)
+        for task in self.background_tasks:
+            task.cancel()
+        for task in self.background_tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.background_tasks = []
+        try:
+            await self.usage.flush()
+        except Exception:
+            logger.exception("Failed to flush usage counters")
+        await self.backend.close()
+        logger.info("Job queue cleaned up")
 
-    async def cleanup(self):
-        """Cleanup the job queue"""
+    async def drain(self, grace_seconds: float):
+        """
+        Stop accepting and dequeuing jobs, give in-flight jobs the grace period to finish,
+        then interrupt the rest; interrupted jobs are requeued with their pipeline checkpoints
+        """
+        self.accepting = False
         self.is_running = False
-        if self.worker_task:
-            self.worker_task.cancel()
+        if not self.worker_tasks:
+            return
+        
+        # Idle workers stop right away; a job popped during shutdown is recovered by lease expiry
+        busy = set(self.active_jobs.values())
+        pending = {task for task in self.worker_tasks if task not in busy}
+        if busy:
+            logger.info("Draining in-flight jobs", extra={"in_flight": len(busy), "grace_seconds": grace_seconds})
+            _, still_running = await asyncio.wait(busy, timeout=grace_seconds)
+            pending |= still_running
+        for task in pending:
+            task.cancel()
+        for task in pending:
             try:
-                await self.worker_task
+                await task
             except asyncio.CancelledError:
                 pass
-        print("✅ Job queue cleaned up")
+        self.worker_tasks = []
 
-    async def submit_job(self, agent_type: str, request_data: Dict[str, Any], user_id: str) -> str:
+    async def submit_job(self, agent_type: str, request_data: Dict[str, Any], user_id: str,
+                         deadline: Optional[datetime] = None) -> str:
         """Submit a new job to the queue"""
+        self._check_accepting()
         job_id = f"job_{uuid.uuid4().hex[:8]}"
-        job = Job(job_id, agent_type, request_data, user_id)
-        
-        self.jobs[job_id] = job
-        await self.queue.put(job)
+        job = Job(job_id, agent_type, request_data, user_id, deadline)
+        job.traceparent = current_traceparent() or new_traceparent()
+        scores = await self._admit([job])
+        await self.backend.enqueue([job], scores)
         
-        print(f"📝 Job {job_id} submitted for agent type: {agent_type}")
+        logger.info("Job submitted", extra={
+            "job_id": job_id, "agent_type": agent_type, "user_id": user_id, "estimated_duration": job.estimated_duration
+        })
         return job_id
 
+    async def submit_pipeline(self, stages: List[Dict[str, Any]], user_id: str,
+                              deadline: Optional[datetime] = None) -> str:
+        """Submit a pipeline of dependent agent stages as a single job"""
+        stages = [dict(stage) for stage in stages]
+        self._validate_pipeline(stages)
+        return await self.submit_job(PIPELINE_AGENT_TYPE, {"stages": stages}, user_id, deadline)
+
+    async def submit_batch(self, items: List[Dict[str, Any]], user_id: str) -> str:
+        """Submit many jobs of mixed agent types at once; either all are queued or none"""
+        self._check_accepting()
+        if not items:
+            raise ValueError("Batch must contain at least one job")
+        
+        # Validate every item before anything is queued
+        for index, item in enumerate(items):
+            agent_type = item.get("agent_type")
+            if agent_type == PIPELINE_AGENT_TYPE:
+                try:
+                    self._validate_pipeline((item.get("request_data") or {}).get("stages") or [])
+                except ValueError as e:
+                    raise ValueError(f"Batch item {index}: {str(e)}")
+            elif agent_type not in SUPPORTED_AGENT_TYPES:
+                raise ValueError(f"Batch item {index}: unsupported agent type '{agent_type}'")
+        
+        batch_id = f"batch_{uuid.uuid4().hex[:8]}"
+        jobs = [
+            Job(
+                f"job_{uuid.uuid4().hex[:8]}",
+                item["agent_type"],
+                item.get("request_data") or {},
+                (item.get("request_data") or {}).get("user_id") or user_id,
+                item.get("deadline")
+            )
+            for item in items
+        ]
+        for job in jobs:
+            job.traceparent = current_traceparent() or new_traceparent()
+        
+        scores = await self._admit(jobs)
+        
+        # The batch record is stored first so results can be streamed as soon as jobs run
+        await self.backend.save_batch(Batch(batch_id, [job.job_id for job in jobs], user_id))
+        await self.backend.enqueue(jobs, scores)
+        
+        logger.info("Batch submitted", extra={"batch_id": batch_id, "user_id": user_id, "jobs": len(jobs)})
+        return batch_id
+
+    def _check_accepting(self):
+        if not self.accepting:
+            raise QueueClosedError("Job queue is shutting down and not accepting new jobs")
+
+    async def get_estimated_duration(self, job_id: str) -> Optional[int]:
+        """Get the estimated time (seconds) until a job completes, including queue wait"""
+        job = await self.backend.get_job(job_id)
+        return job.estimated_duration if job else None
+
+    async def get_duration_percentiles(self) -> Dict[str, Any]:
+        """Export learned duration percentiles for capacity planning"""
+        estimator = await self._planning_estimator(refresh=True)
+        return {
+            "backlog_seconds": round(await self.backend.work_ahead(float("inf")), 1),
+            "max_backlog_seconds": self.max_backlog_seconds,
+            "queued_jobs": await self.backend.queue_depth(),
+            "histograms": estimator.export_percentiles()
+        }
+
+    async def collect_metrics(self):
+        """Refresh gauges that are read from the job backend before a metrics scrape"""
+        JOB_QUEUE_DEPTH.set(await self.backend.queue_depth())
+        JOB_TABLE_SIZE.set(await self.backend.job_count())
+        JOBS_IN_FLIGHT.set(len(self.active_jobs))
+
+    async def get_deadline_stats(self) -> Dict[str, Any]:
+        """Report deadline outcomes and miss rates per agent type"""
+        deadline_stats: Dict[str, Dict[str, int]] = {}
+        for field, value in (await self.backend.get_counters("deadline_stats")).items():
+            agent_type, outcome = field.split(":", 1)
+            deadline_stats.setdefault(agent_type, dict.fromkeys(DEADLINE_OUTCOMES, 0))[outcome] = value
+        
+        per_agent = {}
+        for agent_type, stats in deadline_stats.items():
+            finished = stats["met"] + stats["missed"]
+            per_agent[agent_type] = {
+                **stats,
+                "miss_rate": round(stats["missed"] / finished, 4) if finished else None
+            }
+        
+        met = sum(stats["met"] for stats in deadline_stats.values())
+        missed = sum(stats["missed"] for stats in deadline_stats.values())
+        return {
+            "scheduling_mode": self.scheduling_mode.value,
+            "deadline_policy": self.deadline_policy.value,
+            "miss_rate": round(missed / (met + missed), 4) if met + missed else None,
+            "agents": per_agent
+        }
+
+    async def _record_deadline_outcome(self, agent_type: str, outcome: str):
+        await self.backend.increment_counter("deadline_stats", f"{agent_type}:{outcome}")
+
+    async def _planning_estimator(self, refresh: bool = False) -> DurationEstimator:
+        """Estimator used for admission and estimates: local, or merged across workers"""
+        if not self.backend.shared:
+            return self.duration_estimator
+        
+        stale = time.monotonic() - self._merged_at > ESTIMATOR_REFRESH_SECONDS
+        if refresh or stale or self._merged_estimator is None:
+            snapshots = await self.backend.load_stats("estimator:")
+            self._merged_estimator = DurationEstimator.merged(list(snapshots.values()))
+            self._merged_at = time.monotonic()
+        return self._merged_estimator
+
+    async def _admit(self, jobs: List[Job]) -> List[float]:
+        """
+        Estimate job run times and reject them if the backlog would exceed the admission limit
+        or, under the reject policy, if a deadline cannot be met. Returns the queue scores.
+        """
+        estimator = await self._planning_estimator()
+        for job in jobs:
+            job.estimated_runtime = estimator.estimate(job.agent_type, job.request_data)
+        
+        added = sum(job.estimated_runtime for job in jobs)
+        backlog = await self.backend.work_ahead(float("inf"))
+        if self.max_backlog_seconds is not None and backlog + added > self.max_backlog_seconds:
+            raise QueueFullError(
+                f"Job queue backlog of {backlog:.0f}s would exceed the "
+                f"{self.max_backlog_seconds:.0f}s admission limit"
+            )
+        
+        # Arrival times are spread by a microsecond so batch jobs keep their order
+        now = time.time()
+        arrivals = [now + index * 1e-6 for index in range(len(jobs))]
+        
+        # Check deadlines against a pessimistic (p90) run time and the work scheduled ahead
+        scores = [self._score(job, arrival) for job, arrival in zip(jobs, arrivals)]
+        infeasible = []
+        for index, job in enumerate(jobs):
+            if job.deadline is None:
+                continue
+            runtime = estimator.estimate(job.agent_type, job.request_data, percentile=90)
+            ahead = await self._work_ahead(scores[index], jobs[:index], scores[:index])
+            if now + ahead + runtime > job.deadline:
+                infeasible.append(job)
+        
+        if infeasible and self.deadline_policy == DeadlinePolicy.REJECT:
+            for job in infeasible:
+                await self._record_deadline_outcome(job.agent_type, "rejected")
+            raise DeadlineUnachievableError(
+                f"Deadline cannot be met for {len(infeasible)} job(s) given the current queue"
+            )
+        for job in jobs:
+            if job.deadline is not None:
+                await self._record_deadline_outcome(job.agent_type, "submitted")
+        for job in infeasible:
+            job.best_effort = True
+            await self._record_deadline_outcome(job.agent_type, "best_effort")
+        
+        scores = [self._score(job, arrival) for job, arrival in zip(jobs, arrivals)]
+        for index, job in enumerate(jobs):
+            ahead = await self._work_ahead(scores[index], jobs[:index], scores[:index])
+            job.estimated_duration = int(round(ahead + job.estimated_runtime))
+        return scores
+
+    async def _work_ahead(self, score: float, submitted_with: List[Job], submitted_scores: List[float]) -> float:
+        """Estimated seconds of queued work that will be scheduled before a job with the given score"""
+        ahead = await self.backend.work_ahead(score)
+        return ahead + sum(
+            other.estimated_runtime for other, other_score in zip(submitted_with, submitted_scores)
+            if other_score <= score
+        )
+
+    def _score(self, job: Job, arrival: float) -> float:
+        """Queue score (lowest first): FIFO orders by arrival, EDF orders feasible jobs by deadline"""
+        if self.scheduling_mode == SchedulingMode.EDF:
+            if job.deadline is None:
+                return NO_DEADLINE_SCORE_OFFSET + arrival
+            if job.best_effort:
+                return BEST_EFFORT_SCORE_OFFSET + job.deadline
+            return job.deadline
+        return arrival
+
+    async def get_batch_status(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Get aggregated progress and status counts for a batch"""
+        batch = await self.backend.get_batch(batch_id)
+        if not batch:
+            return None
+        
+        jobs = [job for job in await self.backend.get_jobs(batch.job_ids) if job]
+        counts = {status.value: 0 for status in JobStatus}
+        for job in jobs:
+            counts[job.status.value] += 1
+        
+        finished = counts[JobStatus.COMPLETED.value] + counts[JobStatus.FAILED.value]
+        if finished == len(jobs):
+            status = JobStatus.FAILED if counts[JobStatus.FAILED.value] == len(jobs) else JobStatus.COMPLETED
+        elif counts[JobStatus.QUEUED.value] == len(jobs):
+            status = JobStatus.QUEUED
+        else:
+            status = JobStatus.RUNNING
+        
+        return {
+            "batch_id": batch.batch_id,
+            "status": status,
+            "progress": sum(job.progress if job.status != JobStatus.FAILED else 100 for job in jobs) // max(len(jobs), 1),
+            "total_jobs": len(jobs),
+            "status_counts": counts,
+            "job_ids": list(batch.job_ids),
+            "created_at": batch.created_at
+        }
+
+    async def stream_batch_results(self, batch_id: str, wait: bool = False, poll_interval: float = 0.5):
+        """
+        Yield one result record per batch job. With wait=True, records are yielded
+        as jobs finish until the whole batch is done; otherwise the current state is yielded.
+        """
+        batch = await self.backend.get_batch(batch_id)
+        if not batch:
+            return
+        
+        remaining = list(batch.job_ids)
+        while remaining:
+            still_running = []
+            for job_id, job in zip(remaining, await self.backend.get_jobs(remaining)):
+                if job and wait and job.status in (JobStatus.QUEUED, JobStatus.RUNNING):
+                    still_running.append(job_id)
+                    continue
+                yield self._batch_result_record(job_id, job)
+            
+            remaining = still_running
+            if remaining:
+                await asyncio.sleep(poll_interval)
+
+    def _batch_result_record(self, job_id: str, job: Optional[Job]) -> Dict[str, Any]:
+        """Build the result record for one batch job"""
+        if not job:
+            return {"job_id": job_id, "status": "not_found"}
+        
+        record = {"job_id": job.job_id, "agent_type": job.agent_type, "status": job.status.value}
+        if job.status == JobStatus.COMPLETED:
+            record["result"] = job.result
+        elif job.status == JobStatus.FAILED:
+            record["error_message"] = job.error_message
+        else:
+            record["progress"] = job.progress
+        return record
+
     async def get_job_status(self, job_id: str) -> Optional[Dict[str, Any]]:
         """Get the status of a job"""
-        job = self.jobs.get(job_id)
+        job = await self.backend.get_job(job_id)
         if not job:
             return None
 
-        return {
+        status = {
             "job_id": job.job_id,
             "status": job.status,
             "progress": job.progress,
@@ -85,24 +447,49 @@ class JobQueue:
             "created_at": job.created_at,
             "started_at": job.started_at,
             "completed_at": job.completed_at,
-            "error_message": job.error_message
+            "error_message": job.error_message,
+            "estimated_duration": job.estimated_duration,
+            "deadline": datetime.fromtimestamp(job.deadline, tz=timezone.utc) if job.deadline else None,
+            "best_effort": job.best_effort,
+            "usage": job.usage or None,
+            "knowledge_base_version": job.kb_version
         }
+        if job.stages is not None:
+            status["stages"] = {name: dict(stage) for name, stage in job.stages.items()}
+
+        return status
 
     async def get_job_result(self, job_id: str) -> Optional[Dict[str, Any]]:
         """Get the result of a completed job"""
-        job = self.jobs.get(job_id)
+        job = await self.backend.get_job(job_id)
         if not job or job.status != JobStatus.COMPLETED:
             return None
 
         return job.result
 
-    async def _worker(self):
-        """Worker coroutine that processes jobs from the queue"""
+    async def get_top_consumers(self, group_by: str = "user", metric: str = "cost_microusd",
+                                limit: int = 10) -> List[Dict[str, Any]]:
+        """Rank users or agents by OpenAI usage across all processes sharing the backend"""
+        return await self.usage.top_consumers(group_by, metric, limit)
+
+    async def get_job_timeline(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job's recorded spans as a waterfall"""
+        job = await self.backend.get_job(job_id)
+        if not job:
+            return None
+
+        timeline = build_timeline(job.spans or [])
+        timeline.update(job_id=job.job_id, agent_type=job.agent_type, status=job.status)
+        return timeline
+
+    def _create_agents(self) -> Dict[str, Any]:
+        """Create the agent instances used by the worker"""
         from agents.process_generator import ProcessGeneratorAgent
         from agents.revision_agent import RevisionAgent
         from agents.document_classifier import DocumentClassifierAgent
         from agents.process_optimizer import ProcessOptimizerAgent
         from agents.siam_specialist import SIAMSpecialistAgent
+        from agents.itil_knowledge_agent import ITILKnowledgeAgent
         
         # Initialize agents
         process_generator = ProcessGeneratorAgent()
@@ -110,85 +497,387 @@ class JobQueue:
         document_classifier = DocumentClassifierAgent()
         process_optimizer = ProcessOptimizerAgent()
         siam_specialist = SIAMSpecialistAgent()
+        itil_validator = process_generator.itil_agent or ITILKnowledgeAgent()
         
-        agents = {
+        return {
             "process_generator": process_generator,
+            "itil_process_generator": process_generator,
             "revision_agent": revision_agent,
             "document_classifier": document_classifier,
             "process_optimizer": process_optimizer,
-            "siam_specialist": siam_specialist
+            "siam_specialist": siam_specialist,
+            "itil_validator": itil_validator
         }
 
-        print("🤖 Job queue worker started")
+    async def _worker(self):
+        """Worker coroutine that processes jobs from the queue"""
+        logger.debug("Job queue worker started")
         
         while self.is_running:
             try:
                 # Wait for a job with timeout to allow graceful shutdown
-                job = await asyncio.wait_for(self.queue.get(), timeout=1.0)
-                
-                print(f"🔄 Processing job {job.job_id} with agent {job.agent_type}")
-                
-                # Update job status
-                job.status = JobStatus.RUNNING
-                job.started_at = datetime.utcnow()
-                job.message = "Processing..."
+                job = await self.backend.dequeue(timeout=1.0, owner=self.worker_id, lease_seconds=self.lease_seconds)
+                if job is None:
+                    continue
                 
+                self.active_jobs[job.job_id] = asyncio.current_task()
+                JOBS_IN_FLIGHT.set(len(self.active_jobs))
+                if job.spans is None:
+                    job.spans = []
+                if job.usage is None:
+                    job.usage = {}
                 try:
-                    # Get the appropriate agent
-                    agent = agents.get(job.agent_type)
-                    if not agent:
-                        raise ValueError(f"Unknown agent type: {job.agent_type}")
-                    
-                    # Process the job
-                    if job.agent_type == "process_generator":
-                        # Check if ITIL enhancement is requested
-                        if job.request_data.get("itil_area"):
-                            result = await agent.generate_itil_process(job.request_data, self._update_job_progress(job))
-                        else:
-                            result = await agent.generate_process(job.request_data, self._update_job_progress(job))
-                    elif job.agent_type == "itil_process_generator":
-                        result = await agent.generate_itil_process(job.request_data, self._update_job_progress(job))
-                    elif job.agent_type == "revision_agent":
-                        result = await agent.revise_process(job.request_data, self._update_job_progress(job))
-                    elif job.agent_type == "document_classifier":
-                        result = await agent.classify_document(job.request_data, self._update_job_progress(job))
-                    elif job.agent_type == "process_optimizer":
-                        result = await agent.analyze_process_performance(job.request_data, self._update_job_progress(job))
-                    elif job.agent_type == "siam_specialist":
-                        result = await self._process_siam_job(agent, job.request_data, self._update_job_progress(job))
-                    else:
-                        raise ValueError(f"Unsupported agent type: {job.agent_type}")
-                    
-                    # Job completed successfully
-                    job.status = JobStatus.COMPLETED
-                    job.completed_at = datetime.utcnow()
-                    job.progress = 100
-                    job.message = "Job completed successfully"
-                    job.result = result
-                    
-                    print(f"✅ Job {job.job_id} completed successfully")
-                    
-                except Exception as e:
-                    # Job failed
-                    job.status = JobStatus.FAILED
-                    job.completed_at = datetime.utcnow()
-                    job.error_message = str(e)
-                    job.message = f"Job failed: {str(e)}"
-                    
-                    print(f"❌ Job {job.job_id} failed: {str(e)}")
-                
-                # Mark task done
-                self.queue.task_done()
+                    with log_context(job_id=job.job_id, agent_type=job.agent_type, user_id=job.user_id), \
+                            collect_spans(job.spans), usage_scope(self.usage, job.user_id, job.usage), \
+                            pin_knowledge_base() as knowledge_base:
+                        # A knowledge-base reload while the job runs does not change what it sees
+                        job.kb_version = knowledge_base.version
+                        await self._run_job(job)
+                finally:
+                    self.active_jobs.pop(job.job_id, None)
+                    self._lost_leases.discard(job.job_id)
+                    self.progress_sampler.forget(job.job_id)
+                    JOBS_IN_FLIGHT.set(len(self.active_jobs))
                 
-            except asyncio.TimeoutError:
-                # No job available, continue loop
-                continue
             except asyncio.CancelledError:
-                print("🛑 Job queue worker cancelled")
+                logger.debug("Job queue worker cancelled")
                 break
-            except Exception as e:
-                print(f"❌ Unexpected error in job queue worker: {e}")
+            except Exception:
+                logger.exception("Unexpected error in job queue worker")
+                await asyncio.sleep(1.0)
+                continue
+
+    async def _run_job(self, job: Job):
+        """Run one leased job and store its outcome if this worker still holds the lease"""
+        record_span(
+            "job.queued", int(_to_timestamp(job.created_at) * 1e9), time.time_ns(), parent=job.traceparent,
+            attempt=job.attempts + 1
+        )
+        if not await self._check_deadline_at_dispatch(job):
+            return
+        
+        logger.info("Job started", extra={"attempt": job.attempts + 1})
+        
+        # Update job status
+        job.status = JobStatus.RUNNING
+        job.started_at = datetime.utcnow()
+        job.message = "Processing..."
+        job.attempts += 1
+        await self.backend.save_job(job)
+        JOB_QUEUE_WAIT_SECONDS.labels(job.agent_type).observe((job.started_at - job.created_at).total_seconds())
+        
+        PROFILER.job_started(job.agent_type)
+        try:
+            # Process the job; a hung agent call would otherwise keep renewing its lease forever
+            with start_span("job.run", parent=job.traceparent, job_id=job.job_id, agent_type=job.agent_type,
+                            attempt=job.attempts, worker_id=self.worker_id):
+                if job.agent_type == PIPELINE_AGENT_TYPE:
+                    execution = self._run_pipeline(job)
+                else:
+                    execution = self._execute_agent(job.agent_type, job.request_data, self._update_job_progress(job))
+                result = await asyncio.wait_for(execution, timeout=self.job_timeout_seconds)
+            error = None
+        except asyncio.CancelledError:
+            await self._requeue_interrupted(job)
+            raise
+        except asyncio.TimeoutError:
+            result, error = None, f"Job timed out after {self.job_timeout_seconds:.0f}s"
+        except Exception as e:
+            result, error = None, str(e)
+        finally:
+            PROFILER.job_finished(job.agent_type)
+        
+        if not await self.backend.release_lease(job.job_id, self.worker_id):
+            # The reaper has handed the job to another worker; do not overwrite its state
+            logger.warning("Job lease lost, discarding outcome")
+            return
+        
+        job.completed_at = datetime.utcnow()
+        if error is None:
+            # Job completed successfully
+            job.status = JobStatus.COMPLETED
+            job.progress = 100
+            job.message = "Job completed successfully"
+            job.result = result
+            job.checkpoint = None
+            await self._observe_duration(job)
+            if job.deadline is not None:
+                job.deadline_met = time.time() <= job.deadline
+                await self._record_deadline_outcome(job.agent_type, "met" if job.deadline_met else "missed")
+            
+            logger.info("Job completed", extra={"run_seconds": job.run_seconds})
+        else:
+            # Job failed
+            job.status = JobStatus.FAILED
+            job.error_message = error
+            job.message = f"Job failed: {error}"
+            
+            logger.error("Job failed", extra={"error": error, "run_seconds": job.run_seconds})
+        
+        await self.backend.save_job(job)
+        job.compact()
+        JOB_DURATION_SECONDS.labels(job.agent_type, job.status.value).observe(
+            (job.completed_at - job.created_at).total_seconds()
+        )
+
+    async def _requeue_interrupted(self, job: Job):
+        """Put a job interrupted by shutdown back on the queue, keeping its pipeline checkpoint"""
+        if not await self.backend.release_lease(job.job_id, self.worker_id):
+            return
+        
+        job.status = JobStatus.QUEUED
+        job.progress = 0
+        job.message = "Job requeued: worker shut down"
+        job.started_at = None
+        job.stages = None
+        # An interrupted run does not count against the job's attempts
+        job.attempts = max(job.attempts - 1, 0)
+        await self.backend.enqueue([job], [self._score(job, _to_timestamp(job.created_at))])
+        logger.info("Job requeued on shutdown")
+
+    async def _heartbeat(self):
+        """Renew the leases of jobs run by live worker coroutines in this process"""
+        # Runs until cleanup, so leases stay valid while workers drain
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            live = [job_id for job_id, task in self.active_jobs.items() if not task.done()]
+            try:
+                held = set(await self.backend.renew_leases(self.worker_id, live, self.lease_seconds))
+            except Exception:
+                logger.exception("Failed to renew job leases")
+                continue
+            for job_id in set(live) - held - self._lost_leases:
+                self._lost_leases.add(job_id)
+                logger.warning("Job lease expired while running", extra={"job_id": job_id})
+
+    async def _reaper(self):
+        """Periodically recover jobs whose worker stopped heartbeating"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 2)
+            try:
+                await self.reap_expired_leases()
+            except Exception:
+                logger.exception("Failed to reap expired job leases")
+
+    async def reap_expired_leases(self) -> int:
+        """Requeue jobs with an expired lease, or fail them once they used up their attempts"""
+        job_ids = await self.backend.claim_expired_leases(time.time())
+        reaped = 0
+        for job in await self.backend.get_jobs(job_ids):
+            if job is None or job.status in (JobStatus.COMPLETED, JobStatus.FAILED):
                 continue
+            reaped += 1
+            
+            if job.attempts >= self.max_attempts:
+                job.status = JobStatus.FAILED
+                job.completed_at = datetime.utcnow()
+                job.error_message = f"Worker stopped responding ({job.attempts} attempts)"
+                job.message = f"Job failed: {job.error_message}"
+                await self.backend.save_job(job)
+                logger.error("Job failed after lost attempts", extra={
+                    "job_id": job.job_id, "agent_type": job.agent_type, "user_id": job.user_id, "attempts": job.attempts
+                })
+                continue
+            
+            job.status = JobStatus.QUEUED
+            job.progress = 0
+            job.message = "Job requeued: worker stopped responding"
+            job.started_at = None
+            job.stages = None
+            # Requeued jobs keep their original arrival time, so FIFO puts them back in front
+            await self.backend.enqueue([job], [self._score(job, _to_timestamp(job.created_at))])
+            logger.warning("Job requeued after lease expiry", extra={
+                "job_id": job.job_id, "agent_type": job.agent_type, "user_id": job.user_id, "attempts": job.attempts
+            })
+        return reaped
+
+    async def _observe_duration(self, job: Job):
+        """Learn from a completed job and publish the histograms when other processes plan with them"""
+        self.duration_estimator.observe(job.agent_type, job.request_data, job.run_seconds)
+        if self.backend.shared:
+            await self.backend.save_stats(f"estimator:{self.worker_id}", self.duration_estimator.to_dict())
+
+    async def _check_deadline_at_dispatch(self, job: Job) -> bool:
+        """Drop (reject policy) or flag (best-effort policy) jobs that can no longer meet their deadline"""
+        if job.deadline is None or time.time() + job.estimated_runtime <= job.deadline:
+            return True
+        
+        if self.deadline_policy == DeadlinePolicy.REJECT:
+            job.status = JobStatus.FAILED
+            job.completed_at = datetime.utcnow()
+            job.deadline_met = False
+            job.error_message = "Deadline can no longer be met"
+            job.message = "Job rejected: deadline can no longer be met"
+            await self.backend.release_lease(job.job_id, self.worker_id)
+            await self.backend.save_job(job)
+            job.compact()
+            await self._record_deadline_outcome(job.agent_type, "rejected")
+            logger.warning("Job rejected: deadline can no longer be met")
+            return False
+        
+        if not job.best_effort:
+            job.best_effort = True
+            await self._record_deadline_outcome(job.agent_type, "best_effort")
+        return True
+
+    async def _execute_agent(self, agent_type: str, request_data: Dict[str, Any], progress_callback) -> Dict[str, Any]:
+        """Run a single agent call for the given agent type"""
+        # Get the appropriate agent
+        agent = self.agents.get(agent_type)
+        if not agent:
+            raise ValueError(f"Unknown agent type: {agent_type}")
+        
+        if agent_type == "process_generator":
+            # Check if ITIL enhancement is requested
+            if request_data.get("itil_area"):
+                return await agent.generate_itil_process(request_data, progress_callback)
+            return await agent.generate_process(request_data, progress_callback)
+        elif agent_type == "itil_process_generator":
+            return await agent.generate_itil_process(request_data, progress_callback)
+        elif agent_type == "revision_agent":
+            return await agent.revise_process(request_data, progress_callback)
+        elif agent_type == "document_classifier":
+            return await agent.classify_document(request_data, progress_callback)
+        elif agent_type == "process_optimizer":
+            return await agent.analyze_process_performance(request_data, progress_callback)
+        elif agent_type == "siam_specialist":
+            return await self._process_siam_job(agent, request_data, progress_callback)
+        elif agent_type == "itil_validator":
+            return await self._process_itil_validation_job(agent, request_data, progress_callback)
+        else:
+            raise ValueError(f"Unsupported agent type: {agent_type}")
+
+    def _validate_pipeline(self, stages: List[Dict[str, Any]]):
+        """Validate pipeline stage definitions and reject unknown dependencies or cycles"""
+        if not stages:
+            raise ValueError("Pipeline must contain at least one stage")
+        
+        names = [stage.get("name") for stage in stages]
+        if not all(names):
+            raise ValueError("Every pipeline stage must have a name")
+        if len(set(names)) != len(names):
+            raise ValueError("Pipeline stage names must be unique")
+        
+        for stage in stages:
+            if stage.get("agent_type") not in SUPPORTED_AGENT_TYPES:
+                raise ValueError(f"Unsupported agent type in stage '{stage['name']}': {stage.get('agent_type')}")
+            for dependency in stage.get("depends_on") or []:
+                if dependency not in names:
+                    raise ValueError(f"Stage '{stage['name']}' depends on unknown stage '{dependency}'")
+            for field, source in (stage.get("inputs") or {}).items():
+                if source.split(".", 1)[0] not in (stage.get("depends_on") or []):
+                    raise ValueError(f"Input '{field}' of stage '{stage['name']}' must come from one of its dependencies")
+        
+        # Kahn's algorithm: every stage must be reachable in topological order
+        remaining = {stage["name"]: set(stage.get("depends_on") or []) for stage in stages}
+        while remaining:
+            ready = [name for name, dependencies in remaining.items() if not dependencies]
+            if not ready:
+                raise ValueError(f"Pipeline contains a dependency cycle between stages: {', '.join(sorted(remaining))}")
+            for name in ready:
+                del remaining[name]
+            for dependencies in remaining.values():
+                dependencies.difference_update(ready)
+
+    async def _run_pipeline(self, job: Job) -> Dict[str, Any]:
+        """Run pipeline stages in dependency order, running independent stages concurrently"""
+        stages = {stage["name"]: stage for stage in job.request_data["stages"]}
+        job.stages = {
+            name: {
+                "agent_type": stage["agent_type"],
+                "status": JobStatus.QUEUED,
+                "progress": 0,
+                "message": "Waiting for dependencies"
+            }
+            for name, stage in stages.items()
+        }
+        
+        # Stage outputs are checkpointed on the job, so a requeued pipeline resumes where it stopped
+        outputs: Dict[str, Any] = dict(job.checkpoint or {})
+        for name in outputs:
+            job.stages[name].update(status=JobStatus.COMPLETED, progress=100, message="Stage restored from checkpoint")
+        pending = {name: stage for name, stage in stages.items() if name not in outputs}
+        running: Dict[asyncio.Task, str] = {}
+        
+        try:
+            while pending or running:
+                # Start every stage whose dependencies have produced output
+                ready = [
+                    name for name, stage in pending.items()
+                    if all(dependency in outputs for dependency in stage.get("depends_on") or [])
+                ]
+                for name in ready:
+                    stage = pending.pop(name)
+                    try:
+                        request_data = self._resolve_stage_inputs(stage, outputs)
+                    except ValueError as e:
+                        job.stages[name]["status"] = JobStatus.FAILED
+                        job.stages[name]["message"] = f"Stage failed: {str(e)}"
+                        raise
+                    job.stages[name]["status"] = JobStatus.RUNNING
+                    job.stages[name]["message"] = "Processing..."
+                    task = asyncio.create_task(self._execute_stage(job, name, stage["agent_type"], request_data))
+                    running[task] = name
+                await self._save_progress(job)
+                
+                done, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    try:
+                        outputs[name] = task.result()
+                        job.checkpoint = dict(outputs)
+                    except Exception as e:
+                        job.stages[name]["status"] = JobStatus.FAILED
+                        job.stages[name]["message"] = f"Stage failed: {str(e)}"
+                        raise ValueError(f"Pipeline stage '{name}' failed: {str(e)}") from e
+                    
+                    job.stages[name]["status"] = JobStatus.COMPLETED
+                    job.stages[name]["progress"] = 100
+                    job.stages[name]["message"] = "Stage completed"
+                    self._refresh_pipeline_progress(job)
+                await self._save_progress(job)
+        finally:
+            # Do not leave sibling stages running if one of them failed, and let them finish
+            # unwinding before the job is saved and compacted
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+        
+        return {"stages": outputs}
+
+    async def _execute_stage(self, job: Job, name: str, agent_type: str, request_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Run one pipeline stage inside its own span"""
+        with start_span("pipeline.stage", stage=name, agent_type=agent_type):
+            return await self._execute_agent(agent_type, request_data, self._update_stage_progress(job, name))
+
+    def _resolve_stage_inputs(self, stage: Dict[str, Any], outputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Build a stage's request data, pulling mapped fields from upstream stage outputs"""
+        request_data = dict(stage.get("request_data") or {})
+        
+        for field, source in (stage.get("inputs") or {}).items():
+            value: Any = outputs
+            for key in source.split("."):
+                if isinstance(value, dict) and key in value:
+                    value = value[key]
+                elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+                    value = value[int(key)]
+                else:
+                    raise ValueError(f"Could not resolve input '{source}' for stage '{stage['name']}'")
+            request_data[field] = value
+        
+        return request_data
+
+    def _refresh_pipeline_progress(self, job: Job):
+        """Aggregate stage progress into the pipeline job's progress"""
+        job.progress = sum(stage["progress"] for stage in job.stages.values()) // len(job.stages)
+        running = [name for name, stage in job.stages.items() if stage["status"] == JobStatus.RUNNING]
+        if running:
+            job.message = f"Running stages: {', '.join(running)}"
+
+    async def _save_progress(self, job: Job):
+        """Store intermediate job state unless the job's lease has been lost to the reaper"""
+        if job.job_id not in self._lost_leases:
+            await self.backend.save_job(job)
 
     def _update_job_progress(self, job: Job):
         """Create a progress update callback for a job"""
@@ -196,42 +885,70 @@ class JobQueue:
             job.progress = min(max(progress, 0), 100)
             if message:
                 job.message = message
-            print(f"📊 Job {job.job_id} progress: {progress}% - {message or job.message}")
+            await self._save_progress(job)
+            if self.progress_sampler.should_log(job.job_id, job.progress):
+                logger.info("Job progress", extra={"progress": job.progress, "progress_message": job.message})
+        
+        return update_progress
+
+    def _update_stage_progress(self, job: Job, stage_name: str):
+        """Create a progress update callback for a single pipeline stage"""
+        async def update_progress(progress: int, message: str = None):
+            stage = job.stages[stage_name]
+            stage["progress"] = min(max(progress, 0), 100)
+            if message:
+                stage["message"] = message
+            self._refresh_pipeline_progress(job)
+            await self._save_progress(job)
         
         return update_progress
+
+    async def _process_itil_validation_job(self, agent, request_data: Dict[str, Any], progress_callback):
+        """Validate a process (typically a generated one) against ITIL best practices"""
+        await progress_callback(10, "Validating process against ITIL...")
+        process_data = request_data.get("process") or request_data
+        result = agent.validate_process_against_itil(process_data)
+        await progress_callback(100, "ITIL validation completed")
+        return result
     
     async def _process_siam_job(self, agent, request_data: Dict[str, Any], progress_callback):
         """Process SIAM specialist job based on analysis type"""
+        # The SIAM agent uses the synchronous OpenAI client, so its calls run in a thread
         analysis_type = request_data.get("analysis_type", "scenario")
         
         await progress_callback(10, "Starting SIAM analysis...")
         
         if analysis_type == "scenario":
             await progress_callback(30, "Analyzing multi-vendor scenario...")
-            result = agent.analyze_multi_vendor_scenario(
+            result = await asyncio.to_thread(
+                agent.analyze_multi_vendor_scenario,
                 request_data.get("scenario_description", ""),
                 request_data.get("requirements", [])
             )
         elif analysis_type == "governance":
             await progress_callback(30, "Generating governance guidance...")
-            result = agent.provide_governance_guidance(
+            result = await asyncio.to_thread(
+                agent.provide_governance_guidance,
                 request_data.get("vendor_count", 3),
                 request_data.get("service_complexity", "medium"),
                 request_data.get("organizational_maturity", "medium")
             )
         elif analysis_type == "vendor_assessment":
             await progress_callback(30, "Assessing vendor readiness...")
-            result = agent.assess_vendor_readiness(
+            result = await asyncio.to_thread(
+                agent.assess_vendor_readiness,
                 request_data.get("vendor_profiles", [])
             )
         elif analysis_type == "integration":
             await progress_callback(30, "Analyzing integration requirements...")
-            result = agent.suggest_integration_approach(
+            result = await asyncio.to_thread(
+                agent.suggest_integration_approach,
                 request_data.get("integration_requirements", {})
             )
         elif analysis_type == "sla":
             await progress_callback(30, "Generating SLA framework...")
-            result = agent.generate_sla_framework(
+            result = await asyncio.to_thread(
+                agent.generate_sla_framework,
                 request_data.get("service_requirements", {})
             )
         else:
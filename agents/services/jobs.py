@@ -0,0 +1,225 @@
+"""
+Job and batch records shared by the job queue and its storage backends
+"""
+import json
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+from enum import Enum
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+def _to_timestamp(value: datetime) -> float:
+    """Convert a datetime to epoch seconds, treating naive values as UTC"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _to_millis(value: Optional[datetime]) -> int:
+    """Convert a datetime to integer epoch milliseconds (0 = not set)"""
+    return int(round(_to_timestamp(value) * 1000)) if value else 0
+
+
+def _from_millis(value: int) -> Optional[datetime]:
+    """Convert epoch milliseconds back to a naive UTC datetime"""
+    return datetime.fromtimestamp(value / 1000, tz=timezone.utc).replace(tzinfo=None) if value else None
+
+
+def _format_datetime(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _now_millis() -> int:
+    return int(time.time() * 1000)
+
+
+class Job:
+    """
+    Job record kept compact for large queues: slotted, timestamps as integer epoch
+    milliseconds, and request data compressed once the job has finished
+    """
+
+    __slots__ = (
+        "job_id", "agent_type", "_request_data", "_request_blob", "user_id", "status", "progress",
+        "message", "_created_ms", "_started_ms", "_completed_ms", "error_message", "result", "stages",
+        "estimated_runtime", "estimated_duration", "deadline", "best_effort", "deadline_met", "attempts",
+        "checkpoint", "traceparent", "spans", "usage", "kb_version"
+    )
+
+    def __init__(self, job_id: str, agent_type: str, request_data: Dict[str, Any], user_id: str,
+                 deadline: Optional[datetime] = None):
+        self.job_id = job_id
+        self.agent_type = agent_type
+        self._request_data: Optional[Dict[str, Any]] = request_data
+        self._request_blob: Optional[bytes] = None
+        self.user_id = user_id
+        self.status = JobStatus.QUEUED
+        self.progress = 0
+        self.message = "Job queued"
+        self._created_ms = _now_millis()
+        self._started_ms = 0
+        self._completed_ms = 0
+        self.error_message: Optional[str] = None
+        self.result: Optional[Dict[str, Any]] = None
+        # Per-stage state for pipeline jobs
+        self.stages: Optional[Dict[str, Dict[str, Any]]] = None
+        # Estimated run time, and time until completion including queue wait (seconds)
+        self.estimated_runtime: float = 0.0
+        self.estimated_duration: Optional[int] = None
+        # Optional completion deadline (epoch seconds); best-effort jobs are known to be at risk
+        self.deadline: Optional[float] = _to_timestamp(deadline) if deadline else None
+        self.best_effort = False
+        self.deadline_met: Optional[bool] = None
+        # Number of times a worker has picked the job up (lease expiry can requeue it)
+        self.attempts = 0
+        # Outputs of completed pipeline stages, kept until the pipeline finishes
+        self.checkpoint: Optional[Dict[str, Any]] = None
+        # W3C traceparent of the request that submitted the job, and the spans recorded while running it
+        # (spans and usage are created when the job runs, so queued and empty records stay small)
+        self.traceparent: Optional[str] = None
+        self.spans: Optional[List[Dict[str, Any]]] = None
+        # OpenAI token usage, latency and estimated cost summed over the job's completions
+        self.usage: Optional[Dict[str, Any]] = None
+        # Knowledge-base snapshot version the job ran against
+        self.kb_version: Optional[str] = None
+
+    @property
+    def request_data(self) -> Dict[str, Any]:
+        if self._request_data is None and self._request_blob is not None:
+            return json.loads(zlib.decompress(self._request_blob))
+        return self._request_data
+
+    @request_data.setter
+    def request_data(self, value: Dict[str, Any]):
+        self._request_data = value
+        self._request_blob = None
+
+    @property
+    def created_at(self) -> Optional[datetime]:
+        return _from_millis(self._created_ms)
+
+    @created_at.setter
+    def created_at(self, value: Optional[datetime]):
+        self._created_ms = _to_millis(value)
+
+    @property
+    def started_at(self) -> Optional[datetime]:
+        return _from_millis(self._started_ms)
+
+    @started_at.setter
+    def started_at(self, value: Optional[datetime]):
+        self._started_ms = _to_millis(value)
+
+    @property
+    def completed_at(self) -> Optional[datetime]:
+        return _from_millis(self._completed_ms)
+
+    @completed_at.setter
+    def completed_at(self, value: Optional[datetime]):
+        self._completed_ms = _to_millis(value)
+
+    @property
+    def run_seconds(self) -> Optional[float]:
+        """Run time of a finished job in seconds"""
+        if not self._started_ms or not self._completed_ms:
+            return None
+        return (self._completed_ms - self._started_ms) / 1000
+
+    def compact(self):
+        """Compress the request data of a finished job (only needed again for inspection) and drop empty containers"""
+        if self._request_data is not None:
+            self._request_blob = zlib.compress(json.dumps(self._request_data, default=str).encode("utf-8"))
+            self._request_data = None
+        self.spans = self.spans or None
+        self.usage = self.usage or None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the job for storage in a shared backend"""
+        return {
+            "job_id": self.job_id,
+            "agent_type": self.agent_type,
+            "request_data": self.request_data,
+            "user_id": self.user_id,
+            "status": self.status.value,
+            "progress": self.progress,
+            "message": self.message,
+            "created_at": _format_datetime(self.created_at),
+            "started_at": _format_datetime(self.started_at),
+            "completed_at": _format_datetime(self.completed_at),
+            "error_message": self.error_message,
+            "result": self.result,
+            "stages": self.stages,
+            "estimated_runtime": self.estimated_runtime,
+            "estimated_duration": self.estimated_duration,
+            "deadline": self.deadline,
+            "best_effort": self.best_effort,
+            "deadline_met": self.deadline_met,
+            "attempts": self.attempts,
+            "checkpoint": self.checkpoint,
+            "traceparent": self.traceparent,
+            "spans": self.spans,
+            "usage": self.usage,
+            "kb_version": self.kb_version
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Job":
+        """Restore a job serialized with to_dict"""
+        job = cls(data["job_id"], data["agent_type"], data["request_data"], data["user_id"])
+        job.status = JobStatus(data["status"])
+        job.progress = data["progress"]
+        job.message = data["message"]
+        job.created_at = _parse_datetime(data["created_at"])
+        job.started_at = _parse_datetime(data["started_at"])
+        job.completed_at = _parse_datetime(data["completed_at"])
+        job.error_message = data["error_message"]
+        job.result = data["result"]
+        job.stages = data["stages"]
+        job.estimated_runtime = data["estimated_runtime"]
+        job.estimated_duration = data["estimated_duration"]
+        job.deadline = data["deadline"]
+        job.best_effort = data["best_effort"]
+        job.deadline_met = data["deadline_met"]
+        job.attempts = data.get("attempts", 0)
+        job.checkpoint = data.get("checkpoint")
+        job.traceparent = data.get("traceparent")
+        job.spans = data.get("spans") or None
+        job.usage = data.get("usage") or None
+        job.kb_version = data.get("kb_version")
+        return job
+
+
+class Batch:
+    __slots__ = ("batch_id", "job_ids", "user_id", "created_at")
+
+    def __init__(self, batch_id: str, job_ids: List[str], user_id: str):
+        self.batch_id = batch_id
+        self.job_ids = job_ids
+        self.user_id = user_id
+        self.created_at = datetime.utcnow()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "batch_id": self.batch_id,
+            "job_ids": self.job_ids,
+            "user_id": self.user_id,
+            "created_at": _format_datetime(self.created_at)
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Batch":
+        batch = cls(data["batch_id"], data["job_ids"], data["user_id"])
+        batch.created_at = _parse_datetime(data["created_at"])
+        return batch
@@ -0,0 +1,374 @@
+"""
+Compiled knowledge-base snapshot
+The JSON files under data/itil and data/siam are compiled into one binary snapshot file
+that every process memory-maps read-only, so the raw bytes share the same page-cache pages
+across worker processes. Decoded values are Python objects and cannot live in the mapping:
+each file is decoded at most once per process, on first use, and shared by all agents of
+that process (treat it as read-only). Resident memory therefore still grows by the decoded
+files each worker touches; only the raw knowledge is not duplicated. Prompt fragments
+rendered from the knowledge (JSON dumps, fixed prompt sections) are cached on the snapshot
+too, so they are rendered once per knowledge-base version.
+
+    python -m services.knowledge_base build    # compile (also done automatically when stale)
+    python -m services.knowledge_base info
+
+KnowledgeBaseReloader polls the source files and swaps in a rebuilt snapshot, with its
+derived indexes already built, while the service runs. Jobs pin the snapshot that was
+current when they started (pin_knowledge_base), so a reload never changes what a running
+job sees; results are stamped with the snapshot version.
+
+Layout: MAGIC, 8-byte big-endian index length, JSON index, then the minified JSON of each
+file back to back. The index maps "itil/service-value-system.json" style paths to
+(offset, length) in the data section and records the source fingerprint and version, plus
+the name, area and aliases of every practice file so practices can be indexed without
+decoding their bodies.
+"""
+import os
+import sys
+import json
+import mmap
+import asyncio
+import contextlib
+import contextvars
+import struct
+import hashlib
+import logging
+import argparse
+import functools
+import tempfile
+import threading
+import collections
+from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PPKB\x00\x02"
+# Knowledge-base versions whose derived values (indexes, compiled rules) are kept; jobs
+# pinned to the previous version keep theirs across a reload
+MAX_DERIVED_VERSIONS = 2
+KNOWLEDGE_AREAS = ("itil", "siam")
+DATA_DIR = Path(__file__).resolve().parent.parent.parent / "data"
+_HEADER = struct.Struct(">Q")
+
+
+def default_snapshot_path() -> Path:
+    return Path(os.getenv("KB_SNAPSHOT_PATH") or DATA_DIR / "knowledge-base.snapshot")
+
+
+def _source_files(data_dir: Path) -> List[Path]:
+    files = []
+    for area in KNOWLEDGE_AREAS:
+        files.extend(sorted((data_dir / area).rglob("*.json")))
+    return files
+
+
+def source_fingerprint(data_dir: Path = DATA_DIR) -> Dict[str, List[int]]:
+    """Size and modification time of every source file, to detect a stale snapshot"""
+    fingerprint = {}
+    for path in _source_files(data_dir):
+        stat = path.stat()
+        fingerprint[path.relative_to(data_dir).as_posix()] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+
+def compile_snapshot(data_dir: Path = DATA_DIR, output: Optional[Path] = None) -> Path:
+    """Compile the knowledge base into a snapshot file (written atomically)"""
+    output = Path(output or default_snapshot_path())
+    index: Dict[str, Tuple[int, int]] = {}
+    practices: Dict[str, Dict[str, Any]] = {}
+    chunks = []
+    offset = 0
+    digest = hashlib.sha256()
+    for path in _source_files(data_dir):
+        name = path.relative_to(data_dir).as_posix()
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                content = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid knowledge file {name}: {e}")
+        encoded = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if isinstance(content, dict) and "practice" in content:
+            practices[name] = {
+                "practice": content["practice"],
+                "itil_area": content.get("itil_area", ""),
+                "aliases": content.get("aliases", [])
+            }
+        index[name] = (offset, len(encoded))
+        digest.update(name.encode("utf-8") + b"\0" + encoded)
+        chunks.append(encoded)
+        offset += len(encoded)
+
+    header = json.dumps({
+        "version": digest.hexdigest()[:16],
+        "sources": source_fingerprint(data_dir),
+        "files": index,
+        "practices": practices
+    }, ensure_ascii=False).encode("utf-8")
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=output.parent, prefix=".kb-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(_HEADER.pack(len(header)))
+            f.write(header)
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, output)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    logger.info("Compiled knowledge base snapshot", extra={"path": str(output), "files": len(index), "bytes": offset})
+    return output
+
+
+class KnowledgeBaseSnapshot:
+    """Read-only view of a compiled snapshot, memory-mapped when loaded from a file"""
+
+    def __init__(self, buffer, source: str = "<memory>"):
+        self._buffer = buffer
+        self.source = source
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{source} is not a knowledge base snapshot")
+        start = len(MAGIC) + _HEADER.size
+        (header_length,) = _HEADER.unpack(buffer[len(MAGIC):start])
+        header = json.loads(bytes(buffer[start:start + header_length]))
+        self.version: str = header["version"]
+        self.sources: Dict[str, List[int]] = header["sources"]
+        self._files: Dict[str, List[int]] = header["files"]
+        # Practice metadata by file name, recorded at compile time
+        self.practices: Dict[str, Dict[str, Any]] = header["practices"]
+        self._data_start = start + header_length
+        self._decoded: Dict[str, Any] = {}
+        self._fragments: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path: Path) -> "KnowledgeBaseSnapshot":
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapped, str(path))
+
+    def files(self) -> List[str]:
+        return list(self._files)
+
+    def contains(self, name: str) -> bool:
+        return name in self._files
+
+    def raw(self, name: str) -> bytes:
+        """Minified JSON of one file, straight from the mapped pages"""
+        offset, length = self._files[name]
+        start = self._data_start + offset
+        return self._buffer[start:start + length]
+
+    def get(self, name: str) -> Optional[Any]:
+        """Decoded content of a file such as 'itil/service-value-system.json' (shared; do not mutate)"""
+        value = self._decoded.get(name)
+        if value is None and name in self._files:
+            with self._lock:
+                value = self._decoded.get(name)
+                if value is None:
+                    value = json.loads(self.raw(name))
+                    self._decoded[name] = value
+        return value
+
+    def fragment(self, key: str, render: Callable[[], Any]) -> Any:
+        """
+        Prompt text (or a tuple of texts) derived from this snapshot, rendered once by render() and
+        reused until the snapshot is replaced. Keys must identify everything the text depends on
+        besides the snapshot.
+        """
+        text = self._fragments.get(key)
+        if text is None:
+            text = render()
+            self._fragments[key] = text
+        return text
+
+    def is_stale(self, data_dir: Path = DATA_DIR) -> bool:
+        return self.sources != source_fingerprint(data_dir)
+
+
+_snapshot: Optional[KnowledgeBaseSnapshot] = None
+_snapshot_lock = threading.Lock()
+# Snapshot pinned for the running job, if any
+_pinned: contextvars.ContextVar = contextvars.ContextVar("pinned_knowledge_base", default=None)
+# Called with a new snapshot before it is swapped in, to build derived indexes ahead of use
+_reload_hooks: List[Callable[[KnowledgeBaseSnapshot], Any]] = []
+
+
+def read_snapshot_header(path: Path) -> Optional[Dict[str, Any]]:
+    """Header of a snapshot file (version, sources, index) without mapping it; None if unreadable"""
+    try:
+        with open(path, "rb") as f:
+            prefix = f.read(len(MAGIC) + _HEADER.size)
+            if len(prefix) < len(MAGIC) + _HEADER.size or prefix[:len(MAGIC)] != MAGIC:
+                return None
+            (header_length,) = _HEADER.unpack(prefix[len(MAGIC):])
+            return json.loads(f.read(header_length))
+    except (OSError, ValueError):
+        return None
+
+
+def load_snapshot(path: Optional[Path] = None, data_dir: Path = DATA_DIR) -> KnowledgeBaseSnapshot:
+    """Open the snapshot file, compiling it first if it is missing or older than the sources"""
+    path = Path(path or default_snapshot_path())
+    if path.exists():
+        try:
+            snapshot = KnowledgeBaseSnapshot.open(path)
+            if not snapshot.is_stale(data_dir):
+                return snapshot
+        except ValueError as e:
+            logger.warning("Ignoring unreadable knowledge base snapshot", extra={"path": str(path), "error": str(e)})
+    try:
+        return KnowledgeBaseSnapshot.open(compile_snapshot(data_dir, path))
+    except OSError as e:
+        # Read-only deployment without a prebuilt snapshot: keep the compiled bytes in memory
+        logger.warning("Could not write knowledge base snapshot, using an in-memory copy",
+                       extra={"path": str(path), "error": str(e)})
+        with tempfile.TemporaryDirectory() as tmp:
+            compiled = compile_snapshot(data_dir, Path(tmp) / "kb.snapshot")
+            return KnowledgeBaseSnapshot(compiled.read_bytes())
+
+
+def get_knowledge_base() -> KnowledgeBaseSnapshot:
+    """The snapshot pinned for the running job, or else the latest process-wide snapshot"""
+    global _snapshot
+    pinned = _pinned.get()
+    if pinned is not None:
+        return pinned
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = load_snapshot()
+    return _snapshot
+
+
+@contextlib.contextmanager
+def pin_knowledge_base(snapshot: Optional[KnowledgeBaseSnapshot] = None):
+    """Keep the current (or the given) snapshot for everything run inside the block, even across reloads"""
+    token = _pinned.set(snapshot or get_knowledge_base())
+    try:
+        yield _pinned.get()
+    finally:
+        _pinned.reset(token)
+
+
+def register_reload_hook(hook: Callable[[KnowledgeBaseSnapshot], Any]):
+    """Run hook(snapshot) on every new snapshot before it becomes current"""
+    _reload_hooks.append(hook)
+
+
+def versioned_cache(factory: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Decorator for values derived from a snapshot: factory(snapshot, *args) runs once per
+    knowledge-base version and arguments, values of the latest MAX_DERIVED_VERSIONS versions
+    are kept, and the value is built for every new snapshot before it is swapped in.
+    """
+    values: "collections.OrderedDict[tuple, Any]" = collections.OrderedDict()
+    lock = threading.Lock()
+
+    @functools.wraps(factory)
+    def get(snapshot: KnowledgeBaseSnapshot, *args):
+        key = (snapshot.version, *args)
+        value = values.get(key)
+        if value is None:
+            with lock:
+                value = values.get(key)
+                if value is None:
+                    value = factory(snapshot, *args)
+                    values[key] = value
+                    while len({cached[0] for cached in values}) > MAX_DERIVED_VERSIONS:
+                        values.popitem(last=False)
+        return value
+
+    get.versions = lambda: [key[0] for key in values]
+    get.cache_clear = values.clear
+    register_reload_hook(get)
+    return get
+
+
+def reload_knowledge_base(force: bool = False, path: Optional[Path] = None,
+                          data_dir: Path = DATA_DIR) -> Optional[KnowledgeBaseSnapshot]:
+    """Rebuild and swap in the snapshot if the sources changed; returns the new snapshot or None"""
+    global _snapshot
+    current = _snapshot or get_knowledge_base()
+    if not force and not current.is_stale(data_dir):
+        return None
+    path = Path(path or default_snapshot_path())
+    header = read_snapshot_header(path)
+    if header is None or header["sources"] != source_fingerprint(data_dir):
+        try:
+            compile_snapshot(data_dir, path)
+            header = read_snapshot_header(path)
+        except OSError:
+            # Read-only deployment: load_snapshot below compiles an in-memory copy
+            header = None
+    if header is not None and header["version"] == current.version and not force:
+        # Files touched or rewritten without a content change: keep the current mapping
+        # and adopt the new fingerprint, so later polls do not rebuild it again
+        current.sources = header["sources"]
+        return None
+    snapshot = load_snapshot(path, data_dir)
+    if snapshot.version == current.version and not force:
+        current.sources = snapshot.sources
+        return None
+    for hook in _reload_hooks:
+        hook(snapshot)
+    with _snapshot_lock:
+        _snapshot = snapshot
+    logger.info("Knowledge base reloaded", extra={"previous_version": current.version, "version": snapshot.version})
+    return snapshot
+
+
+class KnowledgeBaseReloader:
+    """Polls the knowledge-base sources and reloads the snapshot in a thread when they change"""
+
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = interval if interval is not None else float(os.getenv("KB_RELOAD_SECONDS", "5"))
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(reload_knowledge_base)
+            except Exception:
+                logger.exception("Failed to reload knowledge base; keeping the current snapshot")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile or inspect the knowledge base snapshot")
+    parser.add_argument("command", choices=["build", "info"])
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        path = compile_snapshot(args.data_dir, args.output)
+        snapshot = KnowledgeBaseSnapshot.open(path)
+        print(f"✅ Compiled {len(snapshot.files())} files into {path} (version {snapshot.version})")
+    else:
+        snapshot = KnowledgeBaseSnapshot.open(args.output or default_snapshot_path())
+        print(f"Snapshot {snapshot.source} version {snapshot.version}"
+              f"{' (stale)' if snapshot.is_stale(args.data_dir) else ''}")
+        for name in snapshot.files():
+            print(f"  {name}: {len(snapshot.raw(name))} bytes")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
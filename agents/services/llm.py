@@ -0,0 +1,72 @@
+"""
+Instrumented OpenAI chat completion calls
+Every agent goes through these helpers so latency, token usage and parse outcomes are recorded
+as metrics, as spans on the running job's trace, and in usage accounting
+"""
+import time
+import contextlib
+from typing import Any
+
+from services.metrics import (
+    LLM_REQUEST_SECONDS, LLM_REQUEST_ERRORS, LLM_PROMPT_TOKENS, LLM_COMPLETION_TOKENS,
+    LLM_PARSE_SECONDS, LLM_PARSE_FAILURES
+)
+from services.tracing import start_span
+from services.usage import usage_from_response, record_usage
+from services.rate_limiter import LLM_RATE_LIMITER
+
+
+def _record_response(agent_type: str, model: str, response: Any, seconds: float, span):
+    LLM_REQUEST_SECONDS.labels(agent_type, model).observe(seconds)
+    usage = usage_from_response(model, response, seconds)
+    if usage is not None:
+        LLM_PROMPT_TOKENS.labels(agent_type).observe(usage["prompt_tokens"])
+        LLM_COMPLETION_TOKENS.labels(agent_type).observe(usage["completion_tokens"])
+        for field in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+            span.set_attribute(field, usage[field])
+        record_usage(agent_type, model, usage)
+
+
+async def create_chat_completion(client, agent_type: str, **request: Any):
+    """Call client.chat.completions.create on an AsyncOpenAI client under the shared rate limiter and record metrics"""
+    model = request.get("model", "")
+    async with LLM_RATE_LIMITER.limit(agent_type):
+        with start_span("llm.call", agent_type=agent_type, model=model) as span:
+            start = time.perf_counter()
+            try:
+                response = await client.chat.completions.create(**request)
+            except Exception:
+                LLM_REQUEST_ERRORS.labels(agent_type, model).inc()
+                raise
+            _record_response(agent_type, model, response, time.perf_counter() - start, span)
+    return response
+
+
+def create_chat_completion_sync(client, agent_type: str, **request: Any):
+    """Same as create_chat_completion for the synchronous OpenAI client"""
+    model = request.get("model", "")
+    with LLM_RATE_LIMITER.limit_sync(agent_type), start_span("llm.call", agent_type=agent_type, model=model) as span:
+        start = time.perf_counter()
+        try:
+            response = client.chat.completions.create(**request)
+        except Exception:
+            LLM_REQUEST_ERRORS.labels(agent_type, model).inc()
+            raise
+        _record_response(agent_type, model, response, time.perf_counter() - start, span)
+    return response
+
+
+@contextlib.contextmanager
+def measure_parse(agent_type: str):
+    """Time the parsing of a model response"""
+    with start_span("llm.parse", agent_type=agent_type):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            LLM_PARSE_SECONDS.labels(agent_type).observe(time.perf_counter() - start)
+
+
+def record_parse_failure(agent_type: str):
+    """Count a model response that needed a fallback parser or default result"""
+    LLM_PARSE_FAILURES.labels(agent_type).inc()
@@ -0,0 +1,105 @@
+"""
+Event loop lag monitor
+A probe coroutine measures how late the loop wakes it up and exports the delay as a metric.
+A watchdog thread notices when the probe is overdue and captures the loop thread's stack
+while it is still blocked, so the offending call shows up in the log and in `stalls`.
+"""
+import os
+import sys
+import time
+import logging
+import asyncio
+import threading
+import traceback
+import collections
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
+
+from services.metrics import EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_FRAMES = 40
+
+
+class LoopLagMonitor:
+    """Measures event loop scheduling delay and records the stack of calls that block it"""
+
+    def __init__(self, interval: Optional[float] = None, threshold: Optional[float] = None, max_stalls: int = 50):
+        self.interval = interval or float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.1"))
+        self.threshold = threshold or float(os.getenv("LOOP_LAG_THRESHOLD_SECONDS", "0.25"))
+        self.stalls: collections.deque = collections.deque(maxlen=max_stalls)
+        self.max_lag = 0.0
+        self._probe_task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        # Monotonic time the probe last woke up, and the stack captured for the current stall
+        self._last_beat = 0.0
+        self._captured_stack: Optional[List[str]] = None
+
+    def start(self):
+        """Start monitoring the running event loop"""
+        if self._probe_task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._probe_task = asyncio.create_task(self._probe())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        if self._probe_task is None:
+            return
+        self._stop.set()
+        self._probe_task.cancel()
+        try:
+            await self._probe_task
+        except asyncio.CancelledError:
+            pass
+        self._probe_task = None
+        self._watchdog.join()
+
+    async def _probe(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - scheduled, 0.0)
+            self._last_beat = time.monotonic()
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self._record_stall(lag)
+            self._captured_stack = None
+
+    def _watch(self):
+        """Capture the loop thread's stack once per stall, while the blocking call is running"""
+        while not self._stop.wait(self.interval / 2):
+            overdue = time.monotonic() - self._last_beat - self.interval
+            if overdue >= self.threshold and self._captured_stack is None:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    self._captured_stack = traceback.format_stack(frame, limit=MAX_STACK_FRAMES)
+
+    def _record_stall(self, lag: float):
+        stack = self._captured_stack or []
+        EVENT_LOOP_STALLS.inc()
+        self.stalls.append({
+            "at": datetime.now(timezone.utc).isoformat(),
+            "lag_seconds": round(lag, 4),
+            "stack": stack
+        })
+        logger.warning("Event loop blocked", extra={
+            "lag_seconds": round(lag, 4), "stack": "".join(stack[-10:]) or None
+        })
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self._probe_task is not None,
+            "interval_seconds": self.interval,
+            "threshold_seconds": self.threshold,
+            "max_lag_seconds": round(self.max_lag, 4),
+            "stalls": list(self.stalls)
+        }
@@ -0,0 +1,242 @@
+"""
+Lightweight Prometheus-style metrics
+Counters, gauges and histograms with labels, rendered in the Prometheus text format.
+Recording is a dict lookup plus a bisect, cheap enough to leave on in production.
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple, Sequence
+
+# Default buckets (seconds) for request and job latencies
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600)
+# Buckets (seconds) for local work such as parsing
+FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+# Buckets (seconds) for event loop scheduling delay
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Buckets for token counts
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 1500, 2000, 3000, 4000, 6000, 8000, 12000, 16000, 32000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """Return the child for a label combination (cached after the first call)"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for values, child in sorted(list(self._children.items())):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_child(self, values, child) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), list(child.counts)):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds metrics and renders them for a /metrics scrape"""
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Job queue
+JOB_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "prosessportal_job_queue_wait_seconds", "Time jobs spent queued before a worker started them", ["agent_type"]
+)
+JOB_DURATION_SECONDS = REGISTRY.histogram(
+    "prosessportal_job_duration_seconds", "Time from job submission to completion or failure", ["agent_type", "status"]
+)
+JOB_QUEUE_DEPTH = REGISTRY.gauge("prosessportal_job_queue_depth", "Jobs waiting in the queue")
+JOBS_IN_FLIGHT = REGISTRY.gauge("prosessportal_jobs_in_flight", "Jobs currently run by this process's workers")
+JOB_TABLE_SIZE = REGISTRY.gauge("prosessportal_job_table_size", "Job records held by the job backend")
+
+# LLM calls
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    "prosessportal_llm_request_seconds", "OpenAI chat completion latency", ["agent_type", "model"]
+)
+LLM_REQUEST_ERRORS = REGISTRY.counter(
+    "prosessportal_llm_request_errors_total", "OpenAI chat completions that raised an error", ["agent_type", "model"]
+)
+LLM_PROMPT_TOKENS = REGISTRY.histogram(
+    "prosessportal_llm_prompt_tokens", "Prompt tokens per chat completion", ["agent_type"], TOKEN_BUCKETS
+)
+LLM_COMPLETION_TOKENS = REGISTRY.histogram(
+    "prosessportal_llm_completion_tokens", "Completion tokens per chat completion", ["agent_type"], TOKEN_BUCKETS
+)
+LLM_PARSE_SECONDS = REGISTRY.histogram(
+    "prosessportal_llm_parse_seconds", "Time spent parsing model responses", ["agent_type"], FAST_BUCKETS
+)
+LLM_PARSE_FAILURES = REGISTRY.counter(
+    "prosessportal_llm_parse_failures_total", "Model responses that could not be parsed as expected", ["agent_type"]
+)
+LLM_RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    "prosessportal_llm_rate_limit_wait_seconds", "Time chat completions waited for the shared rate limiter",
+    ["agent_type"], LOOP_LAG_BUCKETS
+)
+
+# Event loop
+EVENT_LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "prosessportal_event_loop_lag_seconds", "Delay between when the loop monitor was due and when it ran",
+    buckets=LOOP_LAG_BUCKETS
+)
+EVENT_LOOP_STALLS = REGISTRY.counter(
+    "prosessportal_event_loop_stalls_total", "Times the event loop was blocked longer than the lag threshold"
+)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve /metrics from a background thread, for processes without an HTTP API (worker.py)"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,157 @@
+"""
+ITIL practice classifier
+Compiles the practice vocabulary (data/itil/practice-vocabulary.json, plus the names and
+aliases of the practice files) into one Aho-Corasick automaton per knowledge-base version.
+A single pass over the request text finds every term of every practice; practices are
+scored by the weights of the distinct terms found (terms in the title count double) and
+returned ranked with their share of the total score as confidence.
+"""
+import re
+import collections
+from typing import Dict, Any, List, Iterator, Optional, Tuple
+
+from services.knowledge_base import versioned_cache
+from services.practice_index import get_practice_index
+
+VOCABULARY_FILE = "itil/practice-vocabulary.json"
+NAME_WEIGHT = 3.0
+TITLE_FACTOR = 2.0
+
+_NON_WORD = re.compile(r"[^0-9a-zæøåäöéü]+")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase words separated by single spaces, with a leading space so terms match at word starts"""
+    return " " + _NON_WORD.sub(" ", text.lower()).strip()
+
+
+class AhoCorasick:
+    """Multi-pattern matcher: finds all occurrences of all patterns in one pass over the text"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[List[Any]] = [[]]
+        self._built = False
+
+    def add(self, pattern: str, value: Any):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            node = next_node
+        self._outputs[node].append(value)
+        self._built = False
+
+    def build(self):
+        """Compute failure links breadth-first and merge the outputs of suffix states"""
+        queue = collections.deque(self._goto[0].values())
+        for node in queue:
+            self._fail[node] = 0
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._outputs[child] = self._outputs[child] + self._outputs[self._fail[child]]
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Any]:
+        """Values of every pattern occurrence in text"""
+        if not self._built:
+            self.build()
+        node = 0
+        for char in text:
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            yield from self._outputs[node]
+
+    @property
+    def states(self) -> int:
+        return len(self._goto)
+
+
+class PracticeClassifier:
+    """Scores every ITIL practice against a request in one pass per text field"""
+
+    def __init__(self, snapshot):
+        # (practice, term, weight) per distinct normalized term, highest weight kept
+        terms: Dict[Tuple[str, str], float] = {}
+        self.areas: Dict[str, str] = {}
+
+        def add_term(practice: str, term: str, weight: float):
+            key = (practice, normalize_text(term))
+            if key[1].strip():
+                terms[key] = max(terms.get(key, 0.0), float(weight))
+
+        vocabulary = snapshot.get(VOCABULARY_FILE) or {}
+        for practice, entry in vocabulary.get("practices", {}).items():
+            self.areas[practice] = entry.get("itil_area", "")
+            for language_terms in entry.get("terms", {}).values():
+                for term, weight in language_terms.items():
+                    add_term(practice, term, weight)
+
+        for entry in get_practice_index(snapshot).entries:
+            practice = entry.path.rsplit("/", 1)[1][:-len(".json")]
+            self.areas.setdefault(practice, entry.area)
+            for name in (entry.name, *entry.aliases):
+                add_term(practice, name, NAME_WEIGHT)
+
+        self._matcher = AhoCorasick()
+        for (practice, term), weight in terms.items():
+            self._matcher.add(term, (practice, term.strip(), weight))
+        self._matcher.build()
+
+    @property
+    def practices(self) -> List[str]:
+        return sorted(self.areas)
+
+    def classify(self, title: str, description: str = "", limit: int = 3) -> List[Dict[str, Any]]:
+        """Ranked practices with score, confidence (share of the total score) and matched terms"""
+        scores: Dict[str, float] = collections.defaultdict(float)
+        matched: Dict[str, List[str]] = collections.defaultdict(list)
+        for text, factor in ((title, TITLE_FACTOR), (description, 1.0)):
+            seen = set()
+            for practice, term, weight in self._matcher.iter_matches(normalize_text(text)):
+                if (practice, term) in seen:
+                    continue
+                seen.add((practice, term))
+                scores[practice] += weight * factor
+                if term not in matched[practice]:
+                    matched[practice].append(term)
+
+        total = sum(scores.values())
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [
+            {
+                "practice": practice,
+                "itil_area": self.areas.get(practice, ""),
+                "score": round(score, 2),
+                "confidence": round(score / total, 3),
+                "matched_terms": matched[practice]
+            }
+            for practice, score in ranked
+        ]
+
+    def best(self, title: str, description: str = "", min_confidence: float = 0.0) -> Optional[Dict[str, Any]]:
+        """Top candidate, or None when nothing matched or it is not confident enough"""
+        candidates = self.classify(title, description, limit=1)
+        if candidates and candidates[0]["confidence"] >= min_confidence:
+            return candidates[0]
+        return None
+
+
+@versioned_cache
+def get_practice_classifier(snapshot) -> PracticeClassifier:
+    """Practice classifier for a knowledge-base version, compiled once"""
+    return PracticeClassifier(snapshot)
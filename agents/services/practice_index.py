@@ -0,0 +1,109 @@
+"""
+Index of the ITIL practices in the knowledge base
+Built once per knowledge-base version from the practice metadata recorded in the snapshot
+header, so no practice body is decoded until it is asked for. Practices are found by name,
+alias (including the name in parentheses and the file name) or a close misspelling of either,
+optionally narrowed to an ITIL area.
+"""
+import re
+import difflib
+import threading
+import collections
+from typing import Dict, Any, List, Optional
+
+from services.knowledge_base import versioned_cache
+
+FUZZY_CUTOFF = 0.85
+MAX_FUZZY_CACHE = 1024
+
+
+def normalize_name(name: str) -> str:
+    """'Change Enablement (Change Management)' -> 'change-enablement-change-management'"""
+    return re.sub(r"[^0-9a-zæøå]+", "-", name.lower()).strip("-")
+
+
+class PracticeEntry:
+    """One practice file; the body is decoded from the snapshot on first access"""
+
+    __slots__ = ("name", "area", "path", "aliases", "_snapshot")
+
+    def __init__(self, name: str, area: str, path: str, aliases: List[str], snapshot):
+        self.name = name
+        self.area = area
+        self.path = path
+        self.aliases = aliases
+        self._snapshot = snapshot
+
+    @property
+    def knowledge(self) -> Dict[str, Any]:
+        return self._snapshot.get(self.path) or {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"practice": self.name, "itil_area": self.area, "path": self.path, "aliases": self.aliases}
+
+
+class PracticeIndex:
+    """Practice name, alias and area lookup with fuzzy matching"""
+
+    def __init__(self, snapshot):
+        self.entries: List[PracticeEntry] = []
+        self._by_key: Dict[str, List[PracticeEntry]] = collections.defaultdict(list)
+        self._fuzzy: Dict[str, Optional[str]] = {}
+        self._fuzzy_lock = threading.Lock()
+
+        for path, meta in sorted(snapshot.practices.items()):
+            if not path.startswith("itil/") or path.count("/") < 2:
+                continue
+            area_dir, filename = path.split("/")[1:3]
+            name = meta["practice"]
+            # "Change Enablement (Change Management)" is also known by each of its two names
+            parts = re.findall(r"[^()]+", name) if "(" in name else []
+            aliases = [filename[:-len(".json")], *parts, *meta.get("aliases", [])]
+            entry = PracticeEntry(name, area_dir, path, [alias.strip() for alias in aliases if alias.strip()], snapshot)
+            self.entries.append(entry)
+            for key in {normalize_name(name), *(normalize_name(alias) for alias in entry.aliases)}:
+                self._by_key[key].append(entry)
+
+    @property
+    def areas(self) -> List[str]:
+        return sorted({entry.area for entry in self.entries})
+
+    def _closest_key(self, key: str) -> Optional[str]:
+        """Closest known name or alias, memoized since difflib compares against every key"""
+        if key in self._fuzzy:
+            return self._fuzzy[key]
+        matches = difflib.get_close_matches(key, list(self._by_key), n=1, cutoff=FUZZY_CUTOFF)
+        closest = matches[0] if matches else None
+        with self._fuzzy_lock:
+            if len(self._fuzzy) >= MAX_FUZZY_CACHE:
+                self._fuzzy.clear()
+            self._fuzzy[key] = closest
+        return closest
+
+    def find(self, name: str, area: Optional[str] = None) -> Optional[PracticeEntry]:
+        """
+        Practice matching a name or alias, exactly after normalization or else by the closest
+        spelling; an entry in `area` is preferred, but a practice only found in another area
+        is still returned
+        """
+        key = normalize_name(name)
+        if key not in self._by_key:
+            key = self._closest_key(key)
+            if key is None:
+                return None
+        candidates = self._by_key[key]
+        area_key = normalize_name(area) if area else None
+        for entry in candidates:
+            if entry.area == area_key:
+                return entry
+        return candidates[0]
+
+    def in_area(self, area: str) -> List[PracticeEntry]:
+        area_key = normalize_name(area)
+        return [entry for entry in self.entries if entry.area == area_key]
+
+
+@versioned_cache
+def get_practice_index(snapshot) -> PracticeIndex:
+    """Practice index for a knowledge-base version, built once"""
+    return PracticeIndex(snapshot)
@@ -0,0 +1,251 @@
+"""
+On-demand profiling for the live agents service
+A session runs for a number of seconds, or for the next N jobs of an agent type, and
+produces either folded stacks from a sampling profiler (flamegraph.pl, speedscope,
+inferno) or a cProfile/pstats dump (snakeviz, flameprof). tracemalloc snapshots show
+which source lines hold memory, e.g. in the job table or the knowledge caches.
+Sampling shows where threads are executing; coroutines suspended in an await only show
+up in cProfile. Profiles cover the current process only; profile worker.py processes separately.
+"""
+import os
+import sys
+import asyncio
+import cProfile
+import marshal
+import threading
+import tracemalloc
+import collections
+from typing import Dict, Any, Optional
+
+PROFILE_MODES = ("sampling", "cprofile")
+DEFAULT_SAMPLE_INTERVAL = 0.005
+MAX_PROFILE_SECONDS = 300
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profiling session is already running"""
+    pass
+
+
+class ProfileResult:
+    __slots__ = ("content", "media_type", "filename")
+
+    def __init__(self, content: bytes, media_type: str, filename: str):
+        self.content = content
+        self.media_type = media_type
+        self.filename = filename
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads from a background thread and counts folded stacks"""
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: Dict[str, int] = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def result(self) -> ProfileResult:
+        """Folded stacks, one 'frame;frame;frame count' line per distinct stack"""
+        lines = [f"{stack} {count}" for stack, count in sorted(self.stacks.items())]
+        return ProfileResult("\n".join(lines).encode("utf-8") + b"\n", "text/plain; charset=utf-8", "profile.folded")
+
+
+class CProfileProfiler:
+    """Deterministic profile of the event loop thread (the thread that starts it)"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def result(self) -> ProfileResult:
+        """pstats dump, loadable with pstats.Stats or snakeviz"""
+        self.profile.create_stats()
+        return ProfileResult(marshal.dumps(self.profile.stats), "application/octet-stream", "profile.pstats")
+
+
+def _create_profiler(mode: str, interval: float):
+    if mode == "sampling":
+        return SamplingProfiler(interval)
+    if mode == "cprofile":
+        return CProfileProfiler()
+    raise ValueError(f"Unknown profile mode: {mode} (expected one of {', '.join(PROFILE_MODES)})")
+
+
+class _JobWatch:
+    """Profiles from the first matching job start until `count` matching jobs have finished"""
+
+    def __init__(self, agent_type: str, count: int, profiler, future: asyncio.Future):
+        self.agent_type = agent_type
+        self.remaining = count
+        self.profiler = profiler
+        self.future = future
+        self.started = False
+
+
+class ProfilerManager:
+    """Runs at most one profiling session at a time for this process"""
+
+    def __init__(self):
+        self._busy = False
+        self._watch: Optional[_JobWatch] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+
+    def _acquire(self):
+        if self._busy:
+            raise ProfilerBusyError("A profiling session is already running")
+        self._busy = True
+
+    async def profile_for(self, seconds: float, mode: str = "sampling",
+                          interval: float = DEFAULT_SAMPLE_INTERVAL) -> ProfileResult:
+        """Profile the whole process for a number of seconds"""
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            raise ValueError(f"seconds must be between 0 and {MAX_PROFILE_SECONDS}")
+        profiler = _create_profiler(mode, interval)
+        self._acquire()
+        try:
+            profiler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.stop()
+            return profiler.result()
+        finally:
+            self._busy = False
+
+    async def profile_jobs(self, agent_type: str, count: int, mode: str = "sampling",
+                           timeout: float = MAX_PROFILE_SECONDS,
+                           interval: float = DEFAULT_SAMPLE_INTERVAL) -> ProfileResult:
+        """
+        Profile while the next `count` jobs of an agent type run in this process's workers.
+        Other jobs running at the same time are included in the profile.
+        """
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        profiler = _create_profiler(mode, interval)
+        self._acquire()
+        watch = _JobWatch(agent_type, count, profiler, asyncio.get_running_loop().create_future())
+        self._watch = watch
+        try:
+            await asyncio.wait_for(asyncio.shield(watch.future), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Fewer than {count} '{agent_type}' jobs finished within {timeout:.0f}s")
+        finally:
+            self._watch = None
+            if watch.started and not watch.future.done():
+                profiler.stop()
+            self._busy = False
+        return profiler.result()
+
+    def job_started(self, agent_type: str):
+        """Called by the job queue when a worker in this process starts a job"""
+        watch = self._watch
+        if watch is not None and not watch.started and watch.agent_type == agent_type:
+            watch.started = True
+            watch.profiler.start()
+
+    def job_finished(self, agent_type: str):
+        """Called by the job queue when a worker in this process finishes a job"""
+        watch = self._watch
+        if watch is None or not watch.started or watch.agent_type != agent_type:
+            return
+        watch.remaining -= 1
+        if watch.remaining <= 0 and not watch.future.done():
+            watch.profiler.stop()
+            watch.future.set_result(None)
+
+    def start_tracemalloc(self, frames: int = 10) -> Dict[str, Any]:
+        """Start tracing allocations; only memory allocated from now on is attributed"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self._snapshot = None
+        return self.tracemalloc_status()
+
+    def stop_tracemalloc(self) -> Dict[str, Any]:
+        tracemalloc.stop()
+        self._snapshot = None
+        return self.tracemalloc_status()
+
+    def tracemalloc_status(self) -> Dict[str, Any]:
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "tracing": tracemalloc.is_tracing(),
+            "frames": tracemalloc.get_traceback_limit(),
+            "current_bytes": current,
+            "peak_bytes": peak
+        }
+
+    def tracemalloc_snapshot(self, limit: int = 25, group_by: str = "lineno",
+                             path_filter: Optional[str] = None) -> Dict[str, Any]:
+        """Top allocations, plus the growth since the previous snapshot"""
+        if not tracemalloc.is_tracing():
+            raise ValueError("tracemalloc is not running; start it first")
+        if group_by not in ("lineno", "filename", "traceback"):
+            raise ValueError("group_by must be lineno, filename or traceback")
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>")
+        ])
+        if path_filter:
+            snapshot = snapshot.filter_traces([tracemalloc.Filter(True, f"*{path_filter}*")])
+
+        result = self.tracemalloc_status()
+        result["top"] = [_format_stat(stat) for stat in snapshot.statistics(group_by)[:limit]]
+        if self._snapshot is not None:
+            result["growth"] = [
+                _format_stat(stat) for stat in snapshot.compare_to(self._snapshot, group_by)[:limit]
+            ]
+        self._snapshot = snapshot
+        return result
+
+
+def _format_stat(stat) -> Dict[str, Any]:
+    entry = {
+        "location": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+        "size_bytes": stat.size,
+        "count": stat.count
+    }
+    if hasattr(stat, "size_diff"):
+        entry["size_diff_bytes"] = stat.size_diff
+        entry["count_diff"] = stat.count_diff
+    return entry
+
+
+PROFILER = ProfilerManager()
@@ -0,0 +1,75 @@
+"""
+Shared rate limiter for OpenAI calls
+Every chat completion made through services.llm passes through LLM_RATE_LIMITER, which caps
+the number of concurrent async calls and spaces call starts to a requests-per-minute budget.
+Limits apply per process; with worker processes, divide the account's limits between them.
+Synchronous calls (the SIAM agent, in threads) share the request budget but not the
+concurrency cap.
+"""
+import os
+import time
+import asyncio
+import threading
+import contextlib
+from typing import Optional
+
+from services.metrics import LLM_RATE_LIMIT_WAIT_SECONDS
+
+
+class RateLimiter:
+    """Concurrency cap plus evenly spaced call starts"""
+
+    def __init__(self, max_concurrency: Optional[int] = None, requests_per_minute: Optional[float] = None):
+        self.max_concurrency = max_concurrency or int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+        rpm = requests_per_minute if requests_per_minute is not None else float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "0"))
+        # Seconds between call starts; 0 means no request budget
+        self.interval = 60.0 / rpm if rpm > 0 else 0.0
+        self._next_start = 0.0
+        self._slot_lock = threading.Lock()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.in_flight = 0
+
+    def _reserve_start(self) -> float:
+        """Seconds to wait before the next call may start"""
+        if not self.interval:
+            return 0.0
+        with self._slot_lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.interval
+            return start - now
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    @contextlib.asynccontextmanager
+    async def limit(self, agent_type: str = ""):
+        """Wait for a concurrency slot and the next start in the request budget"""
+        started = time.perf_counter()
+        async with self._get_semaphore():
+            delay = self._reserve_start()
+            if delay:
+                await asyncio.sleep(delay)
+            LLM_RATE_LIMIT_WAIT_SECONDS.labels(agent_type).observe(time.perf_counter() - started)
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    @contextlib.contextmanager
+    def limit_sync(self, agent_type: str = ""):
+        """Wait for the next start in the request budget (blocking; call from a thread)"""
+        delay = self._reserve_start()
+        if delay:
+            time.sleep(delay)
+        LLM_RATE_LIMIT_WAIT_SECONDS.labels(agent_type).observe(delay)
+        yield
+
+
+LLM_RATE_LIMITER = RateLimiter()
@@ -0,0 +1,178 @@
+"""
+BM25 retrieval over the ITIL knowledge base
+Every activity, metric, role, concept and guiding principle in the knowledge-base snapshot
+becomes a passage in an inverted index. Prompts include the passages most relevant to
+the request instead of fixed slices of the practice files. Tokenization handles Norwegian
+and English; Norwegian query terms are also expanded to the English ITIL vocabulary the
+knowledge base is written in.
+"""
+import re
+import math
+import collections
+from typing import Dict, Any, List, Optional, Iterable
+
+from services.knowledge_base import versioned_cache
+
+TOKEN_PATTERN = re.compile(r"[0-9a-zæøåäöéü]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in into is it its of on or that the their this to was were will with
+all any can each how if not our should such than then these they which who why within without your
+og i jeg det at en et den til er som på de med han av ikke der så var meg seg men ett har om vi min mitt ha
+hadde hun nå over da ved fra du ut sin dem oss opp man kan hans hvor eller hva skal selv sjøl her alle vil bli
+ble blitt kunne inn når være kom noen noe ville dere deres kun ja etter ned skulle denne for deg si sine sitt
+mot å meget hvorfor dette disse uten hvordan ingen din ditt blir samme hvilken hvilke sånn inni mellom vår
+våre hver hvem vors dei eit berre også mer mye nye ny skal bør må
+""".split())
+
+# Longest suffix first; a suffix is only stripped if a stem of at least 4 characters remains
+_SUFFIXES = (
+    "ingene", "ingen", "ingar", "heten", "ions", "ene", "ane", "ing", "ion", "ies", "ers", "er", "en", "et",
+    "ar", "es", "ed", "e", "s"
+)
+
+# Norwegian ITIL vocabulary mapped to the English terms used in data/itil (matched inside
+# compounds, so "hendelseshåndtering" expands to incident + management)
+NORWEGIAN_GLOSSARY = {
+    "hendelse": "incident", "endring": "change", "problem": "problem", "tjeneste": "service",
+    "leverandør": "supplier vendor", "eskaler": "escalation escalate", "godkjen": "approval authorize",
+    "risiko": "risk", "måling": "measurement metric", "målepunkt": "metric", "håndtering": "management",
+    "styring": "management governance", "forbedring": "improvement", "kunnskap": "knowledge",
+    "kunde": "customer", "bruker": "user", "brukerstøtte": "service desk support", "feil": "failure error",
+    "løsning": "resolution solution", "diagnos": "diagnosis", "kategori": "categorization category",
+    "prioriter": "prioritization priority", "logg": "logging log", "registrer": "logging record",
+    "avslut": "closure close", "gjennomgang": "review", "planlegg": "planning plan", "vurder": "assessment",
+    "implementer": "implementation implement", "utrulling": "deployment release", "rolle": "role",
+    "ansvar": "responsibility", "nødendring": "emergency change", "standardendring": "standard change",
+    "tidsplan": "schedule", "verdi": "value", "prinsipp": "principle", "samarbeid": "collaborate",
+    "tilbakemelding": "feedback", "overvåk": "monitoring", "kapasitet": "capacity", "tilgjengelig": "availability",
+    "sikkerhet": "security", "avtale": "agreement", "nivå": "level", "rapport": "reporting report",
+    "opplæring": "training", "dokument": "documentation", "frist": "deadline", "varsling": "notification",
+    "kommunikasjon": "communication", "beslutning": "decision",
+}
+
+
+def _stem(token: str) -> str:
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            if suffix == "s" and token.endswith("ss"):
+                return token
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, split on non-letters, drop Norwegian/English stopwords and strip common suffixes"""
+    return [_stem(token) for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def expand_query(text: str) -> List[str]:
+    """Query tokens plus English equivalents of Norwegian ITIL terms found in them"""
+    tokens = tokenize(text)
+    expanded = list(tokens)
+    for word in TOKEN_PATTERN.findall(text.lower()):
+        for norwegian, english in NORWEGIAN_GLOSSARY.items():
+            if norwegian in word:
+                expanded.extend(tokenize(english))
+    return expanded
+
+
+class BM25Index:
+    """Okapi BM25 over an in-memory inverted index"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents: List[Dict[str, Any]] = []
+        self._lengths: List[int] = []
+        self._postings: Dict[str, List[tuple]] = collections.defaultdict(list)
+        self._total_length = 0
+        self._average_length = 0.0
+
+    def add(self, text: str, document: Dict[str, Any]):
+        doc_id = len(self.documents)
+        counts = collections.Counter(tokenize(text))
+        for term, frequency in counts.items():
+            self._postings[term].append((doc_id, frequency))
+        self.documents.append(document)
+        self._lengths.append(sum(counts.values()))
+        # Running total, so building an index of N documents stays linear
+        self._total_length += self._lengths[-1]
+        self._average_length = self._total_length / len(self._lengths)
+
+    def _idf(self, term: str) -> float:
+        matching = len(self._postings.get(term, ()))
+        return math.log(1 + (len(self.documents) - matching + 0.5) / (matching + 0.5))
+
+    def search(self, query_terms: Iterable[str], k: int = 8, boost: Optional[Dict[str, float]] = None,
+               min_relative_score: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        Top-k documents for the query terms; boost multiplies scores of documents by source,
+        and documents scoring below min_relative_score times the best score are dropped
+        """
+        scores: Dict[int, float] = collections.defaultdict(float)
+        for term in set(query_terms):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf(term)
+            for doc_id, frequency in postings:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / self._average_length)
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        if boost:
+            for doc_id in scores:
+                scores[doc_id] *= boost.get(self.documents[doc_id].get("source"), 1.0)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        if ranked:
+            cutoff = ranked[0][1] * min_relative_score
+            ranked = [(doc_id, score) for doc_id, score in ranked if score >= cutoff]
+        return [dict(self.documents[doc_id], score=round(score, 4)) for doc_id, score in ranked]
+
+
+def _itil_passages(snapshot) -> Iterable[tuple]:
+    """(text, passage) pairs for every indexable entry in the ITIL part of the snapshot"""
+    svs = snapshot.get("itil/service-value-system.json") or {}
+    components = svs.get("components", {})
+    for principle in components.get("guiding_principles", []):
+        yield (f"{principle.get('name', '')} {principle.get('description', '')}",
+               {"kind": "principle", "source": "service-value-system", "title": principle.get("name", ""),
+                "text": principle.get("description", "")})
+    for activity in components.get("service_value_chain", {}).get("activities", []):
+        inputs = ", ".join(activity.get("key_inputs", []))
+        outputs = ", ".join(activity.get("key_outputs", []))
+        yield (f"{activity.get('name', '')} {activity.get('purpose', '')} {inputs} {outputs}",
+               {"kind": "value_chain_activity", "source": "service-value-system", "title": activity.get("name", ""),
+                "text": activity.get("purpose", "")})
+
+    for name in snapshot.files():
+        if not name.startswith("itil/") or name.count("/") < 2:
+            continue
+        practice = snapshot.get(name) or {}
+        source = name.rsplit("/", 1)[1][:-len(".json")]
+        for activity in practice.get("key_activities", []):
+            sub_activities = "; ".join(activity.get("sub_activities", []))
+            yield (f"{activity.get('activity', '')} {activity.get('description', '')} {sub_activities}",
+                   {"kind": "activity", "source": source, "title": activity.get("activity", ""),
+                    "text": activity.get("description", ""), "details": activity.get("sub_activities", [])})
+        for metric in practice.get("key_metrics", []):
+            yield (f"{metric.get('metric', '')} {metric.get('description', '')} {metric.get('measurement', '')}",
+                   {"kind": "metric", "source": source, "title": metric.get("metric", ""),
+                    "text": metric.get("description", ""), "details": [metric.get("measurement", "")]})
+        for role, duties in practice.get("roles_and_responsibilities", {}).items():
+            role_name = role.replace("_", " ")
+            yield (f"{role_name} {' '.join(duties)}",
+                   {"kind": "role", "source": source, "title": role_name, "text": "; ".join(duties[:2])})
+        for concept, text in practice.get("key_concepts", {}).items():
+            concept_name = concept.replace("_", " ")
+            yield (f"{concept_name} {text}",
+                   {"kind": "concept", "source": source, "title": concept_name, "text": text})
+
+
+@versioned_cache
+def get_itil_index(snapshot) -> BM25Index:
+    """BM25 index of the ITIL passages, built once per knowledge-base version"""
+    index = BM25Index()
+    for text, passage in _itil_passages(snapshot):
+        index.add(text, passage)
+    return index
@@ -0,0 +1,310 @@
+"""
+Lightweight tracing for API requests and agent jobs
+Spans follow the W3C trace context (traceparent), are collected per job for the timeline
+endpoint, and can be exported to a JSON-lines file or an OTLP/HTTP collector.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextlib
+import contextvars
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "prosessportal-agents"
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+# Finished spans are also appended to this list (the running job's span list)
+_span_sink: contextvars.ContextVar = contextvars.ContextVar("span_sink", default=None)
+_exporter: Optional["BatchSpanExporter"] = None
+
+
+def _new_trace_id() -> str:
+    return os.urandom(16).hex()
+
+
+def _new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Return (trace_id, parent_span_id) from a W3C traceparent header, or None if invalid"""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    return parts[1].lower(), parts[2].lower()
+
+
+def format_traceparent(trace_id: str, span_id: str) -> str:
+    return f"00-{trace_id}-{span_id}-01"
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "status")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_span_id()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.status = "ok"
+
+    @property
+    def traceparent(self) -> str:
+        return format_traceparent(self.trace_id, self.span_id)
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "attributes": self.attributes,
+            "status": self.status
+        }
+
+
+def _resolve_parent(parent: Optional[str]) -> Tuple[str, Optional[str]]:
+    """Trace id and parent span id for a new span: explicit traceparent, current span, or a new trace"""
+    remote = parse_traceparent(parent)
+    if remote:
+        return remote
+    current = _current_span.get()
+    if current is not None:
+        return current.trace_id, current.span_id
+    return _new_trace_id(), None
+
+
+@contextlib.contextmanager
+def start_span(name: str, parent: Optional[str] = None, **attributes: Any):
+    """Run the block inside a span; child spans and tasks started in it are nested under it"""
+    trace_id, parent_id = _resolve_parent(parent)
+    span = Span(name, trace_id, parent_id, attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.status = "error"
+        span.attributes["error"] = str(e) or type(e).__name__
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        _finish(span)
+
+
+def record_span(name: str, start_ns: int, end_ns: int, parent: Optional[str] = None, **attributes: Any) -> Span:
+    """Record a span for an interval that was measured elsewhere (e.g. time spent queued)"""
+    trace_id, parent_id = _resolve_parent(parent)
+    span = Span(name, trace_id, parent_id, attributes)
+    span.start_ns = start_ns
+    span.end_ns = end_ns
+    _finish(span)
+    return span
+
+
+def _finish(span: Span):
+    sink = _span_sink.get()
+    if sink is not None:
+        sink.append(span.to_dict())
+    if _exporter is not None:
+        _exporter.export(span.to_dict())
+
+
+@contextlib.contextmanager
+def collect_spans(sink: List[Dict[str, Any]]):
+    """Append every span finished inside the block to sink"""
+    token = _span_sink.set(sink)
+    try:
+        yield
+    finally:
+        _span_sink.reset(token)
+
+
+def current_traceparent() -> Optional[str]:
+    span = _current_span.get()
+    return span.traceparent if span is not None else None
+
+
+def new_traceparent() -> str:
+    """A traceparent for work that does not start inside a traced request"""
+    return format_traceparent(_new_trace_id(), _new_span_id())
+
+
+def build_timeline(spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Turn a job's spans into a waterfall of offsets and durations (milliseconds)"""
+    finished = sorted((span for span in spans if span.get("end_ns")), key=lambda span: span["start_ns"])
+    if not finished:
+        return {"trace_id": None, "total_ms": 0, "spans": []}
+
+    origin = finished[0]["start_ns"]
+    end = max(span["end_ns"] for span in finished)
+    return {
+        "trace_id": finished[0]["trace_id"],
+        "total_ms": round((end - origin) / 1e6, 3),
+        "spans": [
+            {
+                "name": span["name"],
+                "span_id": span["span_id"],
+                "parent_id": span["parent_id"],
+                "offset_ms": round((span["start_ns"] - origin) / 1e6, 3),
+                "duration_ms": round((span["end_ns"] - span["start_ns"]) / 1e6, 3),
+                "status": span["status"],
+                "attributes": span["attributes"]
+            }
+            for span in finished
+        ]
+    }
+
+
+class BatchSpanExporter:
+    """Exports finished spans in batches from a background thread"""
+
+    def __init__(self, max_batch: int = 512, flush_interval: float = 2.0):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=10000)
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Dict[str, Any]):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            pass
+
+    def _run(self):
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                try:
+                    span = self._queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+                except queue.Empty:
+                    break
+                if span is None:
+                    self._flush(batch)
+                    return
+                batch.append(span)
+            self._flush(batch)
+
+    def _flush(self, batch: List[Dict[str, Any]]):
+        if not batch:
+            return
+        try:
+            self.write(batch)
+        except Exception:
+            logger.exception("Failed to export spans", extra={"spans": len(batch)})
+
+    def write(self, batch: List[Dict[str, Any]]):
+        raise NotImplementedError
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+class FileSpanExporter(BatchSpanExporter):
+    """Appends spans as JSON lines to a local file"""
+
+    def __init__(self, path: str, **kwargs):
+        self.path = path
+        super().__init__(**kwargs)
+
+    def write(self, batch: List[Dict[str, Any]]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in batch:
+                f.write(json.dumps(span, default=str, ensure_ascii=False) + "\n")
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPSpanExporter(BatchSpanExporter):
+    """Posts spans to an OTLP/HTTP collector using the JSON encoding"""
+
+    def __init__(self, endpoint: str, **kwargs):
+        import httpx
+
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.client = httpx.Client(timeout=5.0)
+        super().__init__(**kwargs)
+
+    def write(self, batch: List[Dict[str, Any]]):
+        spans = [
+            {
+                "traceId": span["trace_id"],
+                "spanId": span["span_id"],
+                "parentSpanId": span["parent_id"] or "",
+                "name": span["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(span["start_ns"]),
+                "endTimeUnixNano": str(span["end_ns"]),
+                "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span["attributes"].items()],
+                "status": {"code": 2 if span["status"] == "error" else 1}
+            }
+            for span in batch
+        ]
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{"scope": {"name": "prosessportal.tracing"}, "spans": spans}]
+            }]
+        }
+        self.client.post(self.url, json=payload).raise_for_status()
+
+
+def configure_tracing():
+    """
+    Set up span export from the environment:
+    TRACE_EXPORTER=none|file|otlp, TRACE_FILE (default traces.jsonl),
+    OTEL_EXPORTER_OTLP_ENDPOINT (default http://localhost:4318)
+    """
+    global _exporter
+    if _exporter is not None:
+        return
+
+    kind = os.getenv("TRACE_EXPORTER", "none").lower()
+    if kind == "file":
+        _exporter = FileSpanExporter(os.getenv("TRACE_FILE", "traces.jsonl"))
+    elif kind == "otlp":
+        _exporter = OTLPSpanExporter(os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318"))
+    else:
+        return
+    atexit.register(shutdown_tracing)
+
+
+def shutdown_tracing():
+    """Flush pending spans and stop the exporter"""
+    global _exporter
+    if _exporter is not None:
+        _exporter.shutdown()
+        _exporter = None
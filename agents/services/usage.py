@@ -0,0 +1,192 @@
+"""
+Token and cost accounting for OpenAI calls
+Each completion's usage is added to the running job's record and to per-user, per-agent
+totals that are flushed periodically to the job backend's shared counters.
+"""
+import os
+import asyncio
+import logging
+import contextlib
+import contextvars
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Integer fields accumulated per call; cost is kept in micro-dollars so it fits the counters
+USAGE_FIELDS = ("calls", "prompt_tokens", "completion_tokens", "cached_tokens", "latency_ms", "cost_microusd")
+USAGE_METRICS = USAGE_FIELDS + ("total_tokens",)
+USAGE_GROUPS = ("user", "agent", "user_agent")
+USAGE_COUNTERS = "usage"
+
+# USD per million tokens: (prompt, cached prompt, completion). Longest prefix wins,
+# so dated snapshots such as gpt-4o-2024-08-06 use their family's price
+MODEL_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4": (30.0, 30.0, 60.0),
+    "gpt-4-turbo": (10.0, 10.0, 30.0),
+    "gpt-4o": (2.5, 1.25, 10.0),
+    "gpt-4o-mini": (0.15, 0.075, 0.6),
+    "gpt-4.1": (2.0, 0.5, 8.0),
+    "gpt-4.1-mini": (0.4, 0.1, 1.6),
+    "gpt-3.5-turbo": (0.5, 0.5, 1.5),
+}
+
+# (accountant, user_id, job usage record, event loop) for the job running in this context
+_usage_scope: contextvars.ContextVar = contextvars.ContextVar("usage_scope", default=None)
+
+
+def _model_price(model: str) -> Optional[Tuple[float, float, float]]:
+    matches = [name for name in MODEL_PRICES if model == name or model.startswith(name + "-")]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+def usage_from_response(model: str, response: Any, seconds: float) -> Optional[Dict[str, int]]:
+    """Extract token counts and estimated cost from a chat completion response"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return None
+
+    prompt = usage.prompt_tokens or 0
+    completion = usage.completion_tokens or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+
+    cost = 0.0
+    price = _model_price(model)
+    if price is not None:
+        prompt_price, cached_price, completion_price = price
+        cost = (prompt - cached) * prompt_price + cached * cached_price + completion * completion_price
+    return {
+        "calls": 1,
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "cached_tokens": cached,
+        "latency_ms": int(round(seconds * 1000)),
+        "cost_microusd": int(round(cost))
+    }
+
+
+def _add(totals: Dict[str, int], usage: Dict[str, int]):
+    for field in USAGE_FIELDS:
+        totals[field] = totals.get(field, 0) + usage.get(field, 0)
+
+
+def record_usage(agent_type: str, model: str, usage: Dict[str, int]):
+    """Attribute a completion's usage to the running job and its user (no-op outside jobs)"""
+    scope = _usage_scope.get()
+    if scope is None:
+        return
+    accountant, user_id, job_usage, loop = scope
+
+    def apply():
+        _add(job_usage, usage)
+        models = job_usage.setdefault("models", [])
+        if model not in models:
+            models.append(model)
+        accountant.record(user_id, agent_type, usage)
+
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if loop is None or running is loop:
+        apply()
+    else:
+        # Called from a worker thread (synchronous agents run in asyncio.to_thread): the job record
+        # and pending totals are only touched on the event loop, where flushes and saves read them.
+        # The callback is queued before the thread's result, so it runs before the job continues
+        try:
+            loop.call_soon_threadsafe(apply)
+        except RuntimeError:
+            logger.warning("Dropped usage recorded after the job's event loop closed", extra={"agent_type": agent_type})
+
+
+@contextlib.contextmanager
+def usage_scope(accountant: "UsageAccountant", user_id: str, job_usage: Dict[str, Any]):
+    """Attribute completions made inside the block to a job and its user"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    token = _usage_scope.set((accountant, user_id, job_usage, loop))
+    try:
+        yield
+    finally:
+        _usage_scope.reset(token)
+
+
+class UsageAccountant:
+    """
+    Aggregates usage per (user, agent) in memory and flushes the deltas to shared counters.
+    pending is only touched on the event loop (record_usage hands calls from threads over)
+    """
+
+    def __init__(self, backend, flush_interval: Optional[float] = None):
+        self.backend = backend
+        self.flush_interval = flush_interval or float(os.getenv("USAGE_FLUSH_SECONDS", "10"))
+        self.pending: Dict[Tuple[str, str], Dict[str, int]] = {}
+
+    def record(self, user_id: str, agent_type: str, usage: Dict[str, int]):
+        _add(self.pending.setdefault((user_id or "unknown", agent_type), {}), usage)
+
+    async def flush(self):
+        """Add pending totals to the backend counters"""
+        pending, self.pending = self.pending, {}
+        try:
+            for (user_id, agent_type), totals in pending.items():
+                for field in list(totals):
+                    if totals[field]:
+                        await self.backend.increment_counter(USAGE_COUNTERS, f"{user_id}|{agent_type}|{field}", totals[field])
+                    # Written counters leave pending, so a failure below does not count them twice
+                    del totals[field]
+        except Exception:
+            # Keep what was not written for the next flush
+            for key, totals in pending.items():
+                if totals:
+                    _add(self.pending.setdefault(key, {}), totals)
+            raise
+
+    async def run(self):
+        """Flush periodically until cancelled"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush usage counters")
+
+    async def totals(self) -> Dict[Tuple[str, str], Dict[str, int]]:
+        """Flushed totals from all processes plus this process's pending usage"""
+        totals: Dict[Tuple[str, str], Dict[str, int]] = {}
+        for field, value in (await self.backend.get_counters(USAGE_COUNTERS)).items():
+            user_id, agent_type, name = field.rsplit("|", 2)
+            totals.setdefault((user_id, agent_type), {})[name] = int(value)
+        for key, pending in self.pending.items():
+            _add(totals.setdefault(key, {}), pending)
+        return totals
+
+    async def top_consumers(self, group_by: str = "user", metric: str = "cost_microusd",
+                            limit: int = 10) -> List[Dict[str, Any]]:
+        """Rank users, agents or user/agent pairs by a usage metric"""
+        if group_by not in USAGE_GROUPS:
+            raise ValueError(f"group_by must be one of {', '.join(USAGE_GROUPS)}")
+        if metric not in USAGE_METRICS:
+            raise ValueError(f"metric must be one of {', '.join(USAGE_METRICS)}")
+
+        groups: Dict[Tuple[str, ...], Dict[str, int]] = {}
+        for (user_id, agent_type), totals in (await self.totals()).items():
+            key = {"user": (user_id,), "agent": (agent_type,), "user_agent": (user_id, agent_type)}[group_by]
+            _add(groups.setdefault(key, {}), totals)
+
+        ranked = []
+        for key, totals in groups.items():
+            entry = {field: totals.get(field, 0) for field in USAGE_FIELDS}
+            entry["total_tokens"] = entry["prompt_tokens"] + entry["completion_tokens"]
+            entry["cost_usd"] = round(entry["cost_microusd"] / 1e6, 6)
+            entry["avg_latency_ms"] = entry["latency_ms"] // entry["calls"] if entry["calls"] else None
+            if group_by != "agent":
+                entry["user_id"] = key[0]
+            if group_by != "user":
+                entry["agent_type"] = key[-1]
+            ranked.append(entry)
+        ranked.sort(key=lambda entry: entry[metric], reverse=True)
+        return ranked[:limit]
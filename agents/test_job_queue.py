@@ -0,0 +1,1362 @@
+#!/usr/bin/env python3
+"""
+Test script for the job queue
+Runs jobs against lightweight stand-in agents, so no OpenAI API key is required
+"""
+import os
+import sys
+import json
+import time
+import marshal
+import asyncio
+import logging
+import tempfile
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+from services.job_queue import (
+    JobQueue, JobStatus, QueueFullError, QueueClosedError, DeadlineUnachievableError, DeadlinePolicy
+)
+from services.duration_estimator import DurationEstimator, DEFAULT_DURATIONS
+from services.job_backends import SQLiteJobBackend
+from services.metrics import REGISTRY, MetricsRegistry
+from services.llm import create_chat_completion
+from services.structured_logging import ContextFilter, JsonFormatter, ProgressSampler, log_context
+from services.tracing import start_span, parse_traceparent
+from services.profiling import ProfilerManager, PROFILER
+from services.loop_monitor import LoopLagMonitor
+from services.knowledge_base import KnowledgeBaseSnapshot, compile_snapshot, load_snapshot, reload_knowledge_base
+from services.retrieval import BM25Index, expand_query, tokenize
+from services.practice_index import PracticeIndex
+from services.practice_classifier import AhoCorasick
+from services.compliance_rules import ComplianceRuleSet
+import services.knowledge_base as knowledge_base
+import services.retrieval as retrieval
+
+
+class FakeClassifier:
+    """Stand-in for DocumentClassifierAgent returning a fixed classification"""
+
+    async def classify_document(self, request_data, progress_callback):
+        await progress_callback(50, "Classifying...")
+        await asyncio.sleep(0.01)
+        return {
+            "document_type": "INVOICE",
+            "business_category": "Økonomi",
+            "suggested_processes": [
+                {"process_name": "Fakturabehandling", "description": "Behandle innkommende faktura", "priority": "high"}
+            ]
+        }
+
+
+class FakeGenerator:
+    """Stand-in for ProcessGeneratorAgent echoing the request into a process"""
+
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.calls = []
+
+    async def generate_process(self, request_data, progress_callback):
+        self.calls.append(request_data)
+        await progress_callback(50, "Generating...")
+        await asyncio.sleep(self.delay)
+        return {
+            "title": request_data["title"],
+            "description": request_data.get("description", ""),
+            "category": request_data.get("category", ""),
+            "steps": [{"title": "Registrer faktura", "responsible_role": "Økonomi"}]
+        }
+
+
+class FakeValidator:
+    """Stand-in for ITILKnowledgeAgent validation"""
+
+    def validate_process_against_itil(self, process_data):
+        return {"compliance_score": 0.9, "validated_title": process_data.get("title")}
+
+
+def fake_agents(generator=None):
+    return {
+        "document_classifier": FakeClassifier(),
+        "process_generator": generator or FakeGenerator(),
+        "itil_validator": FakeValidator()
+    }
+
+
+async def wait_for_job(queue: JobQueue, job_id: str, timeout: float = 5.0):
+    """Poll until a job leaves the queued/running states"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while asyncio.get_running_loop().time() < deadline:
+        status = await queue.get_job_status(job_id)
+        if status["status"] in (JobStatus.COMPLETED, JobStatus.FAILED):
+            return status
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish in time")
+
+
+def test_pipeline_passes_outputs_forward():
+    """Test classify → generate → validate pipeline in one submission"""
+    print("🔍 Testing pipeline execution...")
+
+    async def run():
+        queue = JobQueue(agents=fake_agents())
+        await queue.initialize()
+        try:
+            job_id = await queue.submit_pipeline([
+                {"name": "classify", "agent_type": "document_classifier", "request_data": {"document_content": "Faktura"}},
+                {
+                    "name": "generate",
+                    "agent_type": "process_generator",
+                    "depends_on": ["classify"],
+                    "inputs": {
+                        "title": "classify.suggested_processes.0.process_name",
+                        "category": "classify.business_category"
+                    }
+                },
+                {"name": "validate", "agent_type": "itil_validator", "depends_on": ["generate"], "inputs": {"process": "generate"}}
+            ], user_id="user_123")
+
+            status = await wait_for_job(queue, job_id)
+            assert status["status"] == JobStatus.COMPLETED, status
+            assert status["progress"] == 100
+            assert all(stage["status"] == JobStatus.COMPLETED for stage in status["stages"].values())
+
+            result = await queue.get_job_result(job_id)
+            assert result["stages"]["generate"]["title"] == "Fakturabehandling"
+            assert result["stages"]["generate"]["category"] == "Økonomi"
+            assert result["stages"]["validate"]["validated_title"] == "Fakturabehandling"
+        finally:
+            await queue.cleanup()
+
+    asyncio.run(run())
+    print("✅ Pipeline stages chained server-side")
+
+
+def test_pipeline_runs_independent_stages_concurrently():
+    """Test that independent branches run at the same time"""
+    print("\n🔍 Testing concurrent pipeline branches...")
+
+    async def run():
+        queue = JobQueue(agents=fake_agents(FakeGenerator(delay=0.2)))
+        await queue.initialize()
+        try:
+            stages = [
+                {"name": f"generate_{i}", "agent_type": "process_generator", "request_data": {"title": f"Prosess {i}"}}
+                for i in range(3)
+            ]
+            started = asyncio.get_running_loop().time()
+            job_id = await queue.submit_pipeline(stages, user_id="user_123")
+            status = await wait_for_job(queue, job_id)
+            elapsed = asyncio.get_running_loop().time() - started
+
+            assert status["status"] == JobStatus.COMPLETED
+            assert elapsed < 0.5, f"Branches ran sequentially ({elapsed:.2f}s)"
+        finally:
+            await queue.cleanup()
+
+    asyncio.run(run())
+    print("✅ Independent stages ran concurrently")
+
+
+def test_pipeline_validation():
+    """Test rejection of invalid pipeline definitions"""
+    print("\n🔍 Testing pipeline validation...")
+
+    async def run():
+        queue = JobQueue(agents=fake_agents())
+        invalid_pipelines = [
+            [],
+            [{"name": "a", "agent_type": "unknown_agent"}],
+            [{"name": "a", "agent_type": "process_generator", "depends_on": ["missing"]}],
+            [
+                {"name": "a", "agent_type": "process_generator", "depends_on": ["b"]},
+                {"name": "b", "agent_type": "process_generator", "depends_on": ["a"]}
+            ],
+            [{"name": "a", "agent_type": "process_generator", "inputs": {"title": "b.title"}}]
+        ]
+        for stages in invalid_pipelines:
+            try:
+                await queue.submit_pipeline(stages, user_id="user_123")
+            except ValueError:
+                continue
+            raise AssertionError(f"Pipeline should have been rejected: {stages}")
+        assert not queue.backend.jobs
+
+    asyncio.run(run())
+    print("✅ Invalid pipelines rejected before queueing")
+
+
+def test_pipeline_stage_failure():
+    """Test that a failing stage fails the pipeline job"""
+    print("\n🔍 Testing pipeline stage failure...")
+
+    async def run():
+        queue = JobQueue(agents=fake_agents())
+        await queue.initialize()
+        try:
+            job_id = await queue.submit_pipeline([
+                {"name": "classify", "agent_type": "document_classifier"},
+                {
+                    "name": "generate",
+                    "agent_type": "process_generator",
+                    "depends_on": ["classify"],
+                    "inputs": {"title": "classify.suggested_processes.5.process_name"}
+                }
+            ], user_id="user_123")
+            status = await wait_for_job(queue, job_id)
+            assert status["status"] == JobStatus.FAILED
+            assert status["stages"]["classify"]["status"] == JobStatus.COMPLETED
+            assert "generate" in status["error_message"]
+        finally:
+            await queue.cleanup()
+
+    class FailingOrSlowGenerator(FakeGenerator):
+        """Fails for the title "fail"; any other stage runs until cancelled"""
+
+        def __init__(self):
+            super().__init__(delay=5.0)
+            self.unwound = []
+
+        async def generate_process(self, request_data, progress_callback):
+            if request_data["title"] == "fail":
+                raise RuntimeError("generation failed")
+            try:
+                return await super().generate_process(request_data, progress_callback)
+            except asyncio.CancelledError:
+                await asyncio.sleep(0.05)
+                self.unwound.append(request_data["title"])
+                raise
+
+    async def run_siblings():
+        generator = FailingOrSlowGenerator()
+        queue = JobQueue(agents=fake_agents(generator))
+        await queue.initialize()
+        try:
+            job_id = await queue.submit_pipeline([
+                {"name": "slow", "agent_type": "process_generator", "request_data": {"title": "slow"}},
+                {"name": "failing", "agent_type": "process_generator", "request_data": {"title": "fail"}}
+            ], user_id="user_123")
+            status = await wait_for_job(queue, job_id)
+            assert status["status"] == JobStatus.FAILED
+            # The sibling stage has finished unwinding by the time the job is reported failed
+            assert generator.unwound == ["slow"]
+        finally:
+            await queue.cleanup()
+
+    asyncio.run(run())
+    asyncio.run(run_siblings())
+    print("✅ Stage failures reported on the pipeline job, sibling stages cancelled")
+
+
+def test_batch_submission():
+    """Test atomic batch submission with aggregated progress and streamed results"""
+    print("\n🔍 Testing batch submission...")
+
+    async def run():
+        queue = JobQueue(agents=fake_agents())
+
+        # An invalid item rejects the whole batch
+        try:
+            await queue.submit_batch([
+                {"agent_type": "document_classifier", "request_data": {"document_content": "Faktura"}},
+                {"agent_type": "unknown_agent", "request_data": {}}
+            ], user_id="user_123")
+            raise AssertionError("Batch with an invalid item should have been rejected")
+        except ValueError:
+            pass
+        assert not queue.backend.jobs and queue.backend.queue.empty()
+
+        await queue.initialize()
+        try:
+            items = [{"agent_type": "document_classifier", "request_data": {"document_content": f"Dokument {i}"}} for i in range(5)]
+            items.append({"agent_type": "process_generator", "request_data": {"title": "Fakturabehandling"}})
+            batch_id = await queue.submit_batch(items, user_id="user_123")
+
+            status = await queue.get_batch_status(batch_id)
+            assert status["total_jobs"] == 6
+
+            records = [record async for record in queue.stream_batch_results(batch_id, wait=True, poll_interval=0.01)]
+            assert len(records) == 6
+            assert all(record["status"] == JobStatus.COMPLETED.value for record in records)
+            assert records[0]["result"]["document_type"] == "INVOICE"
+
+            status = await queue.get_batch_status(batch_id)
+            assert status["status"] == JobStatus.COMPLETED
+            assert status["progress"] == 100
+            assert status["status_counts"]["completed"] == 6
+        finally:
+            await queue.cleanup()
+
+    asyncio.run(run())
+    print("✅ Batch queued atomically and results streamed")
+
+
+def test_duration_estimator():
+    """Test learned duration estimates per agent, analysis type and input size"""
+    print("\n🔍 Testing duration estimator...")
+
+    estimator = DurationEstimator()
+    short_document = {"document_content": "x" * 100}
+    long_document = {"document_content": "x" * 5000}
+
+    # Falls back to the prior without samples
+    assert estimator.estimate("document_classifier", short_document) == DEFAULT_DURATIONS["document_classifier"]
+
+    for _ in range(20):
+        estimator.observe("document_classifier", short_document, 4.0)
+        estimator.observe("document_classifier", long_document, 20.0)
+        estimator.observe("siam_specialist", {"analysis_type": "governance", "vendor_count": 3}, 10.0)
+        estimator.observe("siam_specialist", {"analysis_type": "scenario", "vendor_count": 3}, 30.0)
+
+    assert 3.0 < estimator.estimate("document_classifier", short_document) < 5.0
+    assert 16.0 < estimator.estimate("document_classifier", long_document) < 25.0
+    assert estimator.estimate("siam_specialist", {"analysis_type": "governance", "vendor_count": 3}) < 12.0
+    assert estimator.estimate("siam_specialist", {"analysis_type": "scenario", "vendor_count": 3}) > 25.0
+
+    # Pipelines are estimated along their critical path
+    pipeline = {"stages": [
+        {"name": "a", "agent_type": "document_classifier", "request_data": short_document},
+        {"name": "b", "agent_type": "document_classifier", "request_data": long_document},
+        {"name": "c", "agent_type": "itil_validator", "depends_on": ["a", "b"]}
+    ]}
+    assert 17.0 < estimator.estimate("pipeline", pipeline) < 26.0
+
+    exported = estimator.export_percentiles()
+    assert all({"p50", "p90", "p99", "samples"} <= set(entry) for entry in exported)
+    print(f"✅ Duration estimator learned {len(exported)} histograms")
+
+
+def test_admission_control():
+    """Test that estimates fill estimated_duration and drive admission control"""
+    print("\n🔍 Testing admission control...")
+
+    async def run():
+        queue = JobQueue(agents=fake_agents())
+        queue.max_backlog_seconds = 60
+        first = await queue.submit_job("document_classifier", {"document_content": "Faktura"}, "user_123")
+        second = await queue.submit_job("document_classifier", {"document_content": "Faktura"}, "user_123")
+        assert await queue.get_estimated_duration(first) == 15
+        assert await queue.get_estimated_duration(second) == 30
+
+        try:
+            await queue.submit_job("process_generator", {"title": "Prosess"}, "user_123")
+            raise AssertionError("Job exceeding the backlog limit should have been rejected")
+        except QueueFullError:
+            pass
+        assert len(queue.backend.jobs) == 2
+
+    asyncio.run(run())
+    print("✅ Backlog limit enforced from estimated durations")
+
+
+def test_earliest_deadline_first():
+    """Test EDF ordering, best-effort marking and deadline rejection"""
+    print("\n🔍 Testing deadline-aware scheduling...")
+
+    async def run():
+        generator = FakeGenerator()
+        queue = JobQueue(agents=fake_agents(generator), scheduling_mode="edf")
+        now = datetime.now(timezone.utc)
+
+        overnight = await queue.submit_job("process_generator", {"title": "Overnight"}, "user_123", now + timedelta(hours=12))
+        no_deadline = await queue.submit_job("process_generator", {"title": "Whenever"}, "user_123")
+        meeting = await queue.submit_job("process_generator", {"title": "Meeting"}, "user_123", now + timedelta(minutes=10))
+        hopeless = await queue.submit_job("process_generator", {"title": "Hopeless"}, "user_123", now + timedelta(seconds=5))
+
+        assert queue.backend.jobs[hopeless].best_effort
+        assert not queue.backend.jobs[meeting].best_effort
+
+        await queue.initialize()
+        try:
+            for job_id in (overnight, no_deadline, meeting, hopeless):
+                await wait_for_job(queue, job_id)
+
+            # Feasible deadlines first (earliest first), then jobs without deadline, then best-effort jobs
+            assert [call["title"] for call in generator.calls] == ["Meeting", "Overnight", "Whenever", "Hopeless"]
+
+            stats = await queue.get_deadline_stats()
+            assert stats["agents"]["process_generator"]["submitted"] == 3
+            assert stats["agents"]["process_generator"]["best_effort"] == 1
+            assert stats["agents"]["process_generator"]["met"] == 3
+            assert stats["miss_rate"] == 0.0
+
+            # Under the reject policy an unachievable deadline is refused at submission
+            queue.deadline_policy = DeadlinePolicy.REJECT
+            try:
+                await queue.submit_job("process_generator", {"title": "Too late"}, "user_123", now + timedelta(seconds=1))
+                raise AssertionError("Unachievable deadline should have been rejected")
+            except DeadlineUnachievableError:
+                pass
+            assert (await queue.get_deadline_stats())["agents"]["process_generator"]["rejected"] == 1
+        finally:
+            await queue.cleanup()
+
+    asyncio.run(run())
+    print("✅ Jobs scheduled earliest-deadline-first")
+
+
+def test_shared_backend_between_api_and_worker():
+    """Test an API-only queue and a separate worker sharing an SQLite backend"""
+    print("\n🔍 Testing shared job backend...")
+
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "jobs.db")
+            api = JobQueue(backend=SQLiteJobBackend(path))
+            worker = JobQueue(agents=fake_agents(), backend=SQLiteJobBackend(path), concurrency=2)
+            await api.initialize(run_worker=False)
+            await worker.initialize()
+            try:
+                batch_id = await api.submit_batch(
+                    [{"agent_type": "document_classifier", "request_data": {"document_content": "Faktura"}}] * 3,
+                    user_id="user_123"
+                )
+                records = [record async for record in api.stream_batch_results(batch_id, wait=True, poll_interval=0.05)]
+                assert [record["status"] for record in records] == [JobStatus.COMPLETED.value] * 3
+                assert records[0]["result"]["document_type"] == "INVOICE"
+
+                # Worker histograms are published for the API's admission control
+                estimates = await api.get_duration_percentiles()
+                assert estimates["queued_jobs"] == 0
+                assert any(entry["agent_type"] == "document_classifier" for entry in estimates["histograms"])
+            finally:
+                await worker.cleanup()
+                await api.cleanup()
+
+    asyncio.run(run())
+    print("✅ Jobs submitted by the API were run by a separate worker")
+
+
+def test_lease_expiry_recovers_stuck_jobs():
+    """Test that jobs of a crashed worker are requeued, and failed after too many attempts"""
+    print("\n🔍 Testing job lease expiry...")
+
+    async def run():
+        queue = JobQueue(agents=fake_agents())
+        queue.lease_seconds = 0.2
+        queue.max_attempts = 2
+        document = {"document_content": "Faktura"}
+        recoverable = await queue.submit_job("document_classifier", document, "user_123")
+        exhausted = await queue.submit_job("document_classifier", document, "user_123")
+
+        # A worker that crashes right after picking up both jobs never renews their leases
+        for attempts in (1, 2):
+            job = await queue.backend.dequeue(timeout=1.0, owner="crashed-worker", lease_seconds=0.1)
+            job.status = JobStatus.RUNNING
+            job.attempts = attempts
+
+        await queue.initialize()
+        try:
+            status = await wait_for_job(queue, recoverable)
+            assert status["status"] == JobStatus.COMPLETED
+            assert queue.backend.jobs[recoverable].attempts == 2
+
+            status = await wait_for_job(queue, exhausted)
+            assert status["status"] == JobStatus.FAILED
+            assert "stopped responding" in status["error_message"]
+        finally:
+            await queue.cleanup()
+
+    asyncio.run(run())
+    print("✅ Expired leases requeued or failed")
+
+
+def test_job_timeout():
+    """Test that a hanging agent call fails the job instead of running forever"""
+    print("\n🔍 Testing job timeout...")
+
+    async def run():
+        queue = JobQueue(agents=fake_agents(FakeGenerator(delay=10)))
+        queue.job_timeout_seconds = 0.1
+        await queue.initialize()
+        try:
+            job_id = await queue.submit_job("process_generator", {"title": "Henger"}, "user_123")
+            status = await wait_for_job(queue, job_id)
+            assert status["status"] == JobStatus.FAILED
+            assert "timed out" in status["error_message"]
+        finally:
+            await queue.cleanup()
+
+    asyncio.run(run())
+    print("✅ Hanging job failed after its timeout")
+
+
+def test_graceful_drain():
+    """Test that shutdown lets in-flight jobs finish and requeues pipelines from their checkpoint"""
+    print("\n🔍 Testing graceful drain...")
+
+    async def run():
+        # An in-flight job finishing within the grace period completes; new jobs are refused
+        queue = JobQueue(agents=fake_agents(FakeGenerator(delay=0.2)))
+        await queue.initialize()
+        job_id = await queue.submit_job("process_generator", {"title": "Fakturabehandling"}, "user_123")
+        while queue.backend.jobs[job_id].status != JobStatus.RUNNING:
+            await asyncio.sleep(0.01)
+        await queue.cleanup(grace_seconds=2)
+        assert queue.backend.jobs[job_id].status == JobStatus.COMPLETED
+        try:
+            await queue.submit_job("process_generator", {"title": "For sent"}, "user_123")
+            raise AssertionError("Draining queue should not accept jobs")
+        except QueueClosedError:
+            pass
+
+        # A pipeline interrupted after its first stage is requeued with that stage's output
+        generator = FakeGenerator(delay=0.5)
+        queue = JobQueue(agents=fake_agents(generator))
+        await queue.initialize()
+        job_id = await queue.submit_pipeline([
+            {"name": "draft", "agent_type": "process_generator", "request_data": {"title": "Utkast"}},
+            {"name": "final", "agent_type": "process_generator", "depends_on": ["draft"],
+             "request_data": {"title": "Endelig"}}
+        ], user_id="user_123")
+        while not queue.backend.jobs[job_id].checkpoint:
+            await asyncio.sleep(0.01)
+        await queue.cleanup(grace_seconds=0.05)
+        job = queue.backend.jobs[job_id]
+        assert job.status == JobStatus.QUEUED and list(job.checkpoint) == ["draft"]
+
+        restarted = JobQueue(agents=fake_agents(generator), backend=queue.backend)
+        await restarted.initialize()
+        try:
+            status = await wait_for_job(restarted, job_id)
+            assert status["status"] == JobStatus.COMPLETED
+            assert status["stages"]["draft"]["message"] == "Stage restored from checkpoint"
+            # The draft stage ran once; the final stage was interrupted once and then rerun
+            assert [call["title"] for call in generator.calls] == ["Utkast", "Endelig", "Endelig"]
+        finally:
+            await restarted.cleanup()
+
+    asyncio.run(run())
+    print("✅ In-flight jobs drained and checkpointed")
+
+
+def test_structured_logging():
+    """Test JSON log records with job context and sampled progress events"""
+    print("\n🔍 Testing structured logging...")
+
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    handler.addFilter(ContextFilter())
+    logger = logging.getLogger("test_structured_logging")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    with log_context(job_id="job_123", agent_type="document_classifier", user_id="user_123"):
+        logger.info("Job completed", extra={"run_seconds": 1.5})
+    logger.info("Outside job")
+
+    entry = json.loads(JsonFormatter().format(records[0]))
+    assert entry["message"] == "Job completed" and entry["level"] == "INFO"
+    assert entry["job_id"] == "job_123" and entry["user_id"] == "user_123" and entry["run_seconds"] == 1.5
+    assert "job_id" not in json.loads(JsonFormatter().format(records[1]))
+
+    sampler = ProgressSampler(interval_seconds=60)
+    logged = [sampler.should_log("job_123", progress) for progress in (10, 30, 50, 90, 100)]
+    assert logged == [True, False, False, False, True]
+    print("✅ Structured log records carry job context")
+
+
+def test_metrics():
+    """Test Prometheus exposition of job queue and LLM call metrics"""
+    print("\n🔍 Testing metrics...")
+
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_seconds", "Test latency", ["agent_type"], buckets=(1, 5))
+    for value in (0.5, 3, 10):
+        histogram.labels("document_classifier").observe(value)
+    rendered = registry.render()
+    assert 'test_seconds_bucket{agent_type="document_classifier",le="1"} 1' in rendered
+    assert 'test_seconds_bucket{agent_type="document_classifier",le="+Inf"} 3' in rendered
+    assert 'test_seconds_count{agent_type="document_classifier"} 3' in rendered
+
+    class FakeCompletions:
+        async def create(self, **request):
+            return SimpleNamespace(usage=SimpleNamespace(prompt_tokens=800, completion_tokens=300))
+
+    async def run():
+        client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+        await create_chat_completion(client, "test_agent", model="gpt-4", messages=[])
+
+        queue = JobQueue(agents=fake_agents())
+        await queue.initialize()
+        try:
+            job_id = await queue.submit_job("document_classifier", {"document_content": "Faktura"}, "user_123")
+            await wait_for_job(queue, job_id)
+            await queue.collect_metrics()
+        finally:
+            await queue.cleanup()
+
+    asyncio.run(run())
+    rendered = REGISTRY.render()
+    assert 'prosessportal_llm_request_seconds_count{agent_type="test_agent",model="gpt-4"} 1' in rendered
+    assert 'prosessportal_llm_prompt_tokens_sum{agent_type="test_agent"} 800' in rendered
+    assert 'prosessportal_job_duration_seconds_count{agent_type="document_classifier",status="completed"}' in rendered
+    assert "prosessportal_job_table_size 1" in rendered
+    print("✅ Metrics recorded and rendered")
+
+
+def test_job_tracing():
+    """Test that job spans continue the submitting request's trace and build a timeline"""
+    print("\n🔍 Testing job tracing...")
+
+    async def run():
+        queue = JobQueue(agents=fake_agents())
+        await queue.initialize()
+        try:
+            with start_span("http.request", parent="00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"):
+                job_id = await queue.submit_pipeline([
+                    {"name": "classify", "agent_type": "document_classifier", "request_data": {"document_content": "Faktura"}},
+                    {"name": "validate", "agent_type": "itil_validator", "depends_on": ["classify"], "inputs": {"process": "classify"}}
+                ], user_id="user_123")
+            await wait_for_job(queue, job_id)
+            return await queue.get_job_timeline(job_id)
+        finally:
+            await queue.cleanup()
+
+    timeline = asyncio.run(run())
+    assert timeline["trace_id"] == "4bf92f3577b34da6a3ce929d0e0e4736", timeline
+    spans = {span["name"]: span for span in timeline["spans"]}
+    assert {"job.queued", "job.run", "pipeline.stage"} <= set(spans), list(spans)
+    stages = [span for span in timeline["spans"] if span["name"] == "pipeline.stage"]
+    assert [span["attributes"]["stage"] for span in stages] == ["classify", "validate"]
+    assert all(span["parent_id"] == spans["job.run"]["span_id"] for span in stages)
+    assert all(span["offset_ms"] >= 0 and span["duration_ms"] >= 0 for span in timeline["spans"])
+    assert parse_traceparent("00-not-a-trace-01") is None
+    print("✅ Job spans recorded on the request's trace")
+
+
+def test_profiling():
+    """Test profiling the next jobs of an agent type and tracemalloc snapshots"""
+    print("\n🔍 Testing profiling hooks...")
+
+    async def run():
+        queue = JobQueue(agents=fake_agents(FakeGenerator(delay=0.05)))
+        await queue.initialize()
+        try:
+            session = asyncio.create_task(PROFILER.profile_jobs("process_generator", count=2, mode="cprofile"))
+            await asyncio.sleep(0)
+            for index in range(2):
+                await queue.submit_job("process_generator", {"title": f"Prosess {index}"}, "user_123")
+            job_profile = await asyncio.wait_for(session, timeout=5)
+            sampled = await PROFILER.profile_for(0.05, mode="sampling")
+            return job_profile, sampled
+        finally:
+            await queue.cleanup()
+
+    job_profile, sampled = asyncio.run(run())
+    stats = marshal.loads(job_profile.content)
+    assert any(function == "generate_process" for _, _, function in stats), list(stats)[:5]
+    folded = sampled.content.decode("utf-8").splitlines()
+    assert folded and all(line.rsplit(" ", 1)[1].isdigit() for line in folded)
+
+    profiler = ProfilerManager()
+    profiler.start_tracemalloc()
+    try:
+        retained = [bytearray(1024) for _ in range(200)]
+        snapshot = profiler.tracemalloc_snapshot(limit=5, path_filter="test_job_queue")
+        assert snapshot["top"] and snapshot["top"][0]["size_bytes"] >= 200 * 1024
+        assert "growth" in profiler.tracemalloc_snapshot(limit=5)
+    finally:
+        profiler.stop_tracemalloc()
+    print(f"✅ Profiled {len(folded)} distinct stacks; tracemalloc found {len(retained)} retained buffers")
+
+
+def test_loop_lag_monitor():
+    """Test that blocking calls on the event loop are detected with their stack"""
+    print("\n🔍 Testing event loop lag monitor...")
+
+    def blocking_call():
+        time.sleep(0.3)
+
+    async def run():
+        monitor = LoopLagMonitor(interval=0.02, threshold=0.1)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.1)
+            assert not monitor.stalls, monitor.stalls
+            blocking_call()
+            await asyncio.sleep(0.1)
+            # The same work in a thread keeps the loop responsive
+            await asyncio.to_thread(blocking_call)
+            await asyncio.sleep(0.05)
+        finally:
+            await monitor.stop()
+        return monitor.status()
+
+    status = asyncio.run(run())
+    assert len(status["stalls"]) == 1, status["stalls"]
+    assert status["stalls"][0]["lag_seconds"] >= 0.2
+    assert any("blocking_call" in line for line in status["stalls"][0]["stack"]), status["stalls"][0]["stack"]
+    print(f"✅ Blocking call detected ({status['stalls'][0]['lag_seconds']}s lag)")
+
+
+def test_usage_accounting():
+    """Test token and cost accounting per job, user and agent"""
+    print("\n🔍 Testing usage accounting...")
+
+    class FakeCompletions:
+        async def create(self, **request):
+            return SimpleNamespace(usage=SimpleNamespace(
+                prompt_tokens=1000, completion_tokens=200,
+                prompt_tokens_details=SimpleNamespace(cached_tokens=400)
+            ))
+
+    class LLMClassifier:
+        client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+
+        async def classify_document(self, request_data, progress_callback):
+            await create_chat_completion(self.client, "document_classifier", model="gpt-4o-2024-08-06", messages=[])
+            await create_chat_completion(self.client, "document_classifier", model="gpt-4o-2024-08-06", messages=[])
+            return {"document_type": "INVOICE"}
+
+    async def run():
+        queue = JobQueue(agents={"document_classifier": LLMClassifier()})
+        await queue.initialize()
+        try:
+            job_ids = [
+                await queue.submit_job("document_classifier", {"document_content": "Faktura"}, user_id)
+                for user_id in ("user_a", "user_b", "user_a")
+            ]
+            for job_id in job_ids:
+                await wait_for_job(queue, job_id)
+            status = await queue.get_job_status(job_ids[0])
+            await queue.usage.flush()
+            assert not queue.usage.pending
+            return status, await queue.get_top_consumers("user", "total_tokens")
+        finally:
+            await queue.cleanup()
+
+    status, top = asyncio.run(run())
+    usage = status["usage"]
+    assert usage["calls"] == 2 and usage["prompt_tokens"] == 2000 and usage["cached_tokens"] == 800
+    # 600 uncached at $2.50/M, 400 cached at $1.25/M, 200 completion at $10/M, twice
+    assert usage["cost_microusd"] == 2 * (600 * 2.5 + 400 * 1.25 + 200 * 10)
+    assert usage["models"] == ["gpt-4o-2024-08-06"]
+    assert [entry["user_id"] for entry in top] == ["user_a", "user_b"]
+    assert top[0]["total_tokens"] == 4800 and top[0]["calls"] == 4
+
+    class FlakyBackend:
+        """Counter backend that fails once after two writes"""
+
+        def __init__(self):
+            self.counters = {}
+            self.writes = 0
+
+        async def increment_counter(self, name, field, value):
+            self.writes += 1
+            if self.writes == 3:
+                raise ConnectionError("backend unavailable")
+            self.counters[field] = self.counters.get(field, 0) + value
+
+        async def get_counters(self, name):
+            return dict(self.counters)
+
+    async def flush_with_failure():
+        from services.usage import UsageAccountant
+        accountant = UsageAccountant(FlakyBackend())
+        accountant.record("user_a", "document_classifier", {"calls": 1, "prompt_tokens": 10, "completion_tokens": 5})
+        try:
+            await accountant.flush()
+            raise AssertionError("flush should fail")
+        except ConnectionError:
+            pass
+        await accountant.flush()
+        return await accountant.totals()
+
+    class SlowBackend(FlakyBackend):
+        async def increment_counter(self, name, field, value):
+            await asyncio.sleep(0)
+            self.counters[field] = self.counters.get(field, 0) + value
+
+    async def record_from_threads_while_flushing():
+        from services.usage import UsageAccountant, usage_scope, record_usage
+        accountant = UsageAccountant(SlowBackend())
+        job_usage = {}
+
+        def synchronous_agent():
+            for _ in range(2000):
+                record_usage("siam_specialist", "gpt-4", {"calls": 1, "prompt_tokens": 10})
+
+        async def keep_flushing(done):
+            while not done.is_set():
+                await accountant.flush()
+                await accountant.totals()
+                await asyncio.sleep(0)
+
+        with usage_scope(accountant, "user_a", job_usage):
+            done = asyncio.Event()
+            flusher = asyncio.create_task(keep_flushing(done))
+            await asyncio.gather(*(asyncio.to_thread(synchronous_agent) for _ in range(8)))
+            done.set()
+            await flusher
+        await accountant.flush()
+        return job_usage, await accountant.totals()
+
+    # Switch threads as often as possible, so unsynchronized updates would interleave with the flushes
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        job_usage, thread_totals = asyncio.run(record_from_threads_while_flushing())
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert job_usage["calls"] == 16000 and job_usage["models"] == ["gpt-4"]
+    assert thread_totals[("user_a", "siam_specialist")]["calls"] == 16000
+    assert thread_totals[("user_a", "siam_specialist")]["prompt_tokens"] == 160000
+
+    totals = asyncio.run(flush_with_failure())[("user_a", "document_classifier")]
+    # Counters written before the failure are not added again by the retry
+    assert totals["calls"] == 1 and totals["prompt_tokens"] == 10 and totals["completion_tokens"] == 5
+    print(f"✅ Usage recorded (top consumer {top[0]['user_id']}: ${top[0]['cost_usd']})")
+
+
+def test_knowledge_base_snapshot():
+    """Test compiling, memory-mapping and refreshing the knowledge base snapshot"""
+    print("\n🔍 Testing knowledge base snapshot...")
+
+    from pathlib import Path
+    from agents.itil_knowledge_agent import ITILKnowledgeAgent
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(tmp) / "data"
+        (data_dir / "itil" / "service-operation").mkdir(parents=True)
+        (data_dir / "siam").mkdir()
+        (data_dir / "itil" / "service-operation" / "incident-management.json").write_text(
+            json.dumps({"practice": "Hendelseshåndtering"}), encoding="utf-8"
+        )
+        (data_dir / "siam" / "siam-framework.json").write_text(json.dumps({"layers": 3}), encoding="utf-8")
+
+        path = compile_snapshot(data_dir, Path(tmp) / "kb.snapshot")
+        snapshot = KnowledgeBaseSnapshot.open(path)
+        assert snapshot.files() == ["itil/service-operation/incident-management.json", "siam/siam-framework.json"]
+        assert snapshot.get("itil/service-operation/incident-management.json") == {"practice": "Hendelseshåndtering"}
+        assert snapshot.get("siam/siam-framework.json") is snapshot.get("siam/siam-framework.json")
+        assert snapshot.get("itil/missing.json") is None and not snapshot.is_stale(data_dir)
+
+        (data_dir / "siam" / "siam-framework.json").write_text(json.dumps({"layers": 4}), encoding="utf-8")
+        assert snapshot.is_stale(data_dir)
+        refreshed = load_snapshot(path, data_dir)
+        assert refreshed.get("siam/siam-framework.json") == {"layers": 4}
+        assert refreshed.version != snapshot.version
+
+    # Agents share the decoded knowledge of the process-wide snapshot
+    first, second = ITILKnowledgeAgent(), ITILKnowledgeAgent()
+    assert first.get_service_value_system() is second.get_service_value_system()
+    assert first.get_incident_management_knowledge()
+    print(f"✅ Snapshot compiled and shared (version {refreshed.version})")
+
+
+def test_bm25_retrieval():
+    """Test BM25 ranking with Norwegian and English queries over the ITIL passages"""
+    print("\n🔍 Testing BM25 retrieval...")
+
+    assert tokenize("Processes and the process") == ["process", "process"]
+    assert tokenize("hendelser og hendelsen") == ["hendels", "hendels"]
+    assert {"incident", "management"} <= set(expand_query("Hendelseshåndtering"))
+
+    index = BM25Index()
+    index.add("Incident logging and categorization", {"title": "logging", "source": "incident-management"})
+    index.add("Change authorization by the change advisory board", {"title": "authorization", "source": "change-management"})
+    index.add("Escalation of incidents to suppliers", {"title": "escalation", "source": "incident-management"})
+    assert [hit["title"] for hit in index.search(expand_query("Eskalering av hendelser til leverandør"), k=2)] == [
+        "escalation", "logging"
+    ]
+    assert index.search(expand_query("godkjenning av endringer"), k=1)[0]["title"] == "authorization"
+    assert index.search(["unknown"]) == []
+
+    from agents.itil_knowledge_agent import ITILKnowledgeAgent
+    agent = ITILKnowledgeAgent()
+    context = agent.generate_itil_process_context(
+        "incident-management", "service-operation", query="Måling av løsningstid for hendelser", top_k=4
+    )
+    passages = context["relevant_passages"]
+    assert 0 < len(passages) <= 4 and any(passage["kind"] == "metric" for passage in passages)
+    assert "relevant_passages" not in agent.generate_itil_process_context("incident-management", "service-operation")
+    print(f"✅ Retrieved {[passage['title'] for passage in passages]}")
+
+
+def test_knowledge_base_hot_reload():
+    """Test that a reload swaps the snapshot while running jobs keep the version they started with"""
+    print("\n🔍 Testing knowledge base hot reload...")
+
+    from pathlib import Path
+
+    class KnowledgeReader:
+        def __init__(self):
+            self.started = asyncio.Event()
+            self.release = asyncio.Event()
+
+        async def classify_document(self, request_data, progress_callback):
+            self.started.set()
+            await self.release.wait()
+            return knowledge_base.get_knowledge_base().get("siam/siam-framework.json")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(tmp) / "data"
+        (data_dir / "itil").mkdir(parents=True)
+        (data_dir / "siam").mkdir()
+        framework = data_dir / "siam" / "siam-framework.json"
+        framework.write_text(json.dumps({"layers": 3}), encoding="utf-8")
+        path = Path(tmp) / "kb.snapshot"
+        reader = KnowledgeReader()
+
+        async def run():
+            queue = JobQueue(agents={"document_classifier": reader})
+            await queue.initialize()
+            try:
+                job_id = await queue.submit_job("document_classifier", {"document_content": "Faktura"}, "user")
+                await reader.started.wait()
+                assert reload_knowledge_base(path=path, data_dir=data_dir) is None
+
+                # A touch without a content change keeps the current mapping and is not rebuilt twice
+                os.utime(framework, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+                assert reload_knowledge_base(path=path, data_dir=data_dir) is None
+                compiled_at = path.stat().st_mtime_ns
+                assert reload_knowledge_base(path=path, data_dir=data_dir) is None
+                assert path.stat().st_mtime_ns == compiled_at and knowledge_base._snapshot is original
+
+                framework.write_text(json.dumps({"layers": 4}), encoding="utf-8")
+                reloaded = await asyncio.to_thread(reload_knowledge_base, path=path, data_dir=data_dir)
+                assert reloaded is knowledge_base.get_knowledge_base()
+                assert reloaded.version in retrieval.get_itil_index.versions()
+                reader.release.set()
+                status = await wait_for_job(queue, job_id)
+                return status, await queue.get_job_result(job_id), reloaded
+            finally:
+                await queue.cleanup()
+
+        previous = knowledge_base._snapshot
+        knowledge_base._snapshot = original = load_snapshot(path, data_dir)
+        try:
+            status, result, reloaded = asyncio.run(run())
+        finally:
+            knowledge_base._snapshot = previous
+
+    assert result == {"layers": 3}
+    assert status["knowledge_base_version"] == original.version != reloaded.version
+    assert reloaded.get("siam/siam-framework.json") == {"layers": 4}
+    print(f"✅ Job kept version {original.version} across reload to {reloaded.version}")
+
+
+def test_practice_index():
+    """Test practice lookup by name, alias, area and misspelling without decoding practice bodies"""
+    print("\n🔍 Testing practice index...")
+
+    from pathlib import Path
+    from agents.itil_knowledge_agent import ITILKnowledgeAgent
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(tmp) / "data"
+        practices = {
+            "service-operation/incident-management.json": {"practice": "Incident Management", "aliases": ["Hendelseshåndtering"]},
+            "service-transition/change-management.json": {"practice": "Change Enablement (Change Management)"},
+            "service-design/incident-management.json": {"practice": "Incident Management", "itil_area": "Service Design"},
+        }
+        # Hundreds of practices, as the knowledge base grows
+        for number in range(300):
+            practices[f"service-strategy/practice-{number}.json"] = {"practice": f"Practice {number}"}
+        for name, content in practices.items():
+            (data_dir / "itil" / name).parent.mkdir(parents=True, exist_ok=True)
+            (data_dir / "itil" / name).write_text(json.dumps(content), encoding="utf-8")
+
+        snapshot = KnowledgeBaseSnapshot.open(compile_snapshot(data_dir, Path(tmp) / "kb.snapshot"))
+        started = time.perf_counter()
+        index = PracticeIndex(snapshot)
+        assert index.find("incident-management", "service-operation").area == "service-operation"
+        assert index.find("Incident Management", "Service Design").area == "service-design"
+        assert index.find("hendelseshåndtering").name == "Incident Management"
+        assert index.find("Change Management").path == "itil/service-transition/change-management.json"
+        assert index.find("change enablment", "service-operation").area == "service-transition"
+        assert index.find("Practice 42").name == "Practice 42"
+        assert index.find("problem-management") is None
+        assert index.areas == ["service-design", "service-operation", "service-strategy", "service-transition"]
+        assert time.perf_counter() - started < 1.0
+        # Only metadata from the snapshot header was needed so far
+        assert not snapshot._decoded
+        assert index.find("Change Enablement").knowledge == practices["service-transition/change-management.json"]
+
+    agent = ITILKnowledgeAgent()
+    assert agent.get_practice_knowledge("Hendelseshåndtering", "service-operation") == agent.get_incident_management_knowledge()
+    assert agent.get_change_management_knowledge()["practice"] == "Change Enablement (Change Management)"
+    assert "service-operation" in agent.itil_areas
+    print(f"✅ {len(index.entries)} practices indexed")
+
+
+def test_prompt_fragment_cache():
+    """Test that knowledge-derived prompt fragments are rendered once per knowledge-base version"""
+    print("\n🔍 Testing prompt fragment cache...")
+
+    from pathlib import Path
+    from agents.siam_specialist import SIAMSpecialistAgent
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(tmp) / "data"
+        (data_dir / "itil").mkdir(parents=True)
+        (data_dir / "siam").mkdir()
+        (data_dir / "siam" / "siam-framework.json").write_text(
+            json.dumps({"core_components": {"integration_mechanisms": {"tooling": "ServiceNow"}}}), encoding="utf-8"
+        )
+        first = KnowledgeBaseSnapshot.open(compile_snapshot(data_dir, Path(tmp) / "first.snapshot"))
+        (data_dir / "siam" / "siam-framework.json").write_text(
+            json.dumps({"core_components": {"integration_mechanisms": {"tooling": "Jira"}}}), encoding="utf-8"
+        )
+        second = KnowledgeBaseSnapshot.open(compile_snapshot(data_dir, Path(tmp) / "second.snapshot"))
+
+        renders = []
+        assert first.fragment("key", lambda: renders.append(1) or "text") == "text"
+        assert first.fragment("key", lambda: renders.append(1) or "other") == "text"
+        assert len(renders) == 1
+
+        agent = SIAMSpecialistAgent(client=SimpleNamespace())
+        with knowledge_base.pin_knowledge_base(first):
+            prompt = agent._create_integration_prompt({"vendors": 3})
+            assert '"tooling": "ServiceNow"' in prompt
+            assert agent._knowledge_json("siam-framework.json", "core_components") is \
+                agent._knowledge_json("siam-framework.json", "core_components")
+        with knowledge_base.pin_knowledge_base(second):
+            assert '"tooling": "Jira"' in agent._create_integration_prompt({"vendors": 3})
+    print("✅ Fragments rendered once per version")
+
+
+def test_practice_classifier():
+    """Test one-pass multi-pattern scoring of ITIL practices in Norwegian and English"""
+    print("\n🔍 Testing practice classifier...")
+
+    matcher = AhoCorasick()
+    for pattern in ("he", "she", "his", "hers"):
+        matcher.add(pattern, pattern)
+    assert sorted(matcher.iter_matches("ushers")) == ["he", "hers", "she"]
+
+    from agents.itil_knowledge_agent import ITILKnowledgeAgent
+    agent = ITILKnowledgeAgent()
+
+    # "update" no longer wins over "incident" just because it is checked first
+    candidates = agent.classify_practice("Update incident handling")
+    assert [candidate["practice"] for candidate in candidates] == ["incident-management", "change-management"]
+    assert candidates[0]["confidence"] > candidates[1]["confidence"]
+    assert agent.classify_practice("Hendelseshåndtering for kundeservice")[0]["practice"] == "incident-management"
+    assert agent.classify_practice("Analyse", "Rotårsak til gjentakende feil")[0]["practice"] == "problem-management"
+    assert agent.classify_practice("Endringsforespørsel med CAB-godkjenning")[0]["practice"] == "change-management"
+    # Unknown input gives no candidate instead of defaulting to incident management
+    assert agent.classify_practice("Onboarding av nye ansatte", "Opplæring") == []
+    print(f"✅ Classified ({candidates[0]['practice']} at {candidates[0]['confidence']})")
+
+
+def test_compliance_rules():
+    """Test the compiled compliance rules for single processes and portfolio batches"""
+    print("\n🔍 Testing compliance rule engine...")
+
+    from agents.itil_knowledge_agent import ITILKnowledgeAgent
+    agent = ITILKnowledgeAgent()
+
+    complete = {
+        "id": "complete",
+        "title": "Hendelseshåndtering",
+        "description": "Gir verdi: value for brukerne, i tråd med GDPR",
+        "steps": [
+            {"description": f"Steg {n} med måling av løsningstid", "responsible_role": ["Service Desk", "Drift"][n % 2]}
+            for n in range(5)
+        ]
+    }
+    sparse = {"title": "Ny prosess", "description": "Kort", "steps": [{"description": "Gjør jobben"}]}
+
+    result = agent.validate_process_against_itil(complete)
+    scores = {check["rule_id"]: check["score"] for check in result["compliance_checks"]}
+    assert scores == {"guiding_principles": 1.0, "value_chain": 0.8, "role_clarity": 1.0, "metrics": 0.8,
+                      "norwegian_context": 0.9}
+    assert result["recommendations"] == []
+    sparse_result = agent.validate_process_against_itil(sparse)
+    assert "Ensure clear role assignments for all process steps" in sparse_result["recommendations"]
+    assert sparse_result["compliance_score"] < result["compliance_score"]
+
+    started = time.perf_counter()
+    portfolio = agent.validate_processes([complete, sparse] * 2000)
+    elapsed = time.perf_counter() - started
+    assert portfolio["count"] == 4000 and portfolio["below_threshold"] == 2000
+    assert portfolio["lowest_scoring"][0]["process_id"] == 1
+    assert portfolio["rule_averages"]["role_clarity"] == 0.8
+    assert elapsed < 2.0, f"{elapsed:.2f}s for 4000 processes"
+
+    try:
+        ComplianceRuleSet({"rules": [{"id": "broken", "conditions": [{"type": "regex"}]}]})
+        raise AssertionError("Unknown condition type accepted")
+    except ValueError as e:
+        assert "broken" in str(e)
+    print(f"✅ {portfolio['count']} processes validated in {elapsed * 1000:.0f} ms")
+
+
+def test_template_first_generation():
+    """Test that template mode refines a local ITIL skeleton with a smaller completion budget"""
+    print("\n🔍 Testing template-first generation...")
+
+    from agents.process_generator import ProcessGeneratorAgent
+
+    class FakeCompletions:
+        def __init__(self):
+            self.requests = []
+
+        async def create(self, **request):
+            self.requests.append(request)
+            if request["max_tokens"] < 3000:
+                content = json.dumps({
+                    "title": "Hendelseshåndtering for kundeservice",
+                    "steps": [{"order_index": 1, "title": "Registrer hendelsen", "detailed_instructions": "Bruk skjemaet"}],
+                    "additional_steps": [{"after": 1, "title": "Varsle kunden", "responsible_role": "Kundeservice"}]
+                })
+            else:
+                content = json.dumps({"title": "Full", "steps": [{"title": "Steg", "responsible_role": "Drift"}]})
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                usage=SimpleNamespace(prompt_tokens=900, completion_tokens=300, prompt_tokens_details=None)
+            )
+
+    async def noop_progress(progress, message):
+        pass
+
+    completions = FakeCompletions()
+    generator = ProcessGeneratorAgent(client=SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    request = {
+        "title": "Hendelseshåndtering", "description": "Registrering og løsning av hendelser",
+        "category": "IT", "itil_area": "Service Operation", "requirements": ["Kunden skal varsles"]
+    }
+    skeleton = generator.itil_agent.get_process_template_suggestions("incident-management", "service-operation")
+
+    result = asyncio.run(generator.generate_itil_process(dict(request, generation_mode="template"), noop_progress))
+    generation = result["metadata"]["generation"]
+    assert generation["mode"] == "template" and generation["template_steps"] == len(skeleton) > 0
+    assert completions.requests[-1]["max_tokens"] == 1200
+    assert len(result["steps"]) == len(skeleton) + 1
+    assert result["steps"][0]["title"] == "Registrer hendelsen" and result["steps"][0]["detailed_instructions"] == "Bruk skjemaet"
+    assert result["steps"][0]["responsible_role"] == skeleton[0]["responsible_role"]
+    assert result["steps"][1]["title"] == "Varsle kunden" and result["steps"][1]["order_index"] == 2
+    assert result["title"] == "Hendelseshåndtering for kundeservice"
+    assert result["estimated_duration"] == sum(step["estimated_duration"] for step in result["steps"])
+
+    full = asyncio.run(generator.generate_itil_process(request, noop_progress))
+    assert full["metadata"]["generation"]["mode"] == "full" and completions.requests[-1]["max_tokens"] == 3000
+    assert len(completions.requests[0]["messages"][1]["content"]) < len(completions.requests[1]["messages"][1]["content"])
+    print(f"✅ Template mode: {len(result['steps'])} steps, max_tokens {generation['max_tokens']}")
+
+
+def test_itil_generation_without_requirements():
+    """Test that ITIL generation accepts a request whose optional fields were left out"""
+    print("\n🔍 Testing ITIL generation without requirements...")
+
+    from agents.process_generator import ProcessGeneratorAgent
+    from models.requests import ProcessGenerationRequest
+
+    class FakeCompletions:
+        async def create(self, **request):
+            content = json.dumps({"title": "Endringshåndtering", "steps": [{"title": "Vurder endringen", "responsible_role": "CAB"}]})
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                usage=SimpleNamespace(prompt_tokens=900, completion_tokens=300, prompt_tokens_details=None)
+            )
+
+    async def noop_progress(progress, message):
+        pass
+
+    generator = ProcessGeneratorAgent(client=SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions())))
+    request = ProcessGenerationRequest(
+        title="Endringshåndtering", description="Godkjenning av endringer i produksjon",
+        category="IT", itil_area="Service Transition", user_id="user-1"
+    ).model_dump(exclude={"deadline"})
+    assert request["requirements"] is None
+
+    for mode in ("full", "template"):
+        result = asyncio.run(generator.generate_itil_process(dict(request, generation_mode=mode), noop_progress))
+        assert result["steps"] and result["metadata"]["generation"]["mode"] == mode
+    print("✅ Requests without requirements are generated in full and template mode")
+
+
+def test_outline_then_expand_generation():
+    """Test that outline mode expands steps concurrently under the rate limiter and merges them in order"""
+    print("\n🔍 Testing outline-then-expand generation...")
+
+    from agents.process_generator import ProcessGeneratorAgent
+    from services.rate_limiter import RateLimiter
+    import services.llm as llm
+
+    class FakeCompletions:
+        def __init__(self):
+            self.requests = []
+            self.max_in_flight = 0
+
+        async def create(self, **request):
+            self.requests.append(request)
+            self.max_in_flight = max(self.max_in_flight, limiter.in_flight)
+            prompt = request["messages"][1]["content"]
+            if "Elaborate step" in prompt:
+                number = int(prompt.split("Elaborate step ")[1].split(",")[0])
+                # Later steps finish first, so the merge has to restore outline order
+                await asyncio.sleep(0.2 - 0.03 * number)
+                content = "Not JSON" if number == 3 else json.dumps({
+                    "description": f"Detaljert steg {number}", "detailed_instructions": f"Gjør steg {number}"
+                })
+            else:
+                await asyncio.sleep(0.05)
+                content = json.dumps({
+                    "title": "Innkjøp", "description": "Innkjøp av utstyr", "tags": ["innkjøp"],
+                    "steps": [
+                        {"title": f"Steg {number}", "summary": f"Kort {number}", "responsible_role": "Innkjøp", "estimated_duration": 10}
+                        for number in range(1, 5)
+                    ]
+                })
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                usage=SimpleNamespace(prompt_tokens=100, completion_tokens=50, prompt_tokens_details=None)
+            )
+
+    async def record_progress(progress, message):
+        updates.append(progress)
+
+    limiter = RateLimiter(max_concurrency=2, requests_per_minute=0)
+    original_limiter = llm.LLM_RATE_LIMITER
+    llm.LLM_RATE_LIMITER = limiter
+    try:
+        completions = FakeCompletions()
+        generator = ProcessGeneratorAgent(client=SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        request = {"title": "Innkjøp", "description": "Innkjøp av utstyr", "category": "Økonomi", "generation_mode": "outline"}
+
+        updates = []
+        started = time.perf_counter()
+        result = asyncio.run(generator.generate_process(request, record_progress))
+        elapsed = time.perf_counter() - started
+
+        # Two at a time: steps 3 and 4 start as steps 2 and 1 finish, about 0.25s against a 0.5s sum
+        assert completions.max_in_flight == 2 and limiter.in_flight == 0
+        assert elapsed < 0.05 + 0.17 + 0.11 + 0.1, elapsed
+        assert [step["title"] for step in result["steps"]] == ["Steg 1", "Steg 2", "Steg 3", "Steg 4"]
+        assert [step["order_index"] for step in result["steps"]] == [1, 2, 3, 4]
+        assert result["steps"][0]["description"] == "Detaljert steg 1"
+        assert result["steps"][2]["description"] == "Kort 3" and result["steps"][2]["detailed_instructions"] == "Complete the task: Steg 3"
+        assert result["estimated_duration"] == 40 and updates == sorted(updates) and updates[-1] == 100
+
+        generation = result["metadata"]["generation"]
+        assert generation["mode"] == "outline" and generation["calls"] == 5 and generation["failed_steps"] == 1
+        assert generation["prompt_tokens"] == 500 and generation["completion_tokens"] == 250
+        assert "Steg 4" in completions.requests[1]["messages"][1]["content"]
+    finally:
+        llm.LLM_RATE_LIMITER = original_limiter
+    print(f"✅ Outline mode: {generation['calls']} calls in {elapsed * 1000:.0f} ms, at most {completions.max_in_flight} in flight")
+
+
+def test_governance_guidance_cache():
+    """Test that precomputed governance guidance is served from the cache file and misses go live"""
+    print("\n🔍 Testing governance guidance cache...")
+
+    from pathlib import Path
+    from agents.siam_specialist import SIAMSpecialistAgent
+    import services.guidance_cache as guidance_cache
+
+    class FakeSyncCompletions:
+        def __init__(self):
+            self.requests = []
+
+        def create(self, **request):
+            self.requests.append(request)
+            prompt = request["messages"][1]["content"]
+            vendors = prompt.split("Number of vendors: ")[1].split()[0]
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=f"Styringsmodell for {vendors} leverandører"))],
+                usage=SimpleNamespace(prompt_tokens=2000, completion_tokens=800, prompt_tokens_details=None)
+            )
+
+    original_dir = os.environ.get("GUIDANCE_CACHE_DIR")
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["GUIDANCE_CACHE_DIR"] = tmp
+        try:
+            completions = FakeSyncCompletions()
+            agent = SIAMSpecialistAgent(client=SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+            outcomes = agent.precompute_governance_guidance(vendor_counts=[2, 3], threads=4)
+            assert outcomes == {"generated": 18, "cached": 0, "failed": 0} and len(completions.requests) == 18
+            cache_file = Path(tmp) / f"governance-{agent.knowledge_base.version}.json"
+            assert len(json.loads(cache_file.read_text(encoding="utf-8"))["entries"]) == 18
+
+            # A fresh process only has the file
+            guidance_cache.get_guidance_cache.cache_clear()
+            started = time.perf_counter()
+            result = agent.provide_governance_guidance(3, "High", " medium")
+            elapsed = time.perf_counter() - started
+            assert result["guidance_source"] == "cache" and result["governance_guidance"] == "Styringsmodell for 3 leverandører"
+            assert result["recommended_model"] == "Centralized" and len(completions.requests) == 18
+            assert elapsed < 0.05, elapsed
+
+            # Outside the precomputed space: one live call, then remembered
+            assert agent.provide_governance_guidance(7, "low", "low")["guidance_source"] == "live"
+            assert agent.provide_governance_guidance(7, "low", "low")["guidance_source"] == "cache"
+            assert len(completions.requests) == 19
+
+            # Off the precomputed grid: answered live every time and never retained
+            cache = guidance_cache.get_guidance_cache(agent.knowledge_base)
+            retained = len(cache)
+            for _ in range(2):
+                assert agent.provide_governance_guidance(3, "very high", "medium")["guidance_source"] == "live"
+                assert agent.provide_governance_guidance(500, "low", "low")["guidance_source"] == "live"
+            assert len(cache) == retained and len(completions.requests) == 23
+
+            # A changed prompt does not match the stored answers
+            original_prompt = agent._create_governance_prompt
+            agent._create_governance_prompt = lambda *args: original_prompt(*args) + "\nSvar på norsk."
+            assert agent.provide_governance_guidance(3, "high", "medium")["guidance_source"] == "live"
+            agent._create_governance_prompt = original_prompt
+
+            guidance_cache.get_guidance_cache.cache_clear()
+            assert agent.precompute_governance_guidance(vendor_counts=[2, 3]) == {"generated": 0, "cached": 18, "failed": 0}
+            assert len(completions.requests) == 24
+        finally:
+            guidance_cache.get_guidance_cache.cache_clear()
+            if original_dir is None:
+                os.environ.pop("GUIDANCE_CACHE_DIR", None)
+            else:
+                os.environ["GUIDANCE_CACHE_DIR"] = original_dir
+    print(f"✅ Governance guidance: 18 precomputed, cached answer in {elapsed * 1000:.1f} ms")
+
+
+def main():
+    """Run all job queue tests"""
+    print("🚀 Starting Job Queue Tests\n")
+
+    try:
+        test_pipeline_passes_outputs_forward()
+        test_pipeline_runs_independent_stages_concurrently()
+        test_pipeline_validation()
+        test_pipeline_stage_failure()
+        test_batch_submission()
+        test_duration_estimator()
+        test_admission_control()
+        test_earliest_deadline_first()
+        test_shared_backend_between_api_and_worker()
+        test_lease_expiry_recovers_stuck_jobs()
+        test_job_timeout()
+        test_graceful_drain()
+        test_structured_logging()
+        test_metrics()
+        test_job_tracing()
+        test_profiling()
+        test_loop_lag_monitor()
+        test_usage_accounting()
+        test_knowledge_base_snapshot()
+        test_bm25_retrieval()
+        test_knowledge_base_hot_reload()
+        test_practice_index()
+        test_prompt_fragment_cache()
+        test_practice_classifier()
+        test_compliance_rules()
+        test_template_first_generation()
+        test_itil_generation_without_requirements()
+        test_outline_then_expand_generation()
+        test_governance_guidance_cache()
+
+        print("\n🎉 All job queue tests passed successfully!")
+        return True
+
+    except Exception as e:
+        print(f"\n❌ Test failed: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    success = main()
+    exit(0 if success else 1)
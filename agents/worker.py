@@ -0,0 +1,101 @@
+"""
+Job worker entrypoint for ProsessPortal AI Agents
+Runs agent jobs from the shared job backend, separately from the API server:
+
+    JOB_BACKEND_URL=redis://localhost:6379/0 python worker.py --processes 4 --concurrency 2
+    JOB_BACKEND_URL=redis://localhost:6379/0 JOB_QUEUE_RUN_WORKER=false python main.py
+"""
+import os
+import signal
+import logging
+import asyncio
+import argparse
+import multiprocessing
+from typing import Optional
+from dotenv import load_dotenv
+
+from services.job_backends import create_job_backend
+from services.job_queue import JobQueue
+from services.structured_logging import configure_logging
+from services.metrics import start_metrics_server
+from services.tracing import configure_tracing
+from services.loop_monitor import LoopLagMonitor
+from services.knowledge_base import KnowledgeBaseReloader
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+async def run_worker(concurrency: int, metrics_port: Optional[int] = None):
+    """Run one worker process until SIGINT/SIGTERM"""
+    configure_logging()
+    configure_tracing()
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    backend = create_job_backend()
+    if not backend.shared:
+        raise SystemExit("❌ worker.py needs a shared JOB_BACKEND_URL (sqlite:///... or redis://...)")
+
+    job_queue = JobQueue(backend=backend, concurrency=concurrency)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    loop_monitor = LoopLagMonitor()
+    if os.getenv("LOOP_LAG_MONITOR", "true").lower() == "true":
+        loop_monitor.start()
+    knowledge_reloader = KnowledgeBaseReloader()
+    knowledge_reloader.start()
+
+    logger.info("Starting job worker", extra={"worker_id": job_queue.worker_id})
+    await job_queue.initialize()
+    await stop.wait()
+
+    logger.info("Shutting down job worker", extra={"worker_id": job_queue.worker_id})
+    await job_queue.cleanup()
+    await loop_monitor.stop()
+    await knowledge_reloader.stop()
+
+
+def _worker_process(concurrency: int, metrics_port: Optional[int] = None):
+    asyncio.run(run_worker(concurrency, metrics_port))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run ProsessPortal AI agent job workers")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("JOB_WORKER_CONCURRENCY", "1")),
+                        help="jobs processed concurrently by each worker process")
+    parser.add_argument("--processes", type=int, default=1, help="number of worker processes to run")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve /metrics on this port (process N uses port + N)")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        _worker_process(args.concurrency, args.metrics_port)
+        return
+
+    processes = [
+        multiprocessing.Process(
+            target=_worker_process,
+            args=(args.concurrency, args.metrics_port + index if args.metrics_port else None),
+            name=f"job-worker-{index}"
+        )
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()